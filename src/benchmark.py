@@ -0,0 +1,197 @@
+"""
+Benchmarks of the steps of the conversion that have several implementations
+Usage : python benchmark.py path/to/height_map.png [other images...]
+        python benchmark.py --palette-engines path/to/image.png [other images...]
+        python benchmark.py --soak 1000 path/to/image.png
+"""
+import os
+import sys
+import time
+import numpy as np
+from argparse import ArgumentParser
+from typing import Callable
+from color_detection import findColorsAndMakeNewImage
+from image_loading import load_image
+from img_to_stl import ConversionJob, runConversion
+from palette_engines import palette_engine_names
+from progress import Progress
+from scratch import get_scratch_workspace
+from stl_generation import FACE_DTYPE, VERTEX_DTYPE, MeshGenerationParameters, generate_mesh, load_grayscale_image
+from mesh_simplification import simplify_height_grid
+
+def check_mesh_footprint(vertices: np.ndarray, faces: np.ndarray) -> int:
+    """Checks that a mesh is held in compact buffers : contiguous single precision vertices and 32 bit faces, that are not views
+    keeping a larger array alive. The memory used while generating the mesh is checked by tests/test_mesh_footprint.py.
+
+    Raises:
+        AssertionError: The buffers are larger than needed
+
+    Returns:
+        int: Size of the buffers, in bytes
+    """
+    assert vertices.dtype == VERTEX_DTYPE and faces.dtype == FACE_DTYPE, f"mesh buffers are {vertices.dtype} and {faces.dtype}"
+    assert vertices.flags.c_contiguous and faces.flags.c_contiguous, "mesh buffers are not contiguous"
+    for name, array in (("vertices", vertices), ("faces", faces)):
+        assert array.base is None or array.base.nbytes == array.nbytes, f"the {name} are a view on a buffer of {array.base.nbytes} bytes"
+    return vertices.nbytes + faces.nbytes
+
+def benchmark_simplifier(height_map_path: str, parameters: MeshGenerationParameters = None) -> dict:
+    """Compares the full resolution mesh with the one simplified by the in-house simplifier
+
+    Args:
+        height_map_path (str): Path to a grayscale height map
+        parameters (MeshGenerationParameters, optional): Mesh generation parameters. Defaults to the default parameters.
+
+    Returns:
+        dict: Size of both meshes (also in bytes, checked by check_mesh_footprint), time taken by each, and maximum error of the simplified mesh in mm
+    """
+    if parameters is None:
+        parameters = MeshGenerationParameters()
+    grayscale_image = load_grayscale_image(height_map_path)
+    results = {"image": height_map_path, "pixels": grayscale_image.size}
+    for simplification in ["none", "numpy"]:
+        parameters.simplification = simplification
+        start = time.perf_counter()
+        vertices, faces = generate_mesh(grayscale_image, parameters)
+        results[simplification] = {"seconds": time.perf_counter() - start, "vertices": len(vertices), "triangles": len(faces),
+                                   "bytes": check_mesh_footprint(vertices, faces)}
+    tolerance = parameters.simplificationToleranceMM * 255 / parameters.meshImageThicknessMM
+    _, _, max_error = simplify_height_grid(grayscale_image, tolerance)
+    results["numpy"]["max_error_mm"] = max_error * parameters.meshImageThicknessMM / 255
+    return results
+
+def label_agreement(reference: np.ndarray, labels: np.ndarray) -> float:
+    """Measures how much two labellings of the same pixels agree, whatever the values of their labels
+    Each label is matched with the label of the other labelling it overlaps most, in both directions, and the worst direction is kept
+
+    Args:
+        reference (np.ndarray): The label of each pixel, according to the reference
+        labels (np.ndarray): The label of each pixel, according to the other labelling
+
+    Returns:
+        float: Fraction of the pixels whose labels agree, from 0 to 1
+    """
+    _, reference = np.unique(reference, return_inverse=True)
+    _, labels = np.unique(labels, return_inverse=True)
+    overlaps = np.zeros((reference.max() + 1, labels.max() + 1), dtype=np.int64)
+    np.add.at(overlaps, (reference.ravel(), labels.ravel()), 1)
+    return min(overlaps.max(axis=1).sum(), overlaps.max(axis=0).sum()) / reference.size
+
+def benchmark_palette_engines(image_path: str, max_image_pixels: int = 1 << 24, reference: str = "ward") -> dict:
+    """Compares the palette extraction engines on an image, the labels of the reference engine being the ground truth
+
+    Args:
+        image_path (str): Path to the image
+        max_image_pixels (int, optional): The image is downscaled to this amount of pixels, as when it is converted. Defaults to 1 << 24.
+        reference (str, optional): The engine to which the others are compared. Defaults to "ward".
+
+    Returns:
+        dict: For each engine, the time taken by the color detection, the amount of colors found, and the agreement of its labels with the reference
+    """
+    img = load_image(image_path, max_image_pixels)
+    progress = Progress(callback=lambda value, message="": None, error_callback=lambda *args: None, max=100)
+    results = {"image": image_path, "pixels": img.shape[0] * img.shape[1]}
+    labels = {}
+    # The reference runs first
+    for engine in sorted(palette_engine_names(), key=lambda name: name != reference):
+        start = time.perf_counter()
+        colors, _, labels[engine], _ = findColorsAndMakeNewImage(img, progress, engine=engine)
+        results[engine] = {"seconds": time.perf_counter() - start, "colors": len(colors),
+                           "agreement": label_agreement(labels[reference], labels[engine])}
+    return results
+
+def process_resources() -> dict:
+    """Measures the resources held by this process
+
+    Returns:
+        dict: Amount of open file descriptors ("fds") and resident memory in bytes ("rss"), None when they cannot be measured
+    """
+    try:
+        import psutil
+        process = psutil.Process()
+        return {"fds": process.num_fds() if hasattr(process, "num_fds") else process.num_handles(), "rss": process.memory_info().rss}
+    except ImportError:
+        pass
+    if os.path.isdir("/proc/self/fd"):
+        with open("/proc/self/statm") as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return {"fds": len(os.listdir("/proc/self/fd")), "rss": rss}
+    return {"fds": None, "rss": None}
+
+def soak_test(image_path: str, iterations: int, parameters: MeshGenerationParameters = None, max_rss_growth_mb: float = 64,
+              report: Callable[[int, dict], None] = None) -> dict:
+    """Converts the same image many times, and checks that the resources of the process stay flat
+    The resources are measured after the first tenth of the conversions, once the caches are warm, and at the end.
+
+    Args:
+        image_path (str): Path to the image to convert
+        iterations (int): Amount of conversions
+        parameters (MeshGenerationParameters, optional): Mesh generation parameters. Defaults to the built-in simplifier, without BLEND file.
+        max_rss_growth_mb (float, optional): Allowed growth of the resident memory, in MB. Defaults to 64.
+        report (Callable[[int, dict], None], optional): Called with the number of done conversions and the resources after each of them. Defaults to None.
+
+    Returns:
+        dict: The resources at the start and at the end ("baseline" and "final", with the size of the scratch workspace as "temp"),
+              the failed conversions ("failures") and the resources that grew ("leaks", empty if the test passed)
+    """
+    if parameters is None:
+        parameters = MeshGenerationParameters(simplification="numpy", saveBlendFile=False)
+    workspace = get_scratch_workspace()
+    warm_up = max(1, iterations // 10)
+    baseline = None
+    failures = 0
+    for i in range(iterations):
+        if not runConversion(ConversionJob(image_path, meshParameters=parameters)).success:
+            failures += 1
+        resources = dict(process_resources(), temp=workspace.size())
+        if i + 1 == warm_up:
+            baseline = resources
+        if report is not None:
+            report(i + 1, resources)
+    leaks = []
+    if baseline["fds"] is not None and resources["fds"] > baseline["fds"]:
+        leaks.append(f"{resources['fds'] - baseline['fds']} file descriptors")
+    if baseline["rss"] is not None and resources["rss"] - baseline["rss"] > max_rss_growth_mb * 1024**2:
+        leaks.append(f"{(resources['rss'] - baseline['rss']) / 1024**2:.1f} MB of memory")
+    if resources["temp"] > baseline["temp"]:
+        leaks.append(f"{resources['temp'] - baseline['temp']} bytes of temporary files")
+    return {"baseline": baseline, "final": resources, "failures": failures, "leaks": leaks}
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("images", nargs="+", help="Paths to grayscale height maps, or to images to convert with --palette-engines")
+    argParser.add_argument("--palette-engines", action='store_true', help="Compare the palette extraction engines instead of the mesh simplifiers")
+    argParser.add_argument("--soak", type=int, metavar="ITERATIONS", help="Convert the first image this many times, and fail if file descriptors, memory or temporary files grow")
+    argParser.add_argument("--max-rss-growth", type=float, default=64, help="With --soak, allowed growth of the resident memory, in MB")
+    args = argParser.parse_args()
+    if args.soak:
+        def report(done, resources):
+            if done % max(1, args.soak // 20) == 0:
+                rss = "?" if resources["rss"] is None else f"{resources['rss'] / 1024**2:.1f} MB"
+                print(f"  {done:>6} conversions  {resources['fds']} fds  {rss} resident  {resources['temp']} bytes of temporary files")
+        results = soak_test(args.images[0], args.soak, max_rss_growth_mb=args.max_rss_growth, report=report)
+        if results["failures"]:
+            print(f"{results['failures']} conversions failed")
+        if results["leaks"]:
+            print("Leaks : " + ", ".join(results["leaks"]))
+        else:
+            print("No leak detected")
+        sys.exit(1 if results["leaks"] or results["failures"] else 0)
+    if args.palette_engines:
+        for image in args.images:
+            results = benchmark_palette_engines(image)
+            print(results["image"], f"({results['pixels']} pixels)")
+            for engine in palette_engine_names():
+                r = results[engine]
+                print(f"  {engine.ljust(10)} {r['seconds']:8.3f} s  {r['colors']:>4} colors  {100 * r['agreement']:6.2f} % agreement")
+        return
+    for image in args.images:
+        results = benchmark_simplifier(image)
+        print(results["image"], f"({results['pixels']} pixels)")
+        for simplification in ["none", "numpy"]:
+            r = results[simplification]
+            print(f"  {simplification.ljust(6)} {r['seconds']:8.3f} s  {r['vertices']:>10} vertices  {r['triangles']:>10} triangles  {r['bytes'] / 1e6:8.1f} MB"
+                  + (f"  max error {r['max_error_mm']:.4f} mm" if "max_error_mm" in r else ""))
+
+if __name__ == '__main__':
+    main()
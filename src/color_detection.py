@@ -1,32 +1,423 @@
-import math
+import os
 import numpy as np
 import cv2
-from scipy.cluster.hierarchy import ward, fcluster
-from scipy.spatial.distance import pdist, euclidean
-from tempfile import mkstemp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Tuple, Union
+from image_loading import MAX_INDEXED_COLORS, load_image
+from palette_engines import PaletteEngine, get_palette_engine
 from progress import Progress
+from scratch import ScratchWorkspace, get_scratch_workspace
 
-def findColorsAndMakeNewImage(imagePath: str, progress: Progress):
-    """Finds the different colors used in the image and makes a new one using only flat coloring
+# Label of the pixels that do not belong to a relevant color (yet)
+NO_LABEL = -42
+# Below this amount of pixels per process, starting worker processes takes longer than the work itself
+MIN_PIXELS_PER_PROCESS = 1 << 19
+# Positions of the 3x3 neighbourhood of a pixel (the pixel included), in the order in which its labels are compared
+NEIGHBOUR_OFFSETS = [(-1,-1), (-1,0), (-1,1), (0,-1), (0,0), (0,1), (1,-1), (1,0), (1,1)]
+# Groups together color values when the difference is less than this radius
+GROUPING_RADIUS = 16
+# Minimum amount of pixels needed for a color to be considered, as a percentage of the total amount of pixels
+MIN_COLOR_PRCT = .003
+# Any pixel that has less than this amount of neighbours of the same color will count as being isolated
+MIN_SAME_NEIGHBOURS = 4
+# Amount of pixels looked at first to tell whether an image has few exact colors
+EXACT_COLORS_SAMPLE = 4096
+
+#region ############################## Operations on strips ##############################
+
+def neighbour_labels(labels: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Lists the labels of the 3x3 neighbourhood of each pixel of a strip of rows
+    The rows just above and below the strip (halo rows) are read from the full label image
+
+    Args:
+        labels (np.ndarray): The full label image
+        start (int): First row of the strip
+        end (int): Row after the last row of the strip
+
+    Returns:
+        np.ndarray: The 9 labels around each pixel of the strip, as an array of shape (end-start, width, 9). Outside of the image, the label is NO_LABEL.
+    """
+    halo = labels[max(start-1, 0):min(end+1, labels.shape[0])]
+    top = 1 if start == 0 else 0
+    bottom = 1 if end == labels.shape[0] else 0
+    padded = cv2.copyMakeBorder(halo, top, bottom, 1, 1, cv2.BORDER_CONSTANT, None, NO_LABEL)
+    nb_rows, nb_cols = end - start, labels.shape[1]
+    return np.dstack([padded[1+dx:1+dx+nb_rows, 1+dy:1+dy+nb_cols] for dx, dy in NEIGHBOUR_OFFSETS])
+
+def assign_palette(pixels: np.ndarray, labels: np.ndarray, start: int, end: int, palette_labels: np.ndarray) -> np.ndarray:
+    """Gives to each pixel of a strip the label of its quantized color
+
+    Args:
+        pixels (np.ndarray): The quantized image, as indices of the quantized colors
+        labels (np.ndarray): The full label image (unused, the labels are not known yet)
+        start (int): First row of the strip
+        end (int): Row after the last row of the strip
+        palette_labels (np.ndarray): The label of each quantized color, or NO_LABEL
+
+    Returns:
+        np.ndarray: The labels of the strip
+    """
+    return palette_labels[pixels[start:end]]
+
+def filter_isolated(pixels: np.ndarray, labels: np.ndarray, start: int, end: int, min_same_neighbours: int) -> np.ndarray:
+    """Removes the label of the pixels of a strip that have less than min_same_neighbours pixels of the same label around them (themselves included)
+
+    Args:
+        pixels (np.ndarray): The quantized image (unused, only the labels are needed)
+        labels (np.ndarray): The full label image
+        start (int): First row of the strip
+        end (int): Row after the last row of the strip
+        min_same_neighbours (int): Minimum amount of pixels of the same label in the 3x3 neighbourhood
+
+    Returns:
+        np.ndarray: The new labels of the strip
+    """
+    strip = labels[start:end]
+    same_neighbours = (neighbour_labels(labels, start, end) == strip[:, :, None]).sum(axis=2)
+    return np.where((strip != NO_LABEL) & (same_neighbours >= min_same_neighbours), strip, NO_LABEL)
+
+def fill_from_neighbours(pixels: np.ndarray, labels: np.ndarray, start: int, end: int, color_tables: tuple) -> np.ndarray:
+    """Gives to each pixel of a strip that has no label the label of its neighbours whose mean color is the closest to its own color
+    Pixels that have no labelled neighbour are left as they are
+
+    Args:
+        pixels (np.ndarray): The quantized image, as indices of the quantized colors
+        labels (np.ndarray): The full label image
+        start (int): First row of the strip
+        end (int): Row after the last row of the strip
+        color_tables (tuple): The RGB value of each quantized color, and the mean RGB value of each label
+
+    Returns:
+        np.ndarray: The new labels of the strip
+    """
+    quantized_colors, label_means = color_tables
+    strip = labels[start:end].copy()
+    unknown = np.nonzero(strip == NO_LABEL)
+    if len(unknown[0]) == 0:
+        return strip
+    candidates = neighbour_labels(labels, start, end)[unknown]
+    is_labelled = candidates != NO_LABEL
+    distances = ((label_means[np.where(is_labelled, candidates, 0)] - quantized_colors[pixels[start:end][unknown]][:, None, :])**2).sum(axis=2)
+    # On equal distances, the first neighbour in the order of NEIGHBOUR_OFFSETS wins
+    closest = np.where(is_labelled, distances, np.inf).argmin(axis=1)
+    strip[unknown] = np.where(is_labelled.any(axis=1), candidates[np.arange(len(candidates)), closest], NO_LABEL)
+    return strip
+
+#endregion
+
+#region ############################## Strip processing ##############################
+
+def _attach(spec: tuple):
+    """Opens an array created by StripProcessor in another process
+
+    Args:
+        spec (tuple): Name of the shared memory block, shape and dtype of the array
+
+    Returns:
+        (SharedMemory, np.ndarray): The shared memory block, which must be closed after use, and the array using it
+    """
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _run_on_strip(operation: Callable, start: int, end: int, pixels_spec: tuple, labels_spec: tuple, result_spec: tuple, argument: Any) -> None:
+    """Runs an operation on a strip in a worker process, reading and writing the arrays in shared memory"""
+    blocks, arrays = zip(*[_attach(spec) for spec in (pixels_spec, labels_spec, result_spec)])
+    try:
+        pixels, labels, result = arrays
+        result[start:end] = operation(pixels, labels, start, end, argument)
+    finally:
+        # The arrays must be released before the shared memory can be closed
+        del pixels, labels, result, arrays
+        for block in blocks:
+            block.close()
+
+class StripProcessor:
+    """
+    Runs operations on horizontal strips of an image, across several processes when the image is large enough
+    The quantized image and the labels live in shared memory, so the worker processes do not copy them:
+    each strip reads the labels of the previous step (including the halo rows of its neighbours) and writes its new labels in a second buffer.
+    """
+    def __init__(self, pixels: np.ndarray, workers: int = None):
+        """
+        Args:
+            pixels (np.ndarray): The quantized image, as indices of the quantized colors
+            workers (int, optional): Maximum amount of processes to use. Defaults to the amount of CPUs.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, pixels.size // MIN_PIXELS_PER_PROCESS, pixels.shape[0]))
+        self.blocks = []
+        self.pool = None
+        if workers > 1:
+            self.pixels, self.pixels_spec = self._shared_copy(pixels)
+            self.labels, self.labels_spec = self._shared_copy(np.full(pixels.shape, NO_LABEL, dtype=np.int32))
+            self.result, self.result_spec = self._shared_copy(self.labels)
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.pixels = pixels
+            self.labels = np.full(pixels.shape, NO_LABEL, dtype=np.int32)
+            self.result = np.empty_like(self.labels)
+        bounds = np.linspace(0, pixels.shape[0], workers + 1).astype(int)
+        self.strips = list(zip(bounds[:-1], bounds[1:]))
+
+    def _shared_copy(self, array: np.ndarray) -> tuple:
+        """Copies an array to a new block of shared memory
+
+        Returns:
+            (np.ndarray, tuple): The copy, and its description used by the worker processes to open it
+        """
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        return shared, (block.name, array.shape, array.dtype.str)
+
+    def run(self, operation: Callable, argument: Any) -> np.ndarray:
+        """Applies an operation to every strip
+
+        Args:
+            operation (Callable): One of the operations on strips, such as filter_isolated
+            argument (Any): Last argument of the operation
+
+        Returns:
+            np.ndarray: The new labels
+        """
+        if self.pool is None:
+            for start, end in self.strips:
+                self.result[start:end] = operation(self.pixels, self.labels, start, end, argument)
+        else:
+            futures = [self.pool.submit(_run_on_strip, operation, start, end, self.pixels_spec, self.labels_spec, self.result_spec, argument)
+                       for start, end in self.strips]
+            for future in futures:
+                future.result()
+            self.labels_spec, self.result_spec = self.result_spec, self.labels_spec
+        # The new labels are the input of the next operation
+        self.labels, self.result = self.result, self.labels
+        return self.labels
+
+    def close(self) -> None:
+        """Stops the worker processes and frees the shared memory"""
+        if self.pool is not None:
+            self.pool.shutdown()
+        # The arrays must be released before the shared memory can be closed
+        self.pixels = self.labels = self.result = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#endregion
+
+def write_flat_image(image: np.ndarray, workspace: ScratchWorkspace = None) -> str:
+    """Writes a flat colored image to a temporary PNG file
+
+    Args:
+        image (np.ndarray): The image, as an RGB array
+        workspace (ScratchWorkspace, optional): Where the file is written. Defaults to the workspace of the process.
+
+    Returns:
+        str: Path to the file
+    """
+    image_path = (workspace or get_scratch_workspace()).new_file(suffix=".png")
+    cv2.imwrite(image_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return image_path
+
+def quantize_image(img: np.ndarray, grouping_radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces the amount of colors of an image by grouping very similar colors
+    For example, with a radius of 16, any value between 0 and 15 becomes 8, any value between 16 and 31 becomes 24, etc.
+
+    Args:
+        img (np.ndarray): The image, as an RGB array
+        grouping_radius (int): Size of the groups of values of each channel
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Each pixel as the index of its quantized color, ordered by red, then green, then blue,
+            and the RGB value of every quantized color
+    """
+    levels = -(-256 // grouping_radius)
+    quantized = img // grouping_radius
+    pixels = ((quantized[:, :, 0].astype(np.uint16) * levels + quantized[:, :, 1]) * levels + quantized[:, :, 2])
+    quantized_colors = np.stack(np.unravel_index(np.arange(levels**3), (levels, levels, levels)), axis=1) * grouping_radius + grouping_radius // 2
+    return pixels, quantized_colors
+
+def hex_to_rgb(colors: List[str]) -> np.ndarray:
+    """Converts hex representations of colors (such as '#ff8000') to an array of RGB values
+
+    Args:
+        colors (List[str]): The hex representations of the colors
+
+    Returns:
+        np.ndarray: The RGB values, as an array of uint8 of shape (len(colors), 3)
+    """
+    return np.array([[int(c[i:i+2], 16) for i in (1, 3, 5)] for c in colors], dtype=np.uint8).reshape(-1, 3)
+
+def nearest_palette_colors(colors: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Finds the closest color of a palette for each color
+
+    Args:
+        colors (np.ndarray): RGB values of shape (n, 3)
+        palette (np.ndarray): RGB values of the palette, of shape (k, 3)
+
+    Returns:
+        np.ndarray: The index in the palette of the closest color, for each color
+    """
+    distances = ((colors[:, None, :].astype(np.int32) - palette[None, :, :].astype(np.int32))**2).sum(axis=2)
+    return distances.argmin(axis=1).astype(np.int32)
+
+def label_pixels(pixels: np.ndarray, palette_labels: np.ndarray, pixel_colors: np.ndarray, label_means: np.ndarray, default_label: int,
+                 progress: Progress, workers: int = None) -> np.ndarray:
+    """Gives a label to every pixel : the label of its color when it has one, otherwise the label of the neighbour whose color is the closest
+    Isolated pixels also take the label of their neighbours, so that noise and anti-aliasing do not make specks.
+
+    Args:
+        pixels (np.ndarray): The image, as indices of its colors
+        palette_labels (np.ndarray): The label of each color, or NO_LABEL
+        pixel_colors (np.ndarray): The RGB value of each color
+        label_means (np.ndarray): The RGB value of each label
+        default_label (int): The label of the pixels that have no labelled pixel around them at all
+        progress (Progress): Object used to notify the program when progress is made, from 50 to 100 %
+        workers (int, optional): Maximum amount of processes used. Defaults to the amount of CPUs.
+
+    Returns:
+        np.ndarray: The label of each pixel, flattened
+    """
+    with StripProcessor(pixels, workers) as processor:
+        # We apply the results to every pixel in the image
+        pixel_labels = processor.run(assign_palette, palette_labels)
+    
+        # In the following loop, we will classify the pixels that don't have a label yet
+        nbIter = 0
+        nbUnknown = np.count_nonzero(pixel_labels == NO_LABEL)
+        while nbUnknown > 0:
+            progress.check_cancelled()
+            # The first iteration will invalidate the labels of pixels that seem to be isolated (less than MIN_SAME_NEIGHBOURS neighbours of the same label)
+            if nbIter == 0:
+                pixel_labels = processor.run(filter_isolated, MIN_SAME_NEIGHBOURS)
+            # The next steps will, for each pixel of unknown label, choose the label with the closest color, among the neighbours' labels
+            else:
+                pixel_labels = processor.run(fill_from_neighbours, (pixel_colors, label_means))
+                if np.count_nonzero(pixel_labels == NO_LABEL) == nbUnknown:
+                    # No pixel has a labelled neighbour anymore (every label was isolated) : the remaining ones take the most common color
+                    pixel_labels[pixel_labels == NO_LABEL] = default_label
+            nbUnknown = np.count_nonzero(pixel_labels == NO_LABEL)
+    
+            nbIter += 1
+            # Remaining progress is divided by 2 each iteration
+            progress.update_progress(int(100-50/(2**nbIter)))
+        return pixel_labels.ravel().copy()
+
+def exact_color_labels(img: np.ndarray, max_colors: int = MAX_INDEXED_COLORS) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Labels the pixels of an image that has only a few exact colors, such as a clean export of a drawing tool
+    A sample of the pixels is looked at first, so that images with many colors are rejected almost immediately.
 
     Args:
-        imagePath (string): The path to the image to analyze
+        img (np.ndarray): The image, as an RGB array
+        max_colors (int, optional): Images with more colors are rejected. Defaults to MAX_INDEXED_COLORS.
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray]]: The index of the color of each pixel, as a 2D array, and the RGB value of each color.
+            None if the image has more than max_colors colors.
+    """
+    # Each pixel as a single integer, red in the lowest byte. OpenCV adds the alpha channel faster than numpy can shift the channels.
+    packed = cv2.cvtColor(img, cv2.COLOR_RGB2RGBA).view("<u4")[:, :, 0]
+    flat = packed.ravel()
+    colors = np.unique(flat[::max(1, flat.size // EXACT_COLORS_SAMPLE)])
+    if len(colors) > max_colors:
+        return None
+    # The colors missing from the sample, if any
+    labels = np.minimum(np.searchsorted(colors, packed), len(colors) - 1)
+    missing = colors[labels] != packed
+    if missing.any():
+        colors = np.union1d(colors, packed[missing])
+        if len(colors) > max_colors:
+            return None
+        labels = np.searchsorted(colors, packed)
+    rgb = np.stack([colors & 0xff, (colors >> 8) & 0xff, (colors >> 16) & 0xff], axis=1).astype(np.uint8)
+    return labels.astype(np.uint8), rgb
+
+def label_indexed_image(labels: np.ndarray, colors: np.ndarray, progress: Progress, workers: int = None, workspace: ScratchWorkspace = None,
+                        palette: List[str] = None):
+    """Makes the results of the color detection for an image whose exact colors are known : nothing is clustered
+    When every color covers enough of the image, the labels are the colors themselves. Otherwise, the rare colors, such as the shades
+    of anti-aliased edges, take the label of their neighbours, as in the color detection.
+
+    Args:
+        labels (np.ndarray): The index of the color of each pixel, as a 2D array of uint8
+        colors (np.ndarray): The RGB value of each color, at most 256
+        progress (Progress): Object used to notify the program when progress is made
+        workers (int, optional): Maximum amount of processes used to label the pixels of rare colors. Defaults to the amount of CPUs.
+        workspace (ScratchWorkspace, optional): Where the flat image is written. Defaults to the workspace of the process.
+        palette (List[str], optional): Hex representation of the colors shared by a series of images : each color becomes the closest one. Defaults to None.
+
+    Returns:
+        The same results as findColorsAndMakeNewImage
+    """
+    progress.update_progress(0, "Listing the different colors")
+    if palette is not None:
+        flat_colors = hex_to_rgb(palette)
+        color_labels = nearest_palette_colors(colors, flat_colors)
+        color_hexes = list(palette)
+    else:
+        # The most common color first, as for the detected colors
+        counts = cv2.calcHist([labels], [0], None, [256], [0, 256]).ravel()[:len(colors)]
+        order = np.argsort(-counts, kind="stable")
+        relevant = order[counts[order] > labels.size * MIN_COLOR_PRCT]
+        # The most common color is always kept, so that every pixel can get a label
+        relevant = relevant if len(relevant) else order[:1]
+        color_labels = np.full(len(colors), NO_LABEL, dtype=np.int32)
+        color_labels[relevant] = np.arange(len(relevant))
+        flat_colors = colors[relevant]
+        color_hexes = ['#%02x%02x%02x' % (r, g, b) for [r,g,b] in flat_colors]
+    
+    progress.update_progress(50, "Generating flat colored image")
+    progress.check_cancelled()
+    if (color_labels == NO_LABEL).any():
+        pixel_list_labels = label_pixels(labels, color_labels, colors.astype(np.int32), flat_colors.astype(np.int32), 0, progress, workers)
+        progress.check_cancelled()
+        image_path = write_flat_image(flat_colors.astype(np.uint8)[pixel_list_labels].reshape(*labels.shape, 3), workspace)
+    else:
+        # Lookup tables of OpenCV, from the index of each pixel to its label and to its color
+        label_table = np.zeros(256, dtype=np.int32)
+        label_table[:len(colors)] = color_labels
+        color_table = np.zeros((256, 1, 3), dtype=np.uint8)
+        color_table[:len(colors), 0] = flat_colors[color_labels]
+        pixel_list_labels = label_table[labels.ravel()] if len(color_hexes) > 256 else cv2.LUT(labels, label_table.astype(np.uint8)).ravel().astype(np.int32)
+        image_path = write_flat_image(cv2.LUT(cv2.merge([labels] * 3), color_table), workspace)
+    progress.update_progress(100)
+    return color_hexes, image_path, pixel_list_labels, {i: i for i in range(len(color_hexes))}
 
+def findColorsAndMakeNewImage(image: Union[str, np.ndarray], progress: Progress, workers: int = None, engine: Union[str, PaletteEngine] = None,
+                              workspace: ScratchWorkspace = None, palette: List[str] = None):
+    """Finds the different colors used in the image and makes a new one using only flat coloring
+    
+    Args:
+        image (Union[str, np.ndarray]): The path to the image to analyze, or the image itself as an RGB array
+        progress (Progress): Object used to notify the program when progress is made. Its cancellation token is checked regularly.
+        workers (int, optional): Maximum amount of processes used to label the pixels. Defaults to the amount of CPUs.
+        engine (Union[str, PaletteEngine], optional): The engine that groups the colors, or its name (see palette_engines). Defaults to Ward clustering.
+        workspace (ScratchWorkspace, optional): Where the flat image is written. It must be released from it once not needed anymore. Defaults to the workspace of the process.
+        palette (List[str], optional): Hex representation of the colors to use, shared by a series of images. The colors are not detected:
+            each pixel takes the closest color of the palette, and the colors are returned in the order of the palette. Defaults to None.
+    
     Returns:
-        (list(string), string, list(int), dict(int, int)): the hex representations of the colors, the path to the flat image, the list of labels
-        to which belongs each pixel and the dictionnary that relates a label to the list of hex representations of the colors
+        (list(string), string, np.ndarray, dict(int, int)): the hex representations of the colors, the path to the flat image, the label
+        to which belongs each pixel (flattened) and the dictionnary that relates a label to the list of hex representations of the colors
     """
     
     ## Parameters that could become arguments
     
     # Groups together color values when the difference is less than this radius
-    grouping_radius = 16
-    # Distance used for Ward clustering
-    distance_min_squared = 100
+    grouping_radius = GROUPING_RADIUS
     # Minimum amount of pixels needed for a color to be considered, as a percentage of the total amount of pixels
-    min_color_prct = .003
-    # Any pixel that has less than this amount of neighbours of the same color will count as being isolated
-    min_same_neighbours = 4
+    min_color_prct = MIN_COLOR_PRCT
     
     
     ## Part 1 : finding the different colors
@@ -34,55 +425,47 @@ def findColorsAndMakeNewImage(imagePath: str, progress: Progress):
     # Start the progress bar
     progress.update_progress(0, "Listing the different colors")
     
-    # Reads the image and converts to RGB
-    img = cv2.cvtColor(cv2.imread(imagePath), cv2.COLOR_BGR2RGB)
+    # Reads the image as RGB
+    img = load_image(image) if isinstance(image, str) else image
     
-    # Reduction of the amount of colors by grouping very similar colors
-    # For example, any value between 0 and 15 becomes 8, any valeu between 16 and 31 becomes 24, etc.
-    img = img // grouping_radius * grouping_radius + grouping_radius // 2
+    # Images that only have a few exact colors are labelled straight from them
+    exact = exact_color_labels(img)
+    if exact is not None:
+        return label_indexed_image(*exact, progress, workers, workspace, palette)
     
-    # Flattened list of the pixel values
-    pixel_list = np.reshape(img, [img.shape[0]*img.shape[1], 3])
+    # Reduction of the amount of colors by grouping very similar colors
+    pixels, quantized_colors = quantize_image(img, grouping_radius)
     
     # Lists all unique colors
-    color_list, cl_index, cl_inverse, cl_count = np.unique(pixel_list, axis=0, return_index=True, return_inverse=True, return_counts=True)
-
-    # Makes a small sample of colors by imitating the color rations in the original image. It has all unique colors.
-    color_list_duplicates = color_list
-    for x, c in zip(color_list, cl_count):
-        for i in range(max(1, math.floor(100*c/(img.shape[0]*img.shape[1])))):
-            color_list_duplicates = np.append(color_list_duplicates, [x], axis=0)
-                
-    # Ward clustering
-    y = pdist(color_list_duplicates)
-    Z = ward(y)
-    labels = fcluster(Z, distance_min_squared, criterion='distance')
+    cl_count = np.bincount(pixels.ravel(), minlength=len(quantized_colors))
+    color_codes = np.flatnonzero(cl_count)
+    color_list, cl_count = quantized_colors[color_codes], cl_count[color_codes]
+    
+    if palette is not None:
+        return label_with_palette(img, pixels, quantized_colors, color_codes, color_list, palette, progress, workers, workspace)
+    
+    # Groups the quantized colors into the colors of the palette
+    color_labels = get_palette_engine(engine).cluster(color_list, cl_count, img)
     
     # We get to this point pretty fast
     progress.update_progress(5)
+    progress.check_cancelled()
     
     # processes color means for each class
-    unique_labels = np.unique(labels)
-    sums = [[0,0,0] for _ in unique_labels]
-    counts = [0 for _ in unique_labels]
-    color_to_label = {(x,y,z):label for label,[x,y,z] in zip(labels[0:len(color_list)], color_list)}
-    color_to_label_idx = {(x,y,z):label-min(unique_labels) for label,[x,y,z] in zip(labels[0:len(color_list)], color_list)}
-    def temp_fn(c):
-        x,y,z = c
-        label = color_to_label_idx[(x, y, z)]
-        counts[label] += 1
-        sums[label] = [x+y for x,y in zip(sums[label], c)]
-        
-    any(temp_fn(c) for c in pixel_list)
-    means = [[int(round(x/c)) for x in s] for s,c in zip(sums, counts)]
-    
-    # The means is the most intensive step of this first part
+    unique_labels = np.unique(color_labels)
+    counts = np.bincount(color_labels, weights=cl_count, minlength=unique_labels.max()+1)
+    sums = np.stack([np.bincount(color_labels, weights=cl_count*color_list[:, i], minlength=unique_labels.max()+1) for i in range(3)], axis=1)
+    means = [[int(round(x/c)) for x in s] for s, c in zip(sums[unique_labels], counts[unique_labels])]
+    counts = [int(c) for c in counts[unique_labels]]
+    
     progress.update_progress(45)
     
     # Filters classes that appear in at least 0.3% of the image
     # They are sorted from most to least pixels (helps automatic height selection : the most common color is lowest)
     counts_labels_and_colors = sorted(list(zip(counts, unique_labels, means)), reverse=True)
     relevant_labels = [l for c,l,_ in counts_labels_and_colors if c > img.shape[0] * img.shape[1] * min_color_prct]
+    # The most common color is always kept, so that every pixel can get a label
+    relevant_labels = relevant_labels or [counts_labels_and_colors[0][1]]
     relevant_colors = [c for _,l,c in counts_labels_and_colors if l in relevant_labels]
     relevant_label_to_mean = {l:c for l,c in zip(relevant_labels, relevant_colors)}
     
@@ -96,61 +479,58 @@ def findColorsAndMakeNewImage(imagePath: str, progress: Progress):
     ## Part 2 : making the new image
     
     progress.update_progress(50, "Generating flat colored image")
-
-    # For each unique color in the image, associate a label from relevant_labels, or a default value
-    no_label = -42
-    def get_closest_label(c):
-        [r,g,b] = c
-        orig_label = color_to_label[(r,g,b)]
-        if orig_label in relevant_labels:
-            return orig_label
-        else:
-            return no_label
-    # The results are precomputed for performance reasons
-    color_to_relevant_label = {(r,g,b):get_closest_label([r,g,b]) for [r,g,b] in color_list}
-    # We apply the results to every pixel in the image
-    pixel_list_labels = [color_to_relevant_label[(r,g,b)] for [r,g,b] in pixel_list]
-        
-    # In the following loop, we will classify the pixels that don't have a label yet
-    nbIter = 0
-    pixel_list_2 = pixel_list
-    while any(l for l in pixel_list_labels if l == no_label):
-        # This first step will make 9 clones of the "image" (with labels instead of pixels), slightly shifted
-        img_labels = np.reshape(pixel_list_labels, [img.shape[0],img.shape[1]])
-        img_border = cv2.copyMakeBorder(img_labels, 1, 1, 1, 1, cv2.BORDER_CONSTANT, None, no_label)
-        img_labels_shift = [img_border[1+shiftx:img_border.shape[0]-1+shiftx, 1+shifty:img_border.shape[1]-1+shifty] for (shiftx, shifty) in [(-1,-1), (-1,0), (-1,1), (0,-1), (0,0), (0,1), (1,-1), (1,0), (1,1)]]
-        # The 9 clones are aggregated to make a single 3D array : each 2D "pixel" has a list of 9 labels (his own, plus the labels of its 8 neighbours)
-        img_labels_shift_stack = np.dstack(img_labels_shift)
-        # We convert this array into a list for easier handling
-        pixel_possible_labels_list = np.reshape(img_labels_shift_stack, [img.shape[0]*img.shape[1], 9])
-
-        # The first iteration will invalidate the labels of pixels that seem to be isolated (less than min_same_neighbours neighbours of the same label)
-        if nbIter == 0:
-            pixel_list_labels = [(label if (label != no_label and sum(1 for pl in possible_labels if pl == label) >= min_same_neighbours)
-                                else no_label)
-                        for label, possible_labels in zip(pixel_list_labels, pixel_possible_labels_list)]
-        # The next steps will, for each pixel of unknown label, choose the label with the closest color, among the neighbours' labels
-        else:
-            pixel_list_labels = [(label if label != no_label
-                        else (no_label if not any(pl for pl in possible_labels if pl != no_label)
-                        else min([(pl, relevant_label_to_mean[pl]) for pl in possible_labels if pl != no_label], key=lambda labAndMean: euclidean(pixel, labAndMean[1]))[0]))
-                        for pixel, label, possible_labels in zip(pixel_list, pixel_list_labels, pixel_possible_labels_list)]
-
-        nbIter += 1
-        # Remaining progress is divided by 2 each iteration
-        progress.update_progress(int(100-50/(2**nbIter)))
+    
+    # For each quantized color in the image, associate a label from relevant_labels, or NO_LABEL
+    palette_labels = np.full(len(quantized_colors), NO_LABEL, dtype=np.int32)
+    palette_labels[color_codes] = np.where(np.isin(color_labels, relevant_labels), color_labels, NO_LABEL)
+    label_means = np.zeros((unique_labels.max()+1, 3))
+    for l, c in relevant_label_to_mean.items():
+        label_means[l] = c
+    
+    pixel_list_labels = label_pixels(pixels, palette_labels, quantized_colors, label_means, relevant_labels[0], progress, workers)
     
     # Once all pixels have a label, we rebuild the image
-    pixel_list_2 = [relevant_label_to_mean[label] for label in pixel_list_labels]
-    img_2 = np.reshape(pixel_list_2, img.shape).astype(np.uint8)
+    progress.check_cancelled()
+    img_2 = label_means.astype(np.uint8)[pixel_list_labels].reshape(img.shape)
     
     # Writes the image to a temporary location
-    _, image_path = mkstemp(suffix=".png")
-    img_2_bgr = cv2.cvtColor(img_2, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(image_path, img_2_bgr)
+    image_path = write_flat_image(img_2, workspace)
     
     # We are done
     progress.update_progress(100)
     
     return color_hexes, image_path, pixel_list_labels, relevant_label_to_idx_color_hexes
-    
\ No newline at end of file
+
+
+def label_with_palette(img: np.ndarray, pixels: np.ndarray, quantized_colors: np.ndarray, color_codes: np.ndarray, color_list: np.ndarray,
+                       palette: List[str], progress: Progress, workers: int = None, workspace: ScratchWorkspace = None):
+    """Makes the flat image of an image whose colors are known : each quantized color takes the closest color of the palette
+    Unlike the color detection, nothing depends on the other images of the series, so that a color has the same index on every image
+
+    Args:
+        img (np.ndarray): The image, as an RGB array
+        pixels (np.ndarray): The quantized image, as indices of the quantized colors
+        quantized_colors (np.ndarray): The RGB value of each quantized color
+        color_codes (np.ndarray): The quantized colors present in the image
+        color_list (np.ndarray): The RGB value of these colors
+        palette (List[str]): Hex representation of the colors of the palette
+        progress (Progress): Object used to notify the program when progress is made
+        workers (int, optional): Maximum amount of processes used to label the pixels. Defaults to the amount of CPUs.
+        workspace (ScratchWorkspace, optional): Where the flat image is written. Defaults to the workspace of the process.
+
+    Returns:
+        The same results as findColorsAndMakeNewImage, the labels being the indices of the colors in the palette
+    """
+    palette_rgb = hex_to_rgb(palette)
+    progress.update_progress(50, "Generating flat colored image")
+    palette_labels = np.zeros(len(quantized_colors), dtype=np.int32)
+    palette_labels[color_codes] = nearest_palette_colors(color_list, palette_rgb)
+    progress.check_cancelled()
+    with StripProcessor(pixels, workers) as processor:
+        pixel_list_labels = processor.run(assign_palette, palette_labels).ravel().copy()
+    
+    progress.check_cancelled()
+    img_2 = palette_rgb[pixel_list_labels].reshape(img.shape)
+    image_path = write_flat_image(img_2, workspace)
+    progress.update_progress(100)
+    return list(palette), image_path, pixel_list_labels, {i: i for i in range(len(palette))}
@@ -1,47 +1,24 @@
-import math
 import numpy as np
-import cv2
-from tempfile import mkstemp
 from color_types import ColorDefinition
 from typing import List
-from typing import Dict
 
-def generateGreyScaleImage(imagePath, colors: List[ColorDefinition], pixelListLabels : List[int], labelsToColorIndices : Dict[int, int]) -> str:
-    """Generates a grey scale image based on the results of the classification and the user parameters
+def generateHeightMap(colorIndexImage: np.ndarray, colors: List[ColorDefinition]) -> np.ndarray:
+    """Generates a grey scale height map from the color index of each pixel and the user parameters
+    The lowest color is black and the highest one is white
 
     Args:
-        imagePath (string): The path to the original image
-        colors (List[colors]): The list of different colors that exist in the image and their parameters value
-        pixelListLabels(List[int]): The list of the color labels the pixels of the image correspond to
-        labelsToColorIndices(Dict[int, int]): The dictionnary that relates the labels to the indices of the colors list.
+        colorIndexImage (np.ndarray): The index, in the colors list, of the color of each pixel, as a 2D array
+        colors (List[ColorDefinition]): The list of different colors that exist in the image and their parameters value
+
     Returns:
-        outputImagePath(str): The path towards the grey scale image
-        grayscaleImgReso(tuple(int, int, int)): The shape of the image (rows, columns, channels)
+        np.ndarray: The height map, as a 2D array of grey levels
     """
-        
     # ## Part 1 : computing the grey scale step to which correspond 1 unit of parameter value
-    step = 0
-    upperLimit = -100000
-    lowerLimit = 1000000
-    for c in colors:
-        upperLimit = max(upperLimit, c.colorHeight)
-        lowerLimit = min(lowerLimit, c.colorHeight)
-    step = 255/(upperLimit - lowerLimit)
-
-    # ## Part 2 : modifying the image
-    # # Reads the image and converts to RGB
-    img = cv2.cvtColor(cv2.imread(imagePath), cv2.COLOR_BGR2RGB)
-    # # Flattened list of the pixel values
-    pixel_list = np.reshape(img, [img.shape[0]*img.shape[1], 3])
+    heights = np.array([c.colorHeight for c in colors], dtype=np.float64)
+    upperLimit = heights.max()
+    lowerLimit = heights.min()
+    step = 255/(upperLimit - lowerLimit) if upperLimit > lowerLimit else 0
 
-    # # Change the RGB values to grayscale values
-    for i in range(min(len(pixel_list), len(pixelListLabels))):
-        greyScaleValue = math.floor(colors[labelsToColorIndices[pixelListLabels[i]]].colorHeight * step)
-        pixel_list[i] = (greyScaleValue, greyScaleValue, greyScaleValue)
-    
-    # # Save the resulting image
-    img_2 = np.reshape(pixel_list, img.shape).astype(np.uint8)
-    img_2_bgr = cv2.cvtColor(img_2, cv2.COLOR_RGB2BGR)
-    _, outputImagePath = mkstemp(suffix=".png")
-    cv2.imwrite(outputImagePath, img_2_bgr)
-    return outputImagePath
\ No newline at end of file
+    # ## Part 2 : applying the grey level of each color to its pixels
+    lut = np.floor((heights - lowerLimit) * step).astype(np.uint8)
+    return lut[colorIndexImage]
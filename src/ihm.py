@@ -3,9 +3,11 @@ from wx.lib.expando import ExpandoTextCtrl
 from pubsub import pub
 import threading
 from color_types import ColorDefinition
-from progress import Progress
+from progress import Progress, CancellationToken
 import os
 from img_to_stl import ImgToStl
+from color_detection import hex_to_rgb
+from preview import HeightPreview, ThumbnailPyramid
 
 class LabeledControlHelper(object):
     """ Represents a Labeled Control, inspierd by the NVDA implementation.
@@ -37,6 +39,132 @@ class LabeledControlHelper(object):
         lch = LabeledControlHelper(parent, labelText, wxCtrlClass, orientation, noLabel, **kwargs)
         return  lch.control, lch.sizer
 
+class ColorListCtrl(wx.ListCtrl):
+    """
+    List of the colors of the image and of their heights
+    It is a virtual list : only the visible rows are drawn, so it is as fast to fill with a thousand colors as with three.
+    Heights are edited in place (Enter, F2 or double click), or changed by one step with the + and - keys.
+    """
+    SWATCH_SIZE = 16
+    
+    def __init__(self, parent: wx.Window, onHeightsChanged, maxHeight: int = 100, **kwargs):
+        """Constructor for the list
+
+        Args:
+            parent (wx.Window): The parent window
+            onHeightsChanged (Callable[[], None]): Called when a height is changed by the user
+            maxHeight (int, optional): The highest height that can be selected. Defaults to 100.
+        """
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL | wx.LC_HRULES, name="Colors", **kwargs)
+        self.onHeightsChanged = onHeightsChanged
+        self.maxHeight = maxHeight
+        self.colors = []
+        self.heights = []
+        self.editor = None
+        self.editedItem = None
+        # Swatches are only made for the rows that are displayed, when they are first displayed
+        self.swatches = wx.ImageList(self.SWATCH_SIZE, self.SWATCH_SIZE)
+        self.swatchIndex = {}
+        self.SetImageList(self.swatches, wx.IMAGE_LIST_SMALL)
+        self.AppendColumn("Color", width=110)
+        self.AppendColumn("Height", format=wx.LIST_FORMAT_RIGHT, width=70)
+        self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, lambda event: self.startEditing(event.GetIndex()))
+        self.Bind(wx.EVT_KEY_DOWN, self.onKeyDown)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.onMouseWheel)
+        
+    def setColors(self, colors):
+        """Replaces the content of the list. The heights are reset to the rank of each color.
+
+        Args:
+            colors (List[str]): Hex representation of the colors
+        """
+        self.stopEditing(commit=False)
+        self.colors = list(colors)
+        self.heights = list(range(len(self.colors)))
+        self.swatches.RemoveAll()
+        self.swatchIndex = {}
+        self.SetItemCount(len(self.colors))
+        self.Refresh()
+        
+    def OnGetItemText(self, item, column):
+        return self.colors[item] if column == 0 else str(self.heights[item])
+    
+    def OnGetItemImage(self, item):
+        color = self.colors[item]
+        if color not in self.swatchIndex:
+            bitmap = wx.Bitmap(self.SWATCH_SIZE, self.SWATCH_SIZE)
+            dc = wx.MemoryDC(bitmap)
+            dc.SetBackground(wx.Brush(wx.Colour(color)))
+            dc.Clear()
+            dc.SelectObject(wx.NullBitmap)
+            self.swatchIndex[color] = self.swatches.Add(bitmap)
+        return self.swatchIndex[color]
+    
+    def OnGetItemAttr(self, item):
+        return None
+        
+    def setHeight(self, item: int, height: int):
+        """Changes the height of a color, and notifies the window if it changed"""
+        height = max(0, min(self.maxHeight, int(height)))
+        if height != self.heights[item]:
+            self.heights[item] = height
+            self.RefreshItem(item)
+            self.onHeightsChanged()
+        
+    def startEditing(self, item: int):
+        """Shows a spin control over the height of a color"""
+        self.stopEditing(commit=True)
+        if item < 0 or item >= len(self.colors):
+            return
+        self.EnsureVisible(item)
+        rect = self.GetSubItemRect(item, 1)
+        self.editor = wx.SpinCtrl(self, value=str(self.heights[item]), pos=rect.GetPosition(), size=rect.GetSize(),
+                                  min=0, max=self.maxHeight, style=wx.TE_PROCESS_ENTER | wx.SP_ARROW_KEYS, name=f"Height for color {item+1}")
+        self.editedItem = item
+        self.editor.Bind(wx.EVT_TEXT_ENTER, lambda event: self.stopEditing(commit=True))
+        self.editor.Bind(wx.EVT_KILL_FOCUS, self.onEditorKillFocus)
+        self.editor.Bind(wx.EVT_CHAR_HOOK, self.onEditorKey)
+        self.editor.SetFocus()
+        
+    def stopEditing(self, commit: bool):
+        """Removes the spin control, keeping its value if commit is True"""
+        editor, self.editor = self.editor, None
+        if editor is None:
+            return
+        if commit:
+            self.setHeight(self.editedItem, editor.GetValue())
+        # The control may be the one handling the current event : it is destroyed afterwards
+        editor.Hide()
+        wx.CallAfter(editor.Destroy)
+        self.SetFocus()
+        
+    def onEditorKillFocus(self, event):
+        self.stopEditing(commit=True)
+        event.Skip()
+        
+    def onEditorKey(self, event):
+        if event.GetKeyCode() == wx.WXK_ESCAPE:
+            self.stopEditing(commit=False)
+        else:
+            event.Skip()
+        
+    def onKeyDown(self, event):
+        item = self.GetFirstSelected()
+        key = event.GetKeyCode()
+        if item >= 0 and key == wx.WXK_F2:
+            self.startEditing(item)
+        elif item >= 0 and key in (ord('+'), wx.WXK_ADD, wx.WXK_NUMPAD_ADD):
+            self.setHeight(item, self.heights[item] + 1)
+        elif item >= 0 and key in (ord('-'), wx.WXK_SUBTRACT, wx.WXK_NUMPAD_SUBTRACT):
+            self.setHeight(item, self.heights[item] - 1)
+        else:
+            event.Skip()
+            
+    def onMouseWheel(self, event):
+        # The spin control does not follow the rows when the list scrolls
+        self.stopEditing(commit=True)
+        event.Skip()
+
 class MainWindow(wx.Frame):
     """The main window of the application"""
     def __init__(self, parent, title, args):
@@ -51,7 +179,11 @@ class MainWindow(wx.Frame):
         self.minimum_step_btw_highest_lowest_points = 1.0 # The minimum step of height between the highest point of the object and the lowest point of the top surface.
 
         self.img_to_stl = ImgToStl()
-        self.progress = Progress(max=100, callback=MainWindow.callUpdateProgress, error_callback=self.callErrorMessageBox)
+        self.heightPreview = None
+        self.thumbnailPyramid = None
+        self.progress = self.makeProgress()
+        # Cancellation token of the speculative work done after each load
+        self.speculationToken = CancellationToken()
 
         self.initUI()
         self.Centre()
@@ -115,10 +247,10 @@ class MainWindow(wx.Frame):
         
         #################### Colors ####################
         
-        self.colorSizer = wx.FlexGridSizer(cols=3, vgap=4, hgap=10)
+        self.colorList = ColorListCtrl(panel, onHeightsChanged=self.updateHeightPreview, size=(200, 160))
         
         colorGroupSizer = wx.StaticBoxSizer(wx.VERTICAL, panel, "Colors")
-        colorGroupSizer.Add(self.colorSizer, flag=wx.ALL, border=4)
+        colorGroupSizer.Add(self.colorList, proportion=1, flag=wx.ALL | wx.EXPAND, border=4)
         sizer.Add(colorGroupSizer, pos=(1, 0), flag=wx.EXPAND)
         
         #################### Dimensions (mm) ####################
@@ -135,6 +267,8 @@ class MainWindow(wx.Frame):
         self.heightSpinner.Bind(wx.EVT_SPINCTRL,self.onHeightChanged)
         self.imageThicknessSpinner, imageThincknessSizer = LabeledControlHelper.make(self.panel, "Shape Thickness", wx.SpinCtrl, orientation=wx.VERTICAL, 
                                                                                      min=1, max=self.max_depth, initial=self.img_to_stl.meshParameters.meshImageThicknessMM, size=(50,-1))
+        self.baseThicknessSpinner.Bind(wx.EVT_SPINCTRL,self.onHeightParametersChanged)
+        self.imageThicknessSpinner.Bind(wx.EVT_SPINCTRL,self.onHeightParametersChanged)
         dimensionSizer.Add(widthSizer, flag=wx.ALL, border=4)
         dimensionSizer.Add(heightSizer, flag=wx.ALL, border=4)
         dimensionSizer.Add(baseThicknessSizer, flag=wx.ALL, border=4)
@@ -152,6 +286,20 @@ class MainWindow(wx.Frame):
         self.checkboxSaveBlendFile = wx.CheckBox(panel, label='Save Blend file')  
         exportSizer.Add(self.checkboxSaveBlendFile, flag=wx.ALL, border=4)
         
+        # Indexed formats, smaller than STL files and aware of the color regions
+        self.checkboxSave3MFFile = wx.CheckBox(panel, label='Save 3MF file')
+        exportSizer.Add(self.checkboxSave3MFFile, flag=wx.ALL, border=4)
+        
+        self.checkboxSavePLYFile = wx.CheckBox(panel, label='Save PLY file')
+        exportSizer.Add(self.checkboxSavePLYFile, flag=wx.ALL, border=4)
+        
+        # A quick low resolution STL file is made first, then replaced by the full resolution one
+        self.checkboxDraft = wx.CheckBox(panel, label='Quick draft first')
+        exportSizer.Add(self.checkboxDraft, flag=wx.ALL, border=4)
+        
+        for checkbox in [self.checkboxSaveSTLFile, self.checkboxSaveBlendFile, self.checkboxSave3MFFile, self.checkboxSavePLYFile]:
+            checkbox.Bind(wx.EVT_CHECKBOX, self.onExportOptionsChanged)
+        
         sizer.Add(exportSizer, pos=(3, 0), flag=wx.EXPAND)
 
         #################### Generation ####################
@@ -165,6 +313,10 @@ class MainWindow(wx.Frame):
         
         loadingSizer = wx.BoxSizer(wx.VERTICAL)
         
+        # Estimated resources and outputs of the conversion, updated when the parameters change
+        self.planText = ExpandoTextCtrl(panel, value="No file selected", style= wx.TE_READONLY)
+        loadingSizer.Add(self.planText, flag=wx.EXPAND | wx.BOTTOM, border=5)
+        
         self.gaugeText = wx.StaticText(panel, label="Idle")
         loadingSizer.Add(self.gaugeText)
         
@@ -179,9 +331,17 @@ class MainWindow(wx.Frame):
         #################### Preview ####################
         
         self.PhotoMaxSize = 200
+        previewSizer = wx.BoxSizer(wx.VERTICAL)
         self.imageCtrl = wx.StaticBitmap(self.panel, wx.ID_ANY, 
                                          wx.Bitmap(wx.Image(self.PhotoMaxSize,self.PhotoMaxSize)))
-        sizer.Add(self.imageCtrl, pos=(0, 2), span=(5,1), flag=wx.EXPAND)
+        previewSizer.Add(self.imageCtrl)
+        
+        # Shaded relief of the height map, updated as soon as a height or thickness changes
+        previewSizer.Add(wx.StaticText(self.panel, label="Relief preview"), flag=wx.TOP, border=10)
+        self.heightPreviewCtrl = wx.StaticBitmap(self.panel, wx.ID_ANY, 
+                                                 wx.Bitmap(wx.Image(self.PhotoMaxSize,self.PhotoMaxSize)))
+        previewSizer.Add(self.heightPreviewCtrl)
+        sizer.Add(previewSizer, pos=(0, 2), span=(6,1), flag=wx.EXPAND)
         
         #############################################
         
@@ -234,6 +394,9 @@ class MainWindow(wx.Frame):
         self.buttonGenerate.Disable()
         self.checkboxSaveSTLFile.Disable()
         self.checkboxSaveBlendFile.Disable()
+        self.checkboxSave3MFFile.Disable()
+        self.checkboxSavePLYFile.Disable()
+        self.checkboxDraft.Disable()
         # Menu Items
         self.openMenuItem.Enable(False)
         self.generateMenuItem.Enable(False)
@@ -245,6 +408,9 @@ class MainWindow(wx.Frame):
         self.buttonGenerate.Enable()        
         self.checkboxSaveSTLFile.Enable()
         self.checkboxSaveBlendFile.Enable()
+        self.checkboxSave3MFFile.Enable()
+        self.checkboxSavePLYFile.Enable()
+        self.checkboxDraft.Enable()
         # Menu Items
         self.openMenuItem.Enable()
         self.generateMenuItem.Enable()
@@ -254,6 +420,18 @@ class MainWindow(wx.Frame):
         self.panel.Refresh()
         self.outer_sizer.Fit(self)
         
+    def makeProgress(self) -> Progress:
+        """Makes the Progress object of a new background job, with its own cancellation token"""
+        return Progress(max=100, callback=MainWindow.callUpdateProgress, error_callback=self.callErrorMessageBox, cancel_token=CancellationToken())
+    
+    def startNewJob(self) -> Progress:
+        """Cancels the current background job, if any, and returns the Progress object of a new one"""
+        self.progress.cancel_token.cancel()
+        # Speculative work is stopped as soon as real work is requested
+        self.speculationToken.cancel()
+        self.progress = self.makeProgress()
+        return self.progress
+        
     @staticmethod
     def callUpdateProgress(value, message=""):
         """Updates the status of the progress bar from a thread"""
@@ -278,6 +456,7 @@ class MainWindow(wx.Frame):
             "jpe",
             "bmp",
             "png",
+            "svg",
         ]
         supported_formats_str = ";".join([f"*.{ext}" for ext in supported_formats])
         with wx.FileDialog(self, "Load an image file to process", wildcard=f"Image files ({supported_formats_str}) |{supported_formats_str}",
@@ -295,28 +474,22 @@ class MainWindow(wx.Frame):
         try:
             # We try to open the file to check if it is accessible
             with open(path, 'r') as file:
+                # A load that is still running is stale now, and is stopped so that it does not compete with the new one
+                progress = self.startNewJob()
                 # The intensive stuff is done in a thread
-                threading.Thread(target=self.onImageLoad, args=[path]).start()
+                threading.Thread(target=self.onImageLoad, args=[path, progress]).start()
         except IOError:
             wx.LogError(f"Cannot open file '{path}'.")
     
-    def setImage(self, imageCtrl, imagePath):
-        """Changes the displayed image in the preview"""
-        # scale the image, preserving the aspect ratio
-        img = wx.Image(imagePath, wx.BITMAP_TYPE_ANY)
-        self.image_width = img.GetWidth()
-        self.image_height = img.GetHeight()
-        if self.image_width > self.image_height:
-            NewW = self.PhotoMaxSize
-            NewH = self.PhotoMaxSize * self.image_height / self.image_width
-        else:
-            NewH = self.PhotoMaxSize
-            NewW = self.PhotoMaxSize * self.image_width / self.image_height
-        img = img.Scale(int(NewW),int(NewH))
+    def setImage(self, imageCtrl, thumbnailPyramid: ThumbnailPyramid, thumbnail):
+        """Changes the displayed image in the preview
+        The thumbnail is made beforehand outside of the UI thread, here it is only copied into a bitmap"""
+        self.thumbnailPyramid = thumbnailPyramid
+        self.image_width, self.image_height = thumbnailPyramid.image_size
         # Update the image preview
-        imageCtrl.SetBitmap(wx.Bitmap(img))
+        imageCtrl.SetBitmap(wx.Bitmap.FromBuffer(thumbnail.shape[1], thumbnail.shape[0], thumbnail))
     
-    def onImageLoad(self, imagePath: str):
+    def onImageLoad(self, imagePath: str, progress: Progress):
         """Behaviour for loading an image to be processed (executed in a thread)"""
         # Prevents the user from interacting with the software
         wx.CallAfter(self.disableButtons)
@@ -328,10 +501,15 @@ class MainWindow(wx.Frame):
         wx.CallAfter(self.refresh)
         
         # Find the colors in the image
-        self.img_to_stl.loadImageSync(imagePath, self.progress)
+        if not self.img_to_stl.loadImageSync(imagePath, progress):
+            # Cancelled or failed : a cancelled load leaves the UI to the newer one
+            if not progress.cancel_token.cancelled:
+                wx.CallAfter(self.enableButtons)
+            return
         
-        # Flattened image preview
-        wx.CallAfter(self.setImage, self.imageCtrl, self.img_to_stl.flatImagePath)
+        # Flattened image preview, built from the color indices kept in memory rather than by decoding the flat image
+        thumbnailPyramid = ThumbnailPyramid.from_color_indices(self.img_to_stl.getColorIndexImage(), hex_to_rgb(self.img_to_stl.colors))
+        wx.CallAfter(self.setImage, self.imageCtrl, thumbnailPyramid, thumbnailPyramid.get(self.PhotoMaxSize))
         
         # MAJ UI
         wx.CallAfter(self.refresh)
@@ -339,61 +517,56 @@ class MainWindow(wx.Frame):
         # Triggers the appearance of the color UI
         wx.CallAfter(self.onColorsChanged)
         
-        # Triggers the aspect ratio logic
+        # The downsampled color map used by the relief preview is made here, outside of the UI thread
+        wx.CallAfter(self.setHeightPreview, HeightPreview(self.img_to_stl.getColorIndexImage(), self.PhotoMaxSize))
+        
+        # Triggers the aspect ratio logic, which also updates the estimated resources
         wx.CallAfter(self.onWidthChanged, None)
         
         # Allow the user further interaction with the software
         wx.CallAfter(self.enableButtons)
         
-    
-    def makeColorSquare(self, color):
-        """Makes a color square with the given color"""
-        square = wx.StaticText(self.panel, label=" ")
-        square.SetMinSize((25, 25))
-        square.SetBackgroundColour(color)
-        return square
-
-
-    def makeColorHeightSelect(self, color):
-        """Makes a field for selecting the color processing parameter"""
-        select, sizer = LabeledControlHelper.make(self.panel, f"Height for color {1+len(self.colorHeightSelect)}", noLabel=True,
-                                                  wxCtrlClass=wx.SpinCtrl, min=0, max=100, initial=len(self.colorHeightSelect))
-        self.colorHeightSelect[color] = select
-        return sizer
-    
+        # While the user reviews the colors, the mesh is prepared with the current parameters
+        wx.CallAfter(self.startSpeculation, progress)
+        
+    def startSpeculation(self, loadProgress: Progress):
+        """Starts preparing the mesh in the background, unless a newer job started since the load"""
+        if loadProgress is not self.progress:
+            return
+        self.readParameters()
+        self.img_to_stl.colors_definitions = self.readColorDefinitions()
+        self.img_to_stl.preserveAspectRatio = False
+        self.speculationToken = CancellationToken()
+        self.img_to_stl.prepareMesh(Progress(callback=lambda value, message="": None, error_callback=lambda message: None,
+                                             max=100, cancel_token=self.speculationToken))
+        
     
     def onColorsChanged(self):
         """Behaviour for when the detected colors of the image have changed"""
-        # Clears previous content
-        self.colorTypeCB = {}
-        self.colorHeightSelect = {}
-        self.colorSizer.Clear(True)
+        self.colorList.setColors(self.img_to_stl.colors)
         self.refresh()
         
-        # Adds new content
-        content = [(wx.StaticText(self.panel, label=x, style=wx.ALIGN_CENTRE_HORIZONTAL)) for x in [" ","Color","Height"]] # Headers
-        content = content + [y for color in self.img_to_stl.colors for y in [
-            self.makeColorSquare(color=color),
-            wx.StaticText(self.panel, label=color),
-            self.makeColorHeightSelect(color)]]
-        self.colorSizer.AddMany(content)
-        
-        # Handle tab order
-        for i, color in enumerate(self.img_to_stl.colors):
-            select = self.colorHeightSelect[color]
-            if(i == 0):
-                select.MoveAfterInTabOrder(self.buttonOpen)
-            else:
-                select.MoveAfterInTabOrder(self.colorHeightSelect[self.img_to_stl.colors[i-1]])
-            
-        # MAJ UI
+    def setHeightPreview(self, heightPreview: HeightPreview):
+        """Changes the relief preview to the one of a newly loaded image"""
+        self.heightPreview = heightPreview
+        self.updateHeightPreview()
+        # The size of the preview may have changed
         self.refresh()
         
-    
-    def getColorHeight(self, color: str) -> int:
-        """Finds the parameter selected for a given color"""
-        select = self.colorHeightSelect[color]
-        return select.GetValue()
+    def updateHeightPreview(self):
+        """Renders the relief preview again with the current parameters"""
+        if self.heightPreview is None or self.colorList.colors != self.img_to_stl.colors:
+            return
+        relief = self.heightPreview.render(list(self.colorList.heights),
+                                           imageThicknessMM=self.imageThicknessSpinner.GetValue(),
+                                           baseThicknessMM=self.baseThicknessSpinner.GetValue(),
+                                           widthMM=self.widthSpinner.GetValue())
+        width, height = self.heightPreview.size
+        self.heightPreviewCtrl.SetBitmap(wx.Bitmap.FromBuffer(width, height, relief))
+        
+    def onHeightParametersChanged(self, event):
+        """When a color height or a thickness is changed, updates the relief preview"""
+        self.updateHeightPreview()
         
     def onWidthChanged(self, event):
         """When the height is changed, ajusts the width to keep the aspect ratio"""
@@ -407,6 +580,8 @@ class MainWindow(wx.Frame):
                 newx = newx * self.max_height / newy
                 self.widthSpinner.SetValue(int(newx))
                 self.onWidthChanged(int(event))
+        self.updateHeightPreview()
+        self.updatePlan()
     
     def onHeightChanged(self, event):
         """When the width is changed, ajusts the height to keep the aspect ratio"""
@@ -420,6 +595,8 @@ class MainWindow(wx.Frame):
                 newy = newy * self.max_width / newx
                 self.heightSpinner.SetValue(int(newy))
                 self.onHeightChanged(event)
+        self.updateHeightPreview()
+        self.updatePlan()
 
         
     def onGenerate(self, event):
@@ -427,30 +604,61 @@ class MainWindow(wx.Frame):
         # The intensive stuff is done in a thread
         threading.Thread(target=self.generate).start()
                     
-    def generate(self):
-        """Generates the STL file. Runs in a thread."""
-        saveBlendFile=self.checkboxSaveBlendFile.GetValue()
-        saveSTL=self.checkboxSaveSTLFile.GetValue()
-        
+    def callDraftReady(self, draftPath: str):
+        """Tells the user that the draft STL file can be used, while the full resolution one is still being generated"""
+        message = f"Draft STL file ready :\n{draftPath}\n\nThe full resolution file is being generated, and will replace the draft when done."
+        wx.CallAfter(wx.MessageBox, message, 'Info', wx.OK)
+                    
+    def readParameters(self):
+        """Copies the values of the controls to the mesh generation parameters"""
         self.img_to_stl.meshParameters.saveBlendFile = self.checkboxSaveBlendFile.GetValue()
         self.img_to_stl.meshParameters.saveSTL = self.checkboxSaveSTLFile.GetValue()
-        
-        self.img_to_stl.colors_definitions = [ColorDefinition(color, self.getColorHeight(color)) for color in self.img_to_stl.colors]
+        self.img_to_stl.meshParameters.save3MF = self.checkboxSave3MFFile.GetValue()
+        self.img_to_stl.meshParameters.savePLY = self.checkboxSavePLYFile.GetValue()
         
         self.img_to_stl.meshParameters.meshWidthMM = self.widthSpinner.GetValue()
         self.img_to_stl.meshParameters.meshHeightMM = self.heightSpinner.GetValue()
         self.img_to_stl.meshParameters.meshBaseThicknessMM = self.baseThicknessSpinner.GetValue()
         self.img_to_stl.meshParameters.meshImageThicknessMM = self.imageThicknessSpinner.GetValue()
+        
+    def readColorDefinitions(self):
+        """The colors and the heights chosen for them"""
+        return [ColorDefinition(color, height) for color, height in zip(self.colorList.colors, list(self.colorList.heights))]
+        
+    def updatePlan(self):
+        """Shows the estimated resources and outputs of the conversion with the current parameters"""
+        if self.img_to_stl.imageShape is None:
+            return
+        self.readParameters()
+        if self.img_to_stl.meshParameters.hasOutput():
+            self.planText.SetValue(self.img_to_stl.planConversion().describe())
+        else:
+            self.planText.SetValue("No output file selected")
+        self.refresh()
+        
+    def onExportOptionsChanged(self, event):
+        """When an output format is selected or unselected, updates the estimated resources"""
+        self.updatePlan()
+                    
+    def generate(self):
+        """Generates the STL file. Runs in a thread."""
+        self.readParameters()
+        
+        self.img_to_stl.colors_definitions = self.readColorDefinitions()
+        
         self.img_to_stl.preserveAspectRatio = False
+        self.img_to_stl.progressive = self.checkboxDraft.GetValue()
 
-        if (not saveBlendFile and not saveSTL):
+        if not self.img_to_stl.meshParameters.hasOutput():
             wx.CallAfter(wx.MessageBox, 'Please, choose at least one file type to save', 'Warning', wx.OK | wx.ICON_WARNING)
         else:
             # Prevents the user from interacting with the software
             wx.CallAfter(self.disableButtons)            
 
-            if self.img_to_stl.generateMeshSync(progress=self.progress):
+            if self.img_to_stl.generateMeshSync(progress=self.startNewJob(), onDraftReady=self.callDraftReady):
                 message = 'STL generation successful !'
+                if self.img_to_stl.validationReports:
+                    message += '\n\n' + '\n'.join(report.summary() for report in self.img_to_stl.validationReports)
                 wx.CallAfter(wx.MessageBox, message, 'Info', wx.OK)
             else:
                 wx.CallAfter(wx.MessageBox, 'STL generation unsuccessful', 'Error', wx.OK | wx.ICON_ERROR)
@@ -0,0 +1,150 @@
+import math
+import os
+import warnings
+import numpy as np
+import cv2
+from PIL import Image
+from typing import Optional, Tuple
+
+# Reduced decoding flags of OpenCV, by scale factor. JPEG images are decoded directly at the reduced size.
+REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# Images with at most this amount of exact colors are labelled straight from their colors, without color detection
+MAX_INDEXED_COLORS = 64
+# EXIF tag of the orientation, and its values for which the image is turned by a quarter turn when displayed (and decoded by OpenCV)
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image has more pixels than allowed, before it is decoded"""
+
+def read_image_size(image_path: str) -> Tuple[int, int]:
+    """Reads the size of an image from its header, without decoding it
+    The size is the one of the decoded image : width and height are swapped when the EXIF orientation turns the image
+
+    Args:
+        image_path (str): Path to the image
+
+    Raises:
+        IOError: The file does not exist or is not a known image format
+        ImageTooLargeError: The image is too large to be opened safely
+
+    Returns:
+        Tuple[int, int]: Width and height of the image, in pixels
+    """
+    if not os.path.isfile(image_path):
+        raise IOError(f"No such file : '{image_path}'")
+    try:
+        # The pixel budget is enforced by the callers, PIL's warning about large images is not needed
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(image_path) as image:
+                width, height = image.size
+                if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+                    return height, width
+                return width, height
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except Image.UnidentifiedImageError as e:
+        raise IOError(str(e)) from e
+
+def reduction_factor(size: Tuple[int, int], max_pixels: int = None) -> float:
+    """Computes by how much the sides of an image must be divided to fit in a pixel budget
+
+    Args:
+        size (Tuple[int, int]): Width and height of the image
+        max_pixels (int, optional): Maximum amount of pixels. Defaults to None (no limit).
+
+    Returns:
+        float: The factor, at least 1
+    """
+    width, height = size
+    if max_pixels is None or width * height <= max_pixels:
+        return 1.
+    return math.sqrt(width * height / max_pixels)
+
+def load_image(image_path: str, max_image_pixels: int = None, max_decode_pixels: int = None) -> np.ndarray:
+    """Loads an image as an RGB array, downscaled to fit in a pixel budget
+    The size is checked from the header before anything is decoded, and the image is decoded at a reduced resolution when possible
+
+    Args:
+        image_path (str): Path to the image
+        max_image_pixels (int, optional): Larger images are downscaled to this amount of pixels. Defaults to None (no limit).
+        max_decode_pixels (int, optional): Larger images are refused. Defaults to None (no limit).
+
+    Raises:
+        IOError: The file does not exist or cannot be decoded
+        ImageTooLargeError: The image has more than max_decode_pixels pixels
+
+    Returns:
+        np.ndarray: The image, as an RGB array
+    """
+    width, height = read_image_size(image_path)
+    if max_decode_pixels is not None and width * height > max_decode_pixels:
+        raise ImageTooLargeError(f"The image has {width}x{height} pixels, more than the maximum of {max_decode_pixels} pixels")
+
+    factor = reduction_factor((width, height), max_image_pixels)
+    # The largest reduction supported by the decoder that does not go under the budget
+    decode_factor = max([f for f in REDUCED_COLOR_FLAGS if f <= factor], default=1)
+    img = cv2.imread(image_path, REDUCED_COLOR_FLAGS[decode_factor] if decode_factor > 1 else cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError(f"Cannot decode image '{image_path}'")
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    # The rest of the reduction
+    if factor > 1:
+        new_size = (max(1, int(width / factor)), max(1, int(height / factor)))
+        # The orientation of the decoded image wins over the one of the header, in case the decoder did not turn it
+        if (img.shape[1] - img.shape[0]) * (width - height) < 0:
+            new_size = new_size[::-1]
+        if new_size != (img.shape[1], img.shape[0]):
+            img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    return img
+
+def load_indexed_image(image_path: str, max_image_pixels: int = None, max_decode_pixels: int = None,
+                       max_colors: int = MAX_INDEXED_COLORS) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Loads a palette image, such as a paletted PNG or GIF file, as the index of the color of each pixel
+    Only the indices are decoded, and they are downscaled without mixing colors. Other images are not decoded at all.
+
+    Args:
+        image_path (str): Path to the image
+        max_image_pixels (int, optional): Larger images are downscaled to this amount of pixels. Defaults to None (no limit).
+        max_decode_pixels (int, optional): Larger images are refused. Defaults to None (no limit).
+        max_colors (int, optional): Images using more colors of their palette are not loaded. Defaults to MAX_INDEXED_COLORS.
+
+    Raises:
+        IOError: The file does not exist or cannot be decoded
+        ImageTooLargeError: The image has more than max_decode_pixels pixels
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray]]: The color of each pixel, as a 2D array of indices, and the RGB value of each color.
+            None if the image is not a palette image or uses more than max_colors colors.
+    """
+    width, height = read_image_size(image_path)
+    if max_decode_pixels is not None and width * height > max_decode_pixels:
+        raise ImageTooLargeError(f"The image has {width}x{height} pixels, more than the maximum of {max_decode_pixels} pixels")
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(image_path) as image:
+                if image.mode != "P":
+                    return None
+                indices = np.asarray(image)
+                palette = np.array(image.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+    except (OSError, ValueError) as e:
+        raise IOError(str(e)) from e
+
+    # Only the entries that are used, with the entries of the same color merged
+    used = np.flatnonzero(np.bincount(indices.ravel(), minlength=len(palette)))
+    if len(used) > max_colors or used[-1] >= len(palette):
+        return None
+    colors, entry_colors = np.unique(palette[used], axis=0, return_inverse=True)
+    lookup = np.zeros(len(palette), dtype=np.uint8)
+    lookup[used] = entry_colors.ravel()
+    labels = lookup[indices]
+
+    factor = reduction_factor((width, height), max_image_pixels)
+    if factor > 1:
+        # From the shape of the indices, which are not turned by the EXIF orientation
+        new_size = (max(1, int(labels.shape[1] / factor)), max(1, int(labels.shape[0] / factor)))
+        labels = cv2.resize(labels, new_size, interpolation=cv2.INTER_NEAREST)
+    return labels, colors
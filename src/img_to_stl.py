@@ -1,13 +1,69 @@
+import asyncio
+import dataclasses
+import functools
+import math
+import os
+import sys
 import threading
 import time
-from PIL import Image
+import numpy as np
 from color_types import ColorDefinition
-from color_detection import findColorsAndMakeNewImage
-from generate_greyscale_image import generateGreyScaleImage
-from stl_generation import MeshGenerationParameters, generateSTL
+from color_detection import findColorsAndMakeNewImage, hex_to_rgb, label_indexed_image, nearest_palette_colors, write_flat_image
+from image_loading import ImageTooLargeError, load_image, load_indexed_image, read_image_size
+from island_pruning import island_thresholds, prune_islands
+from resource_planner import ConversionPlan, ResourceBudget, apply_thread_budget, fit_conversion_to_budget
+from generate_greyscale_image import generateHeightMap
+from plate_tiling import PlateLayout, generate_plates
+from resampling import resample_labels
+from scratch import get_scratch_workspace
+from shared_palette import SharedPalette
+from svg_input import is_svg, rasterize_svg, read_svg_size, svg_raster_size
+from stl_generation import MeshGenerationParameters, MeshState, MeshValidationReport, generateSTL, generateNameResultingFile, grid_shape, output_paths, prepareMesh
 from dataclasses import dataclass, field
-from typing import List
-from progress import Progress
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple, Union
+from progress import Progress, OperationCancelled
+
+# Executor of the asynchronous methods when none is given. An asyncio event loop can also be used as an executor.
+JobExecutor = Union[Executor, asyncio.AbstractEventLoop]
+_defaultExecutor = None
+
+def getDefaultExecutor() -> Executor:
+    """The thread pool used by the asynchronous methods when no executor is given, created on first use"""
+    global _defaultExecutor
+    if _defaultExecutor is None:
+        _defaultExecutor = ThreadPoolExecutor(thread_name_prefix="ImgToStl")
+    return _defaultExecutor
+
+_speculativeExecutor = None
+
+def lowerThreadPriority() -> None:
+    """Lowers the scheduling priority of the calling thread, where the system allows it (Linux), so that it only uses idle CPU time"""
+    try:
+        # On Linux, the priority of a thread can be changed through its native id
+        if sys.platform.startswith("linux"):
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+def getSpeculativeExecutor() -> Executor:
+    """The thread used for speculative work, with a low priority, created on first use"""
+    global _speculativeExecutor
+    if _speculativeExecutor is None:
+        _speculativeExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ImgToStlSpeculative", initializer=lowerThreadPriority)
+    return _speculativeExecutor
+
+def submitJob(executor: JobExecutor, fn: Callable, *args) -> Union[Future, asyncio.Future]:
+    """Runs a function with an executor, or with the default executor of an asyncio event loop
+
+    Returns:
+        Union[Future, asyncio.Future]: The future of the result (an asyncio future if executor is an event loop)
+    """
+    if executor is None:
+        executor = getDefaultExecutor()
+    if isinstance(executor, asyncio.AbstractEventLoop):
+        return executor.run_in_executor(None, functools.partial(fn, *args))
+    return executor.submit(fn, *args)
 
 @dataclass(repr=False, eq=False)
 class ImgToStl:
@@ -17,51 +73,132 @@ class ImgToStl:
     
     imagePath: str = None
     flatImagePath: str = None
+    # Rows and columns of the flat image
+    imageShape: Tuple[int, int] = None
+    
+    # Larger images are downscaled while being decoded, to this amount of pixels
+    maxImagePixels: int = 1 << 24
+    # Larger images are refused, before being decoded
+    maxDecodePixels: int = 1 << 27
+    # Memory and CPU limits, the conversions are adjusted or rejected to fit in them
+    resourceBudget: ResourceBudget = field(default_factory=ResourceBudget)
+    # Name of the engine that finds the colors of the image (see palette_engines)
+    paletteEngine: str = "ward"
+    # Palette shared by a series of images : its colors and heights are used instead of detecting the colors of each image
+    sharedPalette: SharedPalette = None
     
     colors: List[str] = field(default_factory=list) 
     colors_definitions: List[ColorDefinition] = field(default_factory=list) 
-    pixel_list_labels: List[int] = field(default_factory=list) 
+    pixel_list_labels: np.ndarray = None
     relevant_label_to_color_hexes: dict = field(default_factory=dict) 
+    color_index_image: np.ndarray = None
+    # Color index image resampled to the resolution of the last mesh (with the settings it was made with), and mesh of the last generation,
+    # so that generating again with other parameters only does the work that depends on them
+    resampled_color_index_image: np.ndarray = None
+    resampled_color_index_key: tuple = None
+    meshState: MeshState = field(default_factory=MeshState)
     
     preserveAspectRatio: bool = True
+    
+    # Progressive mode : a low resolution draft is generated first, then replaced by the full resolution mesh
+    progressive: bool = False
+    # Amount of vertices along the largest side of the draft mesh
+    draftResolution: int = 150
 
-    meshParameters: MeshGenerationParameters = MeshGenerationParameters()
+    meshParameters: MeshGenerationParameters = field(default_factory=MeshGenerationParameters)
+    # Split of the mesh into plates that fit on the print bed
+    plateLayout: PlateLayout = field(default_factory=PlateLayout)
+    # Paths of the files written by the last successful generation
+    outputPaths: List[str] = field(default_factory=list)
+    # Validation reports of the meshes of the last successful generation, one per plate (empty if the validation is disabled)
+    validationReports: List[MeshValidationReport] = field(default_factory=list)
 
-    def loadImage(self, filepath: str, progress: Progress):
+    def loadImage(self, filepath: str, progress: Progress, executor: JobExecutor = None) -> Future:
         """Asynchronous preprocessing of a source image
         At the end of this step, a new image will be generated, using only flat colouring
         This is necessary to reduce the amount of slightly different colors that might be in the image
         Without it, we would risk making the height selection for each color impractical
+        The results are stored in this instance, so the executor must run in this process (threads or asyncio)
 
         Args:
             filepath (str): Path to the image to process
             progress (Progress): Object used to notify the program when progress is made
+            executor (JobExecutor, optional): Runs the job. Defaults to a shared thread pool.
+
+        Returns:
+            Future: Resolves to True if the operation is successful
         """
-        # loadImageSync is called in a separate thread
-        threading.Thread(target=self.loadImageSync, args=[filepath, progress]).start()
+        return submitJob(executor, self.loadImageSync, filepath, progress)
     
-    def generateMesh(self, progress: Progress):
+    def generateMesh(self, progress: Progress, onDraftReady: Callable[[str], None] = None, executor: JobExecutor = None) -> Future:
         """Asynchronous Generation of a mesh from a preprocessed image
         (Behaviour of the 'generate' button)
         Note that the image must have been preprocessed before we get to this step
+        The job works on a snapshot of the parameters : changing them afterwards does not affect it
         
         Args:
             progress (Progress): Object used to notify the program when progress is made
+            onDraftReady (Callable[[str], None], optional): In progressive mode, called with the path of the draft STL file once it is written. Defaults to None.
+            executor (JobExecutor, optional): Runs the job. Defaults to a shared thread pool.
+
+        Returns:
+            Future: Resolves to True if the operation is successful
         """
-        # generateMeshSync is called in a separate thread
-        threading.Thread(target=self.generateMeshSync, args=[progress]).start()
+        return submitJob(executor, self.snapshot().generateMeshSync, progress, onDraftReady)
         
-    def loadImageAndGenerateMesh(self, filepath: str, progress: Progress):
+    def loadImageAndGenerateMesh(self, filepath: str, progress: Progress, onDraftReady: Callable[[str], None] = None, executor: JobExecutor = None) -> Future:
         """Asynchronous Preprocessing and conversion of a source image
         This is the equivalent of calling loadImage, waiting for it to finish and then calling generateMesh
 
         Args:
             filepath (str): Path to the image to process
             progress (Progress): Object used to notify the program when progress is made
+            onDraftReady (Callable[[str], None], optional): In progressive mode, called with the path of the draft STL file once it is written. Defaults to None.
+            executor (JobExecutor, optional): Runs the job. Defaults to a shared thread pool.
+
+        Returns:
+            Future: Resolves to True if the operation is successful
+        """
+        def job():
+            return self.loadImageSync(filepath, progress.make_child(0,50)) and self.snapshot().generateMeshSync(progress.make_child(50,100), onDraftReady)
+        return submitJob(executor, job)
+    
+    def prepareMesh(self, progress: Progress, executor: JobExecutor = None) -> Future:
+        """Asynchronous speculative work for the next generation, with the current parameters and heights
+        The mesh and the Blender object are made in the background, while the user reviews the colors. A generation done afterwards
+        only recomputes what changed since. The work is dropped when the progress is cancelled, and errors are ignored,
+        the generation itself reporting them.
+
+        Args:
+            progress (Progress): Its cancellation token stops the work. Nothing is notified.
+            executor (JobExecutor, optional): Runs the job. Defaults to a single low priority thread.
+
+        Returns:
+            Future: Resolves to True if the work was done
+        """
+        snapshot = self.snapshot()
+        future = submitJob(executor or getSpeculativeExecutor(), snapshot.prepareMeshSync, progress)
+        
+        def adoptResults(future):
+            # The color maps computed by the job are kept, unless another image was loaded in the meantime
+            if not future.cancelled() and future.exception() is None and future.result() and snapshot.pixel_list_labels is self.pixel_list_labels:
+                self.color_index_image = snapshot.color_index_image
+                self.resampled_color_index_image = snapshot.resampled_color_index_image
+                self.resampled_color_index_key = snapshot.resampled_color_index_key
+        future.add_done_callback(adoptResults)
+        return future
+        
+    def snapshot(self) -> "ImgToStl":
+        """Copy of this instance for a single job
+        The parameters are copied, so that they can be changed while the job runs. The results of the color detection are shared,
+        as jobs only read them, and so is the mesh of the last generation, which has its own lock.
+
+        Returns:
+            ImgToStl: The copy
         """
-        # loadImageSync and generateMeshSync are called in a separate thread
-        threading.Thread(target=lambda f, p : self.loadImageSync(f, p.make_child(0,50)) and self.generateMeshSync(p.make_child(50,100)), 
-                         args=[filepath, progress]).start()
+        return dataclasses.replace(self, meshParameters=dataclasses.replace(self.meshParameters), resourceBudget=dataclasses.replace(self.resourceBudget),
+                                   plateLayout=dataclasses.replace(self.plateLayout), colors=list(self.colors),
+                                   colors_definitions=[ColorDefinition(c.colorString, c.colorHeight) for c in self.colors_definitions or []])
             
     def loadImageSync(self, filepath, progress: Progress) -> bool:
         """Synchronous version of loadImage
@@ -74,59 +211,382 @@ class ImgToStl:
             true if the operation is successful
         """
         try:
-            # We try to open the file to check if it is accessible
-            with open(filepath, 'r') as file:
-                # We save the path to the current file for context
-                self.imagePath = filepath
+            # The whole conversion is planned from the header of the image, before anything is decoded
+            plan = self.planConversion(filepath)
+            if plan.rejection is not None:
+                progress.fatal_error(f"Cannot convert file '{filepath}' : it {plan.rejection}.")
+                return False
+            workers = apply_thread_budget(self.resourceBudget)
+            palette = self.sharedPalette.colors if self.sharedPalette is not None else None
+            # Palette images only need their indices : they are the labels
+            indexed = None if is_svg(filepath) else load_indexed_image(filepath, plan.maxImagePixels, self.maxDecodePixels)
+            if is_svg(filepath):
+                results, shape = self.loadVectorImage(filepath, progress)
+            elif indexed is not None:
+                results = label_indexed_image(*indexed, progress, workers, palette=palette)
+                shape = indexed[0].shape
+            else:
+                # The image is only decoded at the resolution that will be used
+                img = load_image(filepath, plan.maxImagePixels, self.maxDecodePixels)
                 # Preprocessing of the image
-                self.colors, self.flatImagePath, self.pixel_list_labels, self.relevant_label_to_color_hexes = findColorsAndMakeNewImage(self.imagePath, progress)
-                return True
+                results = findColorsAndMakeNewImage(img, progress, workers, self.paletteEngine, palette=palette)
+                shape = img.shape[:2]
+            # The results of a cancelled request must not replace those of the newer one
+            try:
+                progress.check_cancelled()
+            except OperationCancelled:
+                get_scratch_workspace().release(results[1])
+                raise
+            # The files of the previous image are not needed anymore
+            self.close()
+            # We save the path to the current file for context
+            self.imagePath = filepath
+            self.imageShape = shape
+            self.colors, self.flatImagePath, self.pixel_list_labels, self.relevant_label_to_color_hexes = results
+            self.color_index_image = None
+            self.resampled_color_index_image = None
+            self.resampled_color_index_key = None
+            self.meshState = MeshState()
+            if self.sharedPalette is not None:
+                # The colors are the ones of the palette, in its order : its heights apply as they are
+                self.colors_definitions = [ColorDefinition(color, height) for color, height in zip(self.sharedPalette.colors, self.sharedPalette.heights)]
+            progress.flush()
+            return True
+        except OperationCancelled:
+            # A newer request replaced this one, its results are not needed anymore
+            return False
+        except ImageTooLargeError as e:
+            progress.fatal_error(f"Cannot open file '{filepath}' : {e}.")
+            return False
         except IOError:
             # Error during preprocessing
             progress.fatal_error(f"Cannot open file '{filepath}'.")
             return False
         
-    def generateMeshSync(self, progress: Progress) -> bool:
+    def loadVectorImage(self, filepath: str, progress: Progress) -> tuple:
+        """Preprocessing of an SVG file : its declared colors are the palette, and its shapes are drawn directly as labels,
+        so neither the color detection nor its approximations are needed
+
+        Args:
+            filepath (str): Path to the SVG file
+            progress (Progress): Object used to notify the program when progress is made
+
+        Returns:
+            tuple: The same results as findColorsAndMakeNewImage, and the shape of the label map
+        """
+        progress.update_progress(0, "Drawing the vector image")
+        labelMap = rasterize_svg(filepath, self.vectorRasterSize(filepath))
+        if labelMap.unsupported:
+            progress.update_progress(50, "Elements ignored : " + ", ".join(sorted(labelMap.unsupported)))
+        progress.check_cancelled()
+        colors, labels = labelMap.colors, labelMap.labels
+        if self.sharedPalette is not None:
+            # Each declared color becomes the closest color of the palette
+            colors = self.sharedPalette.colors
+            labels = nearest_palette_colors(hex_to_rgb(labelMap.colors), hex_to_rgb(colors))[labels]
+        rgb = hex_to_rgb(colors)
+        flatImagePath = write_flat_image(rgb[labels])
+        progress.update_progress(100)
+        results = (colors, flatImagePath, labels.ravel(), {label: label for label in range(len(colors))})
+        return results, labelMap.labels.shape
+        
+    def vectorRasterSize(self, filepath: str) -> Tuple[int, int]:
+        """Size at which an SVG file is drawn : the resolution of the mesh when the parameters limit it, otherwise the size of the drawing,
+        within the pixel budget in both cases
+
+        Args:
+            filepath (str): Path to the SVG file
+
+        Returns:
+            Tuple[int, int]: Width and height
+        """
+        width, height = read_svg_size(filepath)
+        # The drawing can be rasterized at any resolution : the largest one allowed is given to the resolution limits
+        factor = math.sqrt(self.maxImagePixels / (width * height))
+        nominal = (max(1, int(height * factor)), max(1, int(width * factor)))
+        grid = grid_shape(nominal, self.meshParameters)
+        return svg_raster_size((width, height), grid if grid != nominal else None, self.maxImagePixels)
+        
+    def close(self) -> None:
+        """Deletes the temporary files of the loaded image
+        The results of the color detection stay in memory, so meshes can still be generated from them
+        """
+        get_scratch_workspace().release(self.flatImagePath)
+        self.flatImagePath = None
+        
+    def getColorIndexImage(self) -> np.ndarray:
+        """Index of the color of each pixel of the preprocessed image, in the order of self.colors
+        It is computed on first use and then cached
+
+        Returns:
+            np.ndarray: The color indices, as a 2D array with the shape of the image
+        """
+        if self.color_index_image is None:
+            height, width = self.imageShape
+            labels = np.asarray(self.pixel_list_labels)
+            known_labels = np.array(sorted(self.relevant_label_to_color_hexes))
+            indices = np.array([self.relevant_label_to_color_hexes[l] for l in known_labels], dtype=np.uint16)
+            self.color_index_image = indices[np.searchsorted(known_labels, labels)].reshape(height, width)
+        return self.color_index_image
+        
+    def getResampledColorIndexImage(self, parameters: MeshGenerationParameters = None) -> np.ndarray:
+        """Color index image resampled to the resolution of the mesh given by the parameters, without the regions too small to be printed
+        The last result is cached, as it only changes with the size of the mesh
+
+        Args:
+            parameters (MeshGenerationParameters, optional): Mesh generation parameters. Defaults to self.meshParameters.
+
+        Returns:
+            np.ndarray: The color indices, as a 2D array with the shape of the top grid of the mesh
+        """
+        parameters = parameters or self.meshParameters
+        colorIndexImage = self.getColorIndexImage()
+        shape = grid_shape(colorIndexImage.shape, parameters)
+        # The minimum sizes are in mm : they depend on the size of the mesh, not only on its resolution
+        minArea, minWidth = island_thresholds(shape, parameters.meshWidthMM, parameters.meshHeightMM,
+                                              parameters.minIslandAreaMM2, parameters.minIslandWidthMM)
+        key = (shape, minArea, minWidth)
+        if self.resampled_color_index_image is None or self.resampled_color_index_key != key:
+            self.resampled_color_index_image = prune_islands(resample_labels(colorIndexImage, shape), minArea, minWidth)
+            self.resampled_color_index_key = key
+        return self.resampled_color_index_image
+        
+    def planConversion(self, imagePath: str = None) -> ConversionPlan:
+        """Estimates the resources used by a conversion, and adjusts it to fit in the resource budget
+
+        Args:
+            imagePath (str, optional): Image to convert. Defaults to the loaded image, whose color detection is already done.
+
+        Returns:
+            ConversionPlan: The plan, whose parameters are the ones to use
+        """
+        if imagePath is None:
+            height, width = self.imageShape
+            return fit_conversion_to_budget((width, height), self.meshParameters, self.resourceBudget, paletteSize=len(self.colors),
+                                            colorIndexImage=self.getColorIndexImage(), includeColorDetection=False)
+        if is_svg(imagePath):
+            # The colors of vector images are not detected, they are read
+            return fit_conversion_to_budget(self.vectorRasterSize(imagePath), self.meshParameters, self.resourceBudget, includeColorDetection=False)
+        return fit_conversion_to_budget(read_image_size(imagePath), self.meshParameters, self.resourceBudget, maxImagePixels=self.maxImagePixels)
+        
+    def generateDraft(self, heightMap: np.ndarray, progress: Progress) -> str:
+        """Generates a low resolution STL file from a height map, next to the final output
+
+        Args:
+            heightMap (np.ndarray): The height map
+            progress (Progress): Object used to notify the program when progress is made
+
+        Returns:
+            str: Path to the draft STL file
+        """
+        draftOutputPath = os.path.splitext(self.meshParameters.outputMeshPath)[0] + "_draft"
+        draftParameters = dataclasses.replace(self.meshParameters, outputMeshPath=draftOutputPath, maxResolution=self.draftResolution,
+                                              saveSTL=True, saveBlendFile=False, save3MF=False, savePLY=False)
+        generateSTL(heightMap, parameters=draftParameters, progress=progress)
+        return generateNameResultingFile(draftOutputPath, "stl")
+        
+    def applyAspectRatio(self) -> None:
+        """Makes the height of the mesh follow its width, if the aspect ratio of the image is preserved"""
+        if (self.preserveAspectRatio): 
+            height, width = self.imageShape
+            self.meshParameters.meshHeightMM = int(self.meshParameters.meshWidthMM * height / width)
+        
+    def planGeneration(self) -> ConversionPlan:
+        """Plans the generation of the mesh of the loaded image, with the default heights if none were chosen
+
+        Returns:
+            ConversionPlan: The plan, whose parameters are the ones to use
+        """
+        if self.colors_definitions is None or len(self.colors_definitions) == 0:
+            self.colors_definitions = [ColorDefinition(color, i) for i, color in enumerate(self.colors)]
+        self.meshParameters.outputMeshPath = self.imagePath
+        return self.planConversion()
+        
+    def makeHeightMap(self, parameters: MeshGenerationParameters) -> Tuple[np.ndarray, np.ndarray]:
+        """Makes the height map of the loaded image, at the resolution of the mesh
+        The color map is first resampled to the resolution of the mesh, so that the work done afterwards follows the size of the print
+
+        Args:
+            parameters (MeshGenerationParameters): Mesh generation parameters, as adjusted by the plan
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The resampled color index image, and the height map
+        """
+        colorIndexImage = self.getResampledColorIndexImage(parameters)
+        return colorIndexImage, generateHeightMap(colorIndexImage, self.colors_definitions)
+        
+    def prepareMeshSync(self, progress: Progress) -> bool:
+        """Synchronous version of prepareMesh
+
+        Args:
+            progress (Progress): Its cancellation token stops the work
+
+        Returns:
+            true if the work was done
+        """
+        if self.imageShape is None or not self.meshParameters.hasOutput() or self.plateLayout.plateCount > 1:
+            return False
+        self.applyAspectRatio()
+        try:
+            plan = self.planGeneration()
+            if plan.rejection is not None:
+                return False
+            _, heightMap = self.makeHeightMap(plan.parameters)
+            progress.check_cancelled()
+            prepareMesh(heightMap, plan.parameters, self.meshState, progress)
+            return True
+        except OperationCancelled:
+            return False
+        except Exception:
+            # Speculative work : the generation reports the errors if they happen again
+            return False
+        
+    def generateMeshSync(self, progress: Progress, onDraftReady: Callable[[str], None] = None) -> bool:
         """Synchronous version of generateMesh
 
         Args:
             progress (Progress): Object used to notify the program when progress is made
+            onDraftReady (Callable[[str], None], optional): In progressive mode, called with the path of the draft STL file once it is written. Defaults to None.
             
         Returns:
             true if the operation is successful
         """
         
         # If no output was selected, it is useless to continue
-        if (not self.meshParameters.saveBlendFile and not self.meshParameters.saveSTL):
+        if not self.meshParameters.hasOutput():
             print('Please, choose at least one file type to save')
             return False
         
-        # We make sure to preserve the aspect ratio if needed
-        if (self.preserveAspectRatio): 
-            img = Image.open(self.flatImagePath)
-            self.meshParameters.meshHeightMM = int(self.meshParameters.meshWidthMM * img.height / img.width)
+        self.applyAspectRatio()
         
         try:
             # Generation of the grayscale version of the image, which will be used as a height map
             progress.update_progress(0, "Generating height map")
-            if self.colors_definitions is None or len(self.colors_definitions) == 0:
-                self.colors_definitions = [ColorDefinition(color, i) for i, color in enumerate(self.colors)]
-            grayscaleImagePath = generateGreyScaleImage(self.imagePath, self.colors_definitions, self.pixel_list_labels, self.relevant_label_to_color_hexes)
+            # The conversion is adjusted to the resource budget, or refused if it cannot fit
+            plan = self.planGeneration()
+            if plan.rejection is not None:
+                progress.fatal_error(f"STL generation unsuccessful : the conversion {plan.rejection}.")
+                return False
+            parameters = plan.parameters
+            if plan.adjustments:
+                progress.update_progress(0, "Adjusted to the resource budget : " + ", ".join(plan.adjustments))
+            apply_thread_budget(self.resourceBudget)
+            colorIndexImage, heightMap = self.makeHeightMap(parameters)
             
             # Generating the mesh
-            progress.update_progress(50, "Generating STL file")
+            progress.check_cancelled()
             startTime = time.time()
-            self.meshParameters.outputMeshPath = self.imagePath
-            generateSTL(grayscaleImagePath, parameters=self.meshParameters, progress = progress.make_child(50,100))
+            # Remarks added to the final message
+            notes = []
+            if self.plateLayout.plateCount > 1:
+                # The plates share the palette and the height map of the whole image, only their meshes are generated separately
+                if self.progressive:
+                    notes.append("No draft was made : drafts are not supported for meshes split into plates")
+                progress.update_progress(50, "Generating plates")
+                self.outputPaths, reports = generate_plates(heightMap, parameters, self.plateLayout, progress.make_child(50,100),
+                                                            colorIndexImage, self.colors, self.resourceBudget.workers())
+            elif self.progressive:
+                # The draft is a complete mesh with the final dimensions, only coarser, so that it can be test printed on its own
+                progress.update_progress(50, "Generating draft STL file")
+                draftPath = self.generateDraft(heightMap, progress.make_child(50,60))
+                if onDraftReady is not None:
+                    onDraftReady(draftPath)
+                progress.update_progress(60, "Generating STL file")
+                reports = [generateSTL(heightMap, parameters=parameters, progress = progress.make_child(60,100),
+                                       colorIndexImage=colorIndexImage, colors=self.colors, meshState=self.meshState)]
+                # The full resolution mesh replaces the draft
+                if os.path.exists(draftPath):
+                    os.remove(draftPath)
+                self.outputPaths = output_paths(parameters)
+            else:
+                progress.update_progress(50, "Generating STL file")
+                reports = [generateSTL(heightMap, parameters=parameters, progress = progress.make_child(50,100),
+                                       colorIndexImage=colorIndexImage, colors=self.colors, meshState=self.meshState)]
+                self.outputPaths = output_paths(parameters)
             endGenerationTime = time.time()
+            self.validationReports = [report for report in reports if report is not None]
             
             # Generation successful
             message = 'STL generation successful ! Elapsed time : %.2f s' % (endGenerationTime - startTime)
+            # The problems found by the validation are part of the final message, so that they are shown wherever the progress is
+            notes += [report.summary() for report in self.validationReports if not report.isValid]
+            if notes:
+                message += ". " + ". ".join(notes)
             progress.update_progress(100, message)
             return True
+        
+        except OperationCancelled:
+            # A newer request replaced this one
+            return False
             
         # TODO Better exception handling with specific exceptions
         except Exception as ex:
             # Generation failed
             progress.fatal_error(message=f'STL generation unsuccessful : {str(ex)}', exception=ex)
             return False
+
+
+@dataclass(frozen=True)
+class ConversionJob:
+    """
+    Everything needed to convert one image, independently of any other conversion
+    It can be sent to another process, to convert several images at once
+    """
+    imagePath: str
+    meshParameters: MeshGenerationParameters = field(default_factory=MeshGenerationParameters)
+    # Height of each detected color, from the most to the least common. Defaults to their rank.
+    colorHeights: Tuple[float, ...] = None
+    preserveAspectRatio: bool = True
+    progressive: bool = False
+    draftResolution: int = 150
+    maxImagePixels: int = 1 << 24
+    maxDecodePixels: int = 1 << 27
+    resourceBudget: ResourceBudget = field(default_factory=ResourceBudget)
+    paletteEngine: str = "ward"
+    plateLayout: PlateLayout = field(default_factory=PlateLayout)
+    # Palette shared by a series of images. Its heights are used unless colorHeights is given.
+    sharedPalette: SharedPalette = None
+
+@dataclass
+class ConversionResult:
+    """Outcome of a ConversionJob"""
+    imagePath: str
+    success: bool
+    # Hex representation of the detected colors, from the most to the least common
+    colors: List[str] = field(default_factory=list)
+    # Paths of the generated files
+    outputPaths: List[str] = field(default_factory=list)
+    # Messages of the errors that happened, if any
+    errors: List[str] = field(default_factory=list)
+    # Validation reports of the generated meshes, one per plate (empty if the validation is disabled)
+    validationReports: List[MeshValidationReport] = field(default_factory=list)
+
+def runConversion(job: ConversionJob, progress: Progress = None) -> ConversionResult:
+    """Converts an image, with its own copy of the parameters of the job
+    Being a module level function, it can be used with any executor, including process pools
+
+    Args:
+        job (ConversionJob): The conversion to run
+        progress (Progress, optional): Object used to notify the program when progress is made. Defaults to None (the errors are only kept in the result).
+
+    Returns:
+        ConversionResult: The outcome of the conversion
+    """
+    errors = []
+    if progress is None:
+        progress = Progress(callback=lambda value, message="": None, error_callback=errors.append, max=100)
+    imgToStl = ImgToStl(preserveAspectRatio=job.preserveAspectRatio, progressive=job.progressive, draftResolution=job.draftResolution,
+                        maxImagePixels=job.maxImagePixels, maxDecodePixels=job.maxDecodePixels, paletteEngine=job.paletteEngine,
+                        resourceBudget=dataclasses.replace(job.resourceBudget), meshParameters=dataclasses.replace(job.meshParameters),
+                        plateLayout=dataclasses.replace(job.plateLayout), sharedPalette=job.sharedPalette)
+    try:
+        success = imgToStl.loadImageSync(job.imagePath, progress.make_child(0,50))
+        if success and job.colorHeights is not None:
+            imgToStl.colors_definitions = [ColorDefinition(color, height) for color, height in zip(imgToStl.colors, job.colorHeights)]
+        success = success and imgToStl.generateMeshSync(progress.make_child(50,100))
+    finally:
+        imgToStl.close()
+
+    return ConversionResult(imagePath=job.imagePath, success=success, colors=list(imgToStl.colors),
+                            outputPaths=list(imgToStl.outputPaths) if success else [], errors=errors,
+                            validationReports=list(imgToStl.validationReports) if success else [])
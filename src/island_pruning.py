@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+from scipy import ndimage
+from typing import Tuple
+
+def connected_regions(label_image: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Splits a label map into regions : sets of 4-connected pixels of the same label
+
+    Args:
+        label_image (np.ndarray): The label map, as a 2D array of integers
+
+    Returns:
+        Tuple[np.ndarray, int]: The region of each pixel, from 0, and the amount of regions
+    """
+    regions = np.empty(label_image.shape, dtype=np.int32)
+    nb_regions = 0
+    # One labeling per label, each of them done by OpenCV on the whole image
+    for label in np.unique(label_image):
+        mask = label_image == label
+        count, components = cv2.connectedComponents(mask.view(np.uint8), connectivity=4, ltype=cv2.CV_32S)
+        # The component 0 of OpenCV is the background, outside of the mask
+        regions[mask] = components[mask] + (nb_regions - 1)
+        nb_regions += count - 1
+    return regions, nb_regions
+
+def region_widths(label_image: np.ndarray, regions: np.ndarray, nb_regions: int) -> np.ndarray:
+    """Estimates the width of each region, as the diameter of the largest disk that fits in it
+
+    Args:
+        label_image (np.ndarray): The label map
+        regions (np.ndarray): The region of each pixel, made by connected_regions
+        nb_regions (int): The amount of regions
+
+    Returns:
+        np.ndarray: The approximate width of each region, in pixels
+    """
+    # Pixels next to a pixel of another label are at the edge of their region. The sides of the image are not edges.
+    is_inside = np.ones(label_image.shape, dtype=np.uint8)
+    vertical = label_image[1:, :] != label_image[:-1, :]
+    horizontal = label_image[:, 1:] != label_image[:, :-1]
+    is_inside[1:, :][vertical] = 0
+    is_inside[:-1, :][vertical] = 0
+    is_inside[:, 1:][horizontal] = 0
+    is_inside[:, :-1][horizontal] = 0
+    distances = cv2.distanceTransform(is_inside, cv2.DIST_L2, 3)
+    return 2 * ndimage.maximum(distances, regions, index=np.arange(nb_regions)) + 1
+
+def prune_islands(label_image: np.ndarray, min_area: float, min_width: float = 0) -> np.ndarray:
+    """Merges the regions that are too small or too thin to be printed into the regions that surround them
+    Every region is measured and merged at once, in a single pass : each pixel of a merged region takes the label of the closest pixel
+    of a region that is kept, so that a speck next to another speck also joins the region around both.
+
+    Args:
+        label_image (np.ndarray): The label map, as a 2D array of integers
+        min_area (float): Regions with less pixels than this are merged
+        min_width (float, optional): Regions narrower than this, in pixels, are merged. Defaults to 0.
+
+    Returns:
+        np.ndarray: The new label map, with the same type as label_image (label_image itself if nothing was merged)
+    """
+    if (min_area <= 1 and min_width <= 1) or label_image.size == 0:
+        return label_image
+    regions, nb_regions = connected_regions(label_image)
+    areas = np.bincount(regions.ravel(), minlength=nb_regions)
+    is_pruned = areas < min_area
+    if min_width > 1:
+        is_pruned |= region_widths(label_image, regions, nb_regions) < min_width
+    # The largest region is always kept, so that every pixel has a region to join
+    is_pruned[areas.argmax()] = False
+    if not is_pruned.any():
+        return label_image
+
+    is_pruned_pixel = is_pruned[regions]
+    # OpenCV numbers the pixels of the kept regions in raster order, and gives to every pixel the number of the closest one
+    _, closest = cv2.distanceTransformWithLabels(is_pruned_pixel.view(np.uint8), cv2.DIST_L2, 3, labelType=cv2.DIST_LABEL_PIXEL)
+    kept_labels = label_image[~is_pruned_pixel]
+    pruned = label_image.copy()
+    pruned[is_pruned_pixel] = kept_labels[closest[is_pruned_pixel] - 1]
+    return pruned
+
+def island_thresholds(shape: Tuple[int, int], widthMM: float, heightMM: float, minAreaMM2: float, minWidthMM: float) -> Tuple[float, float]:
+    """Converts the minimum size of the regions from mm to pixels of a label map covering the whole mesh
+
+    Args:
+        shape (Tuple[int, int]): Shape of the label map (rows, columns), one pixel per vertex of the grid
+        widthMM (float): Width of the mesh, in mm (along the columns)
+        heightMM (float): Height of the mesh, in mm (along the rows)
+        minAreaMM2 (float): Minimum area of a region, in mm², or None
+        minWidthMM (float): Minimum width of a region, in mm, or None
+
+    Returns:
+        Tuple[float, float]: The minimum area in pixels and the minimum width in pixels
+    """
+    pixel_height = heightMM / max(1, shape[0] - 1)
+    pixel_width = widthMM / max(1, shape[1] - 1)
+    min_area = (minAreaMM2 or 0) / (pixel_height * pixel_width)
+    min_width = (minWidthMM or 0) / ((pixel_height + pixel_width) / 2)
+    return min_area, min_width
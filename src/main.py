@@ -1,8 +1,17 @@
-from argparse import ArgumentParser
+import os
+from argparse import ArgumentParser, ArgumentTypeError
+from multiprocessing import freeze_support
 from set_env import set_blender_env
 
+# Environment variables read by the BLAS and OpenMP libraries of NumPy when they are loaded
+THREAD_LIMIT_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
 def main():
     args = parseArgs()
+    if args.workers is not None:
+        # NumPy is not imported yet : its thread pools will be created with this limit (variables set by the user win)
+        for variable in THREAD_LIMIT_VARIABLES:
+            os.environ.setdefault(variable, str(max(1, args.workers)))
     if args.silent:
         main_no_gui(args)
     else:
@@ -27,19 +36,128 @@ def main_no_gui(args: ArgumentParser):
         # This imports bpy, and thus needs to happen after set_blender_env
         from img_to_stl import ImgToStl
         
-        if args.file is None:
-            print("No file was specified. Use '-f' to specify a file to convert.")
+        files = args.batch or ([args.file] if args.file is not None else [])
+        if args.spool is not None and not files:
+            from spool import run_local_workers, run_worker
+            if args.spool_workers > 1:
+                run_local_workers(args.spool, args.spool_workers, exitWhenIdle=args.exit_when_idle, leaseSeconds=args.lease)
+            else:
+                run_worker(args.spool, exitWhenIdle=args.exit_when_idle, leaseSeconds=args.lease)
+        elif not files:
+            print("No file was specified. Use '-f' to specify a file to convert, or '--batch' for several files.")
         else:        
-            filepath = args.file
             img_to_stl = ImgToStl()
-            progress = ConsoleProgress(max=100)
-            img_to_stl.loadImageAndGenerateMesh(filepath, progress)
+            img_to_stl.progressive = args.draft
+            img_to_stl.meshParameters.featureSizeMM = args.feature_size
+            img_to_stl.meshParameters.maxTriangles = args.max_triangles
+            img_to_stl.meshParameters.simplification = args.simplification
+            img_to_stl.meshParameters.save3MF = args.save_3mf
+            img_to_stl.meshParameters.savePLY = args.save_ply
+            if args.blend is not None:
+                img_to_stl.meshParameters.saveBlendFile = True
+                img_to_stl.meshParameters.blendContent = args.blend
+            img_to_stl.meshParameters.validation = args.validate
+            img_to_stl.meshParameters.minIslandAreaMM2 = args.min_island_area
+            img_to_stl.meshParameters.minIslandWidthMM = args.min_island_width
+            if args.max_pixels is not None:
+                img_to_stl.maxImagePixels = args.max_pixels
+            img_to_stl.paletteEngine = args.palette_engine
+            img_to_stl.plateLayout.columns, img_to_stl.plateLayout.rows = args.plates
+            img_to_stl.plateLayout.registrationMarkMM = args.registration_mark
+            img_to_stl.resourceBudget.maxMemoryMB = args.max_memory
+            img_to_stl.resourceBudget.maxWorkers = args.workers
+            if args.dry_run:
+                # Only the header of the images is read
+                for filepath in files:
+                    print(img_to_stl.planConversion(filepath).describe())
+                return
+            if args.palette is not None:
+                img_to_stl.sharedPalette = loadOrBuildPalette(args.palette, [args.palette_reference] if args.palette_reference else files, args.palette_engine)
+            if args.spool is not None:
+                from img_to_stl import ConversionJob
+                from spool import JobSpool
+                spool = JobSpool(args.spool)
+                for filepath in files:
+                    job = ConversionJob(filepath, meshParameters=img_to_stl.meshParameters, progressive=img_to_stl.progressive,
+                                        maxImagePixels=img_to_stl.maxImagePixels, resourceBudget=img_to_stl.resourceBudget,
+                                        paletteEngine=img_to_stl.paletteEngine, plateLayout=img_to_stl.plateLayout, sharedPalette=img_to_stl.sharedPalette)
+                    print(spool.submit(filepath, job))
+                return
+            for filepath in files:
+                if len(files) > 1:
+                    print(f"\n{filepath}")
+                progress = ConsoleProgress(max=100)
+                # Each file starts from the options only, without the colors of the previous one
+                conversion = img_to_stl.snapshot()
+                try:
+                    conversion.loadImageAndGenerateMesh(filepath, progress, onDraftReady=lambda path: print(f"\nDraft STL file ready : {path}")).result()
+                finally:
+                    # The flat image of the file is not needed anymore : a long batch must not fill the scratch workspace
+                    conversion.close()
+
+def loadOrBuildPalette(palettePath: str, imagePaths: list, engine: str):
+    """Reads a shared palette file, or builds it from images and saves it when it does not exist yet"""
+    import os
+    from shared_palette import SharedPalette, build_shared_palette
+    if os.path.exists(palettePath):
+        return SharedPalette.load(palettePath)
+    palette = build_shared_palette(imagePaths, engine)
+    palette.save(palettePath)
+    print(f"Palette of {len(palette.colors)} colors saved to '{palettePath}' : edit its heights and convert again to change them")
+    return palette
+
+def parsePlates(value: str):
+    """Reads a plate layout such as '2x3' (columns x rows)"""
+    try:
+        columns, rows = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise ArgumentTypeError(f"invalid plate layout '{value}', expected COLUMNSxROWS such as 2x3")
+    if columns < 1 or rows < 1:
+        raise ArgumentTypeError(f"invalid plate layout '{value}', there must be at least one plate in each direction")
+    return columns, rows
 
 def parseArgs():
     argParser = ArgumentParser()
     argParser.add_argument("-f", "--file", help="Path to the image file to convert")
+    argParser.add_argument("--batch", nargs="+", metavar="FILE", help="Paths to several image files, converted one after the other with the same options")
+    argParser.add_argument("--palette", metavar="PALETTE.json",
+                           help="Palette shared by the files : its colors and heights are used for every file. It is built from the files and saved if it does not exist.")
+    argParser.add_argument("--palette-reference", metavar="IMAGE", help="Image from which the palette is built, instead of a sample of all the files")
     argParser.add_argument("-s", "--silent", "--no-gui", action='store_true', help="Launch the program in console only mode")
+    argParser.add_argument("--feature-size", type=float, help="Smallest distance between two vertices of the mesh, in mm")
+    argParser.add_argument("--max-triangles", type=int, help="Maximum number of triangles on the top of the mesh")
+    argParser.add_argument("--min-island-area", type=float, default=1., metavar="AREA",
+                           help="Regions of a color smaller than this area, in mm², are merged into the region around them (0 to keep them)")
+    argParser.add_argument("--min-island-width", type=float, metavar="WIDTH",
+                           help="Regions of a color narrower than this, in mm, are merged into the region around them")
+    argParser.add_argument("--simplification", choices=["blender", "numpy", "none"], default="blender",
+                           help="How the mesh is simplified : by Blender modifiers during export, by the built-in simplifier (no Blender needed), or not at all")
+    argParser.add_argument("--3mf", dest="save_3mf", action='store_true', help="Also generate a 3MF file, with one material per color")
+    argParser.add_argument("--ply", dest="save_ply", action='store_true', help="Also generate a binary PLY file, with the colors on the faces")
+    argParser.add_argument("--blend", nargs="?", const="simplified", choices=["simplified", "full"],
+                           help="Also save a BLEND file (needs Blender) : only the simplified mesh (default), or the full resolution mesh with its modifiers")
+    argParser.add_argument("--validate", choices=["report", "fail", "none"], default="report",
+                           help="Check that the mesh is watertight before export : print the problems, refuse to export an invalid mesh, or skip the check")
+    argParser.add_argument("--palette-engine", choices=["ward", "kmeans", "median-cut", "octree"], default="ward",
+                           help="How the colors of the image are found : Ward clustering, k-means on a sample of the pixels, median cut or octree quantization")
+    argParser.add_argument("--plates", type=parsePlates, default=(1, 1), metavar="COLUMNSxROWS",
+                           help="Split the mesh into plates that are printed separately, for example 2x3 for 2 plates along the width and 3 along the height")
+    argParser.add_argument("--registration-mark", type=float, default=0., metavar="SIZE",
+                           help="Side of the raised marks across the seams between plates, in mm. They replace the relief under them (none by default)")
+    argParser.add_argument("--max-pixels", type=int, help="Larger images are downscaled to this amount of pixels while being decoded")
+    argParser.add_argument("--max-memory", type=float, help="Memory budget in MB : the conversion is adjusted to fit in it, or refused")
+    argParser.add_argument("--workers", type=int, help="Maximum amount of processes and threads used")
+    argParser.add_argument("--dry-run", action='store_true', help="Print the estimated resources and outputs of the conversion, without running it")
+    argParser.add_argument("--spool", metavar="DIR",
+                           help="Shared job directory : with '-f', the file is added to it as a job, otherwise the jobs in it are converted")
+    argParser.add_argument("--spool-workers", type=int, default=1, help="Amount of worker processes converting the jobs of the spool")
+    argParser.add_argument("--lease", type=float, default=300,
+                           help="Seconds after which a job whose worker stopped responding is given to another worker")
+    argParser.add_argument("--exit-when-idle", action='store_true', help="Stop the workers of the spool when no job is left")
+    argParser.add_argument("-d", "--draft", action='store_true', help="Generate a quick low resolution STL file first, replaced by the full resolution one when done")
     return argParser.parse_args()
 
 if __name__ == '__main__':
+    # Needed by the worker processes of the color detection in the exe version
+    freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,119 @@
+import zipfile
+import numpy as np
+from html import escape
+from typing import List, Tuple
+
+def face_normals(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Computes the unit normal of each face
+
+    Args:
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh, as triplets of vertex indices
+
+    Returns:
+        np.ndarray: The normals, as an array of shape (len(faces), 3)
+    """
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(b - a, c - a)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(lengths > 0, lengths, 1)
+
+def write_stl(filepath: str, vertices: np.ndarray, faces: np.ndarray) -> None:
+    """Writes a mesh as a binary STL file, without needing Blender
+
+    Args:
+        filepath (str): Path to the output file
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh, as triplets of vertex indices
+    """
+    record = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+    data = np.empty(len(faces), dtype=record)
+    data['normal'] = face_normals(vertices, faces)
+    data['vertices'] = vertices[faces]
+    data['attribute'] = 0
+    with open(filepath, 'wb') as file:
+        file.write(b'Image2Touch'.ljust(80, b' '))
+        file.write(np.uint32(len(faces)).tobytes())
+        data.tofile(file)
+
+def hex_to_3mf_color(color: str) -> str:
+    """Converts a hex color such as '#ff8000' to the sRGB format used by 3MF ('#FF8000FF')"""
+    return color.upper() + "FF"
+
+def write_ply(filepath: str, vertices: np.ndarray, faces: np.ndarray, face_colors: np.ndarray = None) -> None:
+    """Writes a mesh as a binary PLY file, in which each vertex is only stored once
+
+    Args:
+        filepath (str): Path to the output file
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh, as triplets of vertex indices
+        face_colors (np.ndarray, optional): If given, the RGB color of each face. Defaults to None.
+    """
+    face_fields = [('count', 'u1'), ('indices', '<i4', (3,))]
+    header = ["ply", "format binary_little_endian 1.0", "comment Image2Touch",
+              f"element vertex {len(vertices)}", "property float x", "property float y", "property float z",
+              f"element face {len(faces)}", "property list uchar int vertex_indices"]
+    if face_colors is not None:
+        face_fields += [('rgb', 'u1', (3,))]
+        header += ["property uchar red", "property uchar green", "property uchar blue"]
+    header += ["end_header"]
+
+    face_data = np.empty(len(faces), dtype=np.dtype(face_fields))
+    face_data['count'] = 3
+    face_data['indices'] = faces
+    if face_colors is not None:
+        face_data['rgb'] = face_colors
+    with open(filepath, 'wb') as file:
+        file.write(("\n".join(header) + "\n").encode('ascii'))
+        np.ascontiguousarray(vertices, dtype='<f4').tofile(file)
+        face_data.tofile(file)
+
+def write_3mf(filepath: str, vertices: np.ndarray, faces: np.ndarray, face_materials: np.ndarray = None, materials: List[Tuple[str, str]] = None,
+              chunk_size: int = 1 << 18) -> None:
+    """Writes a mesh as a 3MF file, in which each vertex is only stored once and each face can have its own material
+    The model is written to the archive as a stream, chunk by chunk
+
+    Args:
+        filepath (str): Path to the output file
+        vertices (np.ndarray): The vertices of the mesh, in mm
+        faces (np.ndarray): The faces of the mesh, as triplets of vertex indices
+        face_materials (np.ndarray, optional): If given, the index in materials of the material of each face. Defaults to None.
+        materials (List[Tuple[str, str]], optional): Name and hex color of each material. Defaults to None.
+        chunk_size (int, optional): Amount of vertices or faces written at once. Defaults to 2^18.
+    """
+    content_types = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                     '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+                     '</Types>')
+    relationships = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                     '<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+                     '</Relationships>')
+    has_materials = face_materials is not None and materials
+    with zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("_rels/.rels", relationships)
+        with archive.open("3D/3dmodel.model", 'w', force_zip64=True) as model:
+            model.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                        b'<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+                        b'<resources>\n')
+            if has_materials:
+                # One material per region of the image, so that multi-material printers can use them
+                model.write(b'<basematerials id="1">\n')
+                for name, color in materials:
+                    model.write(f'<base name="{escape(name, quote=True)}" displaycolor="{hex_to_3mf_color(color)}"/>\n'.encode('utf-8'))
+                model.write(b'</basematerials>\n<object id="2" type="model" pid="1" pindex="0">\n')
+            else:
+                model.write(b'<object id="2" type="model">\n')
+            model.write(b'<mesh>\n<vertices>\n')
+            for start in range(0, len(vertices), chunk_size):
+                np.savetxt(model, vertices[start:start+chunk_size], fmt='<vertex x="%.4f" y="%.4f" z="%.4f"/>')
+            model.write(b'</vertices>\n<triangles>\n')
+            for start in range(0, len(faces), chunk_size):
+                if has_materials:
+                    chunk = np.column_stack((faces[start:start+chunk_size], face_materials[start:start+chunk_size]))
+                    np.savetxt(model, chunk, fmt='<triangle v1="%d" v2="%d" v3="%d" p1="%d"/>')
+                else:
+                    np.savetxt(model, faces[start:start+chunk_size], fmt='<triangle v1="%d" v2="%d" v3="%d"/>')
+            model.write(b'</triangles>\n</mesh>\n</object>\n</resources>\n<build>\n<item objectid="2"/>\n</build>\n</model>\n')
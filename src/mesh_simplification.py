@@ -0,0 +1,97 @@
+import numpy as np
+from scipy.ndimage import maximum_filter, minimum_filter
+from scipy.spatial import Delaunay
+from typing import Tuple
+
+def find_relevant_vertices(heights: np.ndarray) -> np.ndarray:
+    """Finds the vertices of the height grid that cannot be removed without further checks :
+    the ones on the sides of the grid, and the ones that have a neighbour at a different height
+
+    Args:
+        heights (np.ndarray): The height of each vertex of the grid, as a 2D array
+
+    Returns:
+        np.ndarray: Boolean mask of the relevant vertices, with the shape of the grid
+    """
+    # A vertex is inside a flat area if its 8 neighbours are at its height
+    is_flat = maximum_filter(heights, size=3, mode='nearest') == minimum_filter(heights, size=3, mode='nearest')
+    is_relevant = ~is_flat
+    is_relevant[0, :] = True
+    is_relevant[-1, :] = True
+    is_relevant[:, 0] = True
+    is_relevant[:, -1] = True
+    return is_relevant
+
+def orient_counterclockwise(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Reorders the vertices of 2D triangles so that they all turn counterclockwise
+
+    Args:
+        points (np.ndarray): The vertices, as an array of shape (n, 2)
+        triangles (np.ndarray): The triangles, as indices of the vertices
+
+    Returns:
+        np.ndarray: The reoriented triangles
+    """
+    a, b, c = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+    is_clockwise = (b[:, 0]-a[:, 0])*(c[:, 1]-a[:, 1]) - (b[:, 1]-a[:, 1])*(c[:, 0]-a[:, 0]) < 0
+    triangles = triangles.copy()
+    triangles[is_clockwise] = triangles[is_clockwise][:, [0, 2, 1]]
+    return triangles
+
+def interpolation_error(triangulation: Delaunay, values: np.ndarray, samples: np.ndarray, sample_values: np.ndarray,
+                        chunk_size: int = 1 << 20) -> np.ndarray:
+    """Computes the difference between known values at sample points and the values interpolated linearly on a triangulation
+
+    Args:
+        triangulation (Delaunay): The triangulation
+        values (np.ndarray): The value at each vertex of the triangulation
+        samples (np.ndarray): The sample points, as an array of shape (m, 2)
+        sample_values (np.ndarray): The known value at each sample point
+        chunk_size (int, optional): Amount of sample points processed at once, to limit memory usage. Defaults to 2^20.
+
+    Returns:
+        np.ndarray: The absolute error at each sample point
+    """
+    errors = np.empty(len(samples))
+    for start in range(0, len(samples), chunk_size):
+        chunk = samples[start:start+chunk_size]
+        simplex = triangulation.find_simplex(chunk)
+        # Barycentric coordinates, using the affine transforms precomputed by Qhull
+        transform = triangulation.transform[simplex]
+        weights = np.einsum('ijk,ik->ij', transform[:, :2], chunk - transform[:, 2])
+        weights = np.column_stack((weights, 1 - weights.sum(axis=1)))
+        interpolated = np.einsum('ij,ij->i', weights, values[triangulation.simplices[simplex]])
+        errors[start:start+chunk_size] = np.abs(interpolated - sample_values[start:start+chunk_size])
+    return errors
+
+def simplify_height_grid(heights: np.ndarray, tolerance: float, max_iterations: int = 32) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Triangulates a height grid with as few vertices as possible
+    The vertices inside flat areas are removed, and the remaining ones are triangulated again.
+    Removed vertices for which the new surface is further than the tolerance are added back, until none is.
+    The result only depends on the input, and the error is bounded at every vertex of the original grid.
+
+    Args:
+        heights (np.ndarray): The height of each vertex of the grid, as a 2D array
+        tolerance (float): Maximum vertical distance between a removed vertex and the new surface, in the unit of heights
+        max_iterations (int, optional): After this amount of refinements, the error is not checked anymore. Defaults to 32.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, float]: Mask of the kept vertices (with the shape of the grid), counterclockwise triangles
+        as grid coordinates (array of shape (m, 3, 2)), and the maximum error at the removed vertices
+    """
+    is_kept = find_relevant_vertices(heights)
+    for _ in range(max_iterations + 1):
+        points = np.argwhere(is_kept)
+        triangulation = Delaunay(points)
+        removed = np.argwhere(~is_kept)
+        if len(removed) == 0:
+            max_error = 0.
+            break
+        errors = interpolation_error(triangulation, heights[is_kept].astype(np.float64), removed, heights[~is_kept].astype(np.float64))
+        max_error = float(errors.max())
+        is_too_far = errors > tolerance
+        if not is_too_far.any():
+            break
+        # The vertices that are too far are added back for the next triangulation
+        is_kept[tuple(removed[is_too_far].T)] = True
+    return is_kept, points[orient_counterclockwise(points, triangulation.simplices)], max_error
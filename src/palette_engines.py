@@ -0,0 +1,235 @@
+import math
+import numpy as np
+from abc import ABC, abstractmethod
+import cv2
+from scipy.cluster.hierarchy import ward, fcluster
+from scipy.spatial.distance import pdist
+from typing import Dict, List
+
+# Most engines need a maximum amount of colors : maps rarely have more, and the colors covering too few pixels are filtered afterwards anyway
+DEFAULT_MAX_COLORS = 24
+# The clusters of the engines that split the colors up to a fixed amount are merged when their mean colors are closer than this
+DEFAULT_MERGE_DISTANCE = 40.
+# Amount of pixels on which k-means runs
+KMEANS_SAMPLE_SIZE = 20000
+
+class PaletteEngine(ABC):
+    """
+    Groups the colors of an image into the colors of its palette
+    The engines work on the histogram of the quantized colors of the image, so that their cost barely depends on the size of the image.
+    An engine that does not implement cluster cannot be created.
+    """
+    # Name used to select the engine (GUI, command line, conversion jobs)
+    name: str = None
+    # Short description, for the user
+    description: str = None
+
+    @abstractmethod
+    def cluster(self, colors: np.ndarray, counts: np.ndarray, image: np.ndarray) -> np.ndarray:
+        """Gives a label to each quantized color
+
+        Args:
+            colors (np.ndarray): The quantized colors present in the image, as an array of shape (n, 3)
+            counts (np.ndarray): The amount of pixels of each quantized color
+            image (np.ndarray): The RGB image itself, for the engines that work on pixels
+
+        Returns:
+            np.ndarray: The label of each quantized color, as non-negative integers
+        """
+
+class WardEngine(PaletteEngine):
+    """Ward hierarchical clustering of the colors, cut at a fixed distance. Finds the amount of colors by itself, but is the slowest on noisy images."""
+    name = "ward"
+    description = "Ward hierarchical clustering (default, the most robust)"
+
+    def __init__(self, distance_min_squared: float = 100):
+        """
+        Args:
+            distance_min_squared (float, optional): Distance at which the hierarchy is cut. Defaults to 100.
+        """
+        self.distance_min_squared = distance_min_squared
+
+    def cluster(self, colors: np.ndarray, counts: np.ndarray, image: np.ndarray) -> np.ndarray:
+        # Makes a small sample of colors by imitating the color rations in the original image. It has all unique colors.
+        total = counts.sum()
+        repeats = np.maximum(1, np.floor(100 * counts / total)).astype(int)
+        color_list_duplicates = np.concatenate([colors, np.repeat(colors, repeats, axis=0)])
+        Z = ward(pdist(color_list_duplicates))
+        return fcluster(Z, self.distance_min_squared, criterion='distance')[0:len(colors)]
+
+class KMeansEngine(PaletteEngine):
+    """k-means (OpenCV) on a random sample of the pixels, each quantized color then taking the label of the closest center"""
+    name = "kmeans"
+    description = "k-means on a sample of the pixels (fast, good on noisy scans)"
+
+    def __init__(self, max_colors: int = DEFAULT_MAX_COLORS, merge_distance: float = DEFAULT_MERGE_DISTANCE, sample_size: int = KMEANS_SAMPLE_SIZE):
+        """
+        Args:
+            max_colors (int, optional): Amount of centers. Defaults to DEFAULT_MAX_COLORS.
+            merge_distance (float, optional): Centers closer than this are merged. Defaults to DEFAULT_MERGE_DISTANCE.
+            sample_size (int, optional): Amount of pixels used to find the centers. Defaults to KMEANS_SAMPLE_SIZE.
+        """
+        self.max_colors = max_colors
+        self.merge_distance = merge_distance
+        self.sample_size = sample_size
+
+    def cluster(self, colors: np.ndarray, counts: np.ndarray, image: np.ndarray) -> np.ndarray:
+        k = min(self.max_colors, len(colors))
+        if k <= 1:
+            return np.zeros(len(colors), dtype=np.int32)
+        pixels = image.reshape(-1, 3)
+        # The same image always gives the same palette
+        rng = np.random.default_rng(0)
+        if len(pixels) > self.sample_size:
+            pixels = pixels[rng.choice(len(pixels), self.sample_size, replace=False)]
+        cv2.setRNGSeed(0)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.)
+        _, _, centers = cv2.kmeans(pixels.astype(np.float32), k, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+        distances = ((colors[:, None, :].astype(np.float32) - centers[None, :, :])**2).sum(axis=2)
+        return merge_close_labels(colors, counts, distances.argmin(axis=1), self.merge_distance)
+
+class MedianCutEngine(PaletteEngine):
+    """Median cut : the box of colors with the largest spread is split at its median, until every box is small enough or there are enough boxes"""
+    name = "median-cut"
+    description = "Median cut (fastest, good on clean maps)"
+
+    def __init__(self, max_colors: int = DEFAULT_MAX_COLORS, merge_distance: float = DEFAULT_MERGE_DISTANCE):
+        """
+        Args:
+            max_colors (int, optional): Maximum amount of boxes. Defaults to DEFAULT_MAX_COLORS.
+            merge_distance (float, optional): Boxes narrower than this are not split, and closer ones are merged. Defaults to DEFAULT_MERGE_DISTANCE.
+        """
+        self.max_colors = max_colors
+        self.merge_distance = merge_distance
+
+    def cluster(self, colors: np.ndarray, counts: np.ndarray, image: np.ndarray) -> np.ndarray:
+        labels = np.zeros(len(colors), dtype=np.int32)
+        nb_boxes = 1
+        while nb_boxes < self.max_colors:
+            # The box to split is the one with the largest spread along a channel, weighted by its pixels
+            best = None
+            for box in range(nb_boxes):
+                members = np.flatnonzero(labels == box)
+                spread = colors[members].max(axis=0) - colors[members].min(axis=0)
+                channel = int(spread.argmax())
+                score = spread[channel] * math.sqrt(counts[members].sum())
+                if spread[channel] > self.merge_distance and (best is None or score > best[0]):
+                    best = (score, members, channel)
+            if best is None:
+                break
+            _, members, channel = best
+            # Weighted median along the channel
+            order = members[np.argsort(colors[members, channel], kind="stable")]
+            cumulated = np.cumsum(counts[order])
+            median = colors[order[np.searchsorted(cumulated, cumulated[-1] / 2)], channel]
+            upper = members[colors[members, channel] > median]
+            if len(upper) == 0 or len(upper) == len(members):
+                upper = members[colors[members, channel] >= median]
+            labels[upper] = nb_boxes
+            nb_boxes += 1
+        return merge_close_labels(colors, counts, labels, self.merge_distance)
+
+class OctreeEngine(PaletteEngine):
+    """Octree quantization : the colors are the leaves of an octree of their bits, the leaves with the least pixels being merged into their parent"""
+    name = "octree"
+    description = "Octree quantization (fast, keeps small but distinct colors)"
+
+    def __init__(self, max_colors: int = DEFAULT_MAX_COLORS, merge_distance: float = DEFAULT_MERGE_DISTANCE):
+        """
+        Args:
+            max_colors (int, optional): Maximum amount of leaves. Defaults to DEFAULT_MAX_COLORS.
+            merge_distance (float, optional): Leaves whose mean colors are closer than this are merged. Defaults to DEFAULT_MERGE_DISTANCE.
+        """
+        self.max_colors = max_colors
+        self.merge_distance = merge_distance
+
+    def cluster(self, colors: np.ndarray, counts: np.ndarray, image: np.ndarray) -> np.ndarray:
+        colors = colors.astype(np.int64)
+        # Depth of the leaf of each color. Depth 8 would hold every color, but the colors are already quantized.
+        depth = np.full(len(colors), 8)
+        while True:
+            keys = octree_keys(colors, depth)
+            leaves, labels = np.unique(keys, return_inverse=True)
+            if len(leaves) <= self.max_colors:
+                break
+            # Among the deepest leaves, the children of the parent with the least pixels are merged into it
+            deepest = depth == depth.max()
+            parent_keys = octree_keys(colors[deepest], depth[deepest] - 1)
+            parents, parent_index = np.unique(parent_keys, return_inverse=True)
+            smallest = np.bincount(parent_index, weights=counts[deepest]).argmin()
+            depth[np.flatnonzero(deepest)[parent_index == smallest]] -= 1
+        return merge_close_labels(colors, counts, labels.ravel(), self.merge_distance)
+
+def octree_keys(colors: np.ndarray, depth: np.ndarray) -> np.ndarray:
+    """Identifies the node of an octree that holds each color at a given depth
+
+    Args:
+        colors (np.ndarray): The colors, as 8 bit RGB values of shape (n, 3)
+        depth (np.ndarray): The depth of each node, from 0 (root) to 8
+
+    Returns:
+        np.ndarray: A key that is unique to each node
+    """
+    shift = (8 - depth)[:, None]
+    prefix = colors >> shift
+    return (((depth << 8 | prefix[:, 0]) << 8 | prefix[:, 1]) << 8) | prefix[:, 2]
+
+def merge_close_labels(colors: np.ndarray, counts: np.ndarray, labels: np.ndarray, merge_distance: float) -> np.ndarray:
+    """Merges the labels whose mean colors are closer than a distance, the closest ones first
+
+    Args:
+        colors (np.ndarray): The quantized colors, of shape (n, 3)
+        counts (np.ndarray): The amount of pixels of each color
+        labels (np.ndarray): The label of each color
+        merge_distance (float): Labels closer than this are merged
+
+    Returns:
+        np.ndarray: The new labels, from 0 to the amount of labels - 1
+    """
+    _, labels = np.unique(labels, return_inverse=True)
+    labels = labels.ravel()
+    weights = np.bincount(labels, weights=counts).astype(float)
+    means = np.stack([np.bincount(labels, weights=counts * colors[:, i]) for i in range(3)], axis=1) / weights[:, None]
+    # The amount of labels is small : merging them one pair at a time is cheap
+    parent = np.arange(len(weights))
+    alive = np.ones(len(weights), dtype=bool)
+    while alive.sum() > 1:
+        indices = np.flatnonzero(alive)
+        distances = np.sqrt(((means[indices, None, :] - means[None, indices, :])**2).sum(axis=2))
+        np.fill_diagonal(distances, np.inf)
+        a, b = np.unravel_index(distances.argmin(), distances.shape)
+        if distances[a, b] >= merge_distance:
+            break
+        a, b = indices[a], indices[b]
+        means[a] = (means[a] * weights[a] + means[b] * weights[b]) / (weights[a] + weights[b])
+        weights[a] += weights[b]
+        alive[b] = False
+        parent[parent == b] = a
+    return np.unique(parent, return_inverse=True)[1].ravel()[labels]
+
+# Available engines, by name. The first one is the default.
+PALETTE_ENGINES: Dict[str, PaletteEngine] = {engine.name: engine for engine in [WardEngine(), KMeansEngine(), MedianCutEngine(), OctreeEngine()]}
+
+def palette_engine_names() -> List[str]:
+    """Names of the available engines, the default one first"""
+    return list(PALETTE_ENGINES)
+
+def get_palette_engine(engine) -> PaletteEngine:
+    """Finds an engine from its name
+
+    Args:
+        engine (Union[str, PaletteEngine]): Name of the engine, or the engine itself. None gives the default engine.
+
+    Raises:
+        ValueError: There is no engine with this name
+
+    Returns:
+        PaletteEngine: The engine
+    """
+    if engine is None:
+        return next(iter(PALETTE_ENGINES.values()))
+    if isinstance(engine, PaletteEngine):
+        return engine
+    if engine not in PALETTE_ENGINES:
+        raise ValueError(f"Unknown palette engine '{engine}', available engines are : {', '.join(PALETTE_ENGINES)}")
+    return PALETTE_ENGINES[engine]
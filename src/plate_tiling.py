@@ -0,0 +1,169 @@
+import dataclasses
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Tuple
+from progress import Progress
+from stl_generation import MeshGenerationParameters, MeshValidationReport, generateSTL, output_paths
+
+@dataclass
+class PlateLayout:
+    """
+    How a mesh is split into plates that fit on the print bed, printed separately and assembled afterwards
+
+    Args:
+        columns (int): Amount of plates along the width of the mesh
+        rows (int): Amount of plates along the height of the mesh
+        registrationMarkMM (float): Side of the registration marks, in mm, or 0 for no marks (default). The marks are raised squares
+            centered on the seams, half on each plate, that show how the plates fit together once printed. They replace the relief
+            under them, so they are only made when asked for.
+        marksPerSeam (int): Amount of registration marks along the seam between two plates
+    """
+    columns: int = 1
+    rows: int = 1
+    registrationMarkMM: float = 0.
+    marksPerSeam: int = 2
+
+    @property
+    def plateCount(self) -> int:
+        """Amount of plates"""
+        return self.columns * self.rows
+
+@dataclass
+class Plate:
+    """One plate of a tiled mesh"""
+    # Position of the plate in the layout, from the top left corner
+    row: int
+    column: int
+    # Part of the height map used by the plate. Neighbouring plates share the row or column of vertices of their seam.
+    rowRange: Tuple[int, int]
+    columnRange: Tuple[int, int]
+    # Parameters of the mesh of the plate : its own size and output path
+    parameters: MeshGenerationParameters
+
+def plate_bounds(nb_points: int, nb_plates: int) -> List[Tuple[int, int]]:
+    """Splits a row of grid points into plates of about the same size, neighbouring plates sharing the point of their seam
+
+    Args:
+        nb_points (int): Amount of points
+        nb_plates (int): Amount of plates
+
+    Raises:
+        ValueError: There are not enough points to make this amount of plates
+
+    Returns:
+        List[Tuple[int, int]]: The first point and the point after the last point of each plate
+    """
+    if nb_plates < 1 or nb_points - 1 < nb_plates:
+        raise ValueError(f"Cannot split a mesh of {nb_points} vertices into {nb_plates} plates")
+    seams = np.linspace(0, nb_points - 1, nb_plates + 1).round().astype(int)
+    return [(int(start), int(end) + 1) for start, end in zip(seams[:-1], seams[1:])]
+
+def plan_plates(shape: Tuple[int, int], parameters: MeshGenerationParameters, layout: PlateLayout) -> List[Plate]:
+    """Splits a height map at the resolution of the mesh into plates
+
+    Args:
+        shape (Tuple[int, int]): Shape of the height map (rows, columns)
+        parameters (MeshGenerationParameters): Parameters of the whole mesh
+        layout (PlateLayout): How the mesh is split
+
+    Returns:
+        List[Plate]: The plates, row by row
+    """
+    nb_rows, nb_cols = shape
+    # The height map already has the resolution of the mesh, the plates must not be resampled again
+    common = dataclasses.replace(parameters, maxResolution=None, featureSizeMM=None, maxTriangles=None)
+    base_path = os.path.splitext(parameters.outputMeshPath)[0]
+    plates = []
+    for row, (row_start, row_end) in enumerate(plate_bounds(nb_rows, layout.rows)):
+        for column, (col_start, col_end) in enumerate(plate_bounds(nb_cols, layout.columns)):
+            # Sizes are proportional to the amount of intervals between the vertices, so that the plates add up to the whole mesh
+            plate_parameters = dataclasses.replace(common, outputMeshPath=f"{base_path}_plate_{row+1}_{column+1}",
+                                                   meshHeightMM=parameters.meshHeightMM * (row_end - 1 - row_start) / (nb_rows - 1),
+                                                   meshWidthMM=parameters.meshWidthMM * (col_end - 1 - col_start) / (nb_cols - 1))
+            plates.append(Plate(row, column, (row_start, row_end), (col_start, col_end), plate_parameters))
+    return plates
+
+def add_registration_marks(height_map: np.ndarray, plates: List[Plate], layout: PlateLayout, parameters: MeshGenerationParameters) -> np.ndarray:
+    """Raises square marks across the seams between plates, to the highest level of the mesh
+
+    Args:
+        height_map (np.ndarray): The height map of the whole mesh
+        plates (List[Plate]): The plates made by plan_plates
+        layout (PlateLayout): How the mesh is split
+        parameters (MeshGenerationParameters): Parameters of the whole mesh
+
+    Returns:
+        np.ndarray: A copy of the height map with the marks (the height map itself if there are no marks)
+    """
+    if layout.registrationMarkMM <= 0 or layout.marksPerSeam <= 0 or layout.plateCount == 1:
+        return height_map
+    nb_rows, nb_cols = height_map.shape
+    # Half side of a mark, in points of the grid
+    half_rows = max(1, int(round(layout.registrationMarkMM / 2 * (nb_rows - 1) / parameters.meshHeightMM)))
+    half_cols = max(1, int(round(layout.registrationMarkMM / 2 * (nb_cols - 1) / parameters.meshWidthMM)))
+    marked = height_map.copy()
+    top = 255
+    for plate in plates:
+        (row_start, row_end), (col_start, col_end) = plate.rowRange, plate.columnRange
+        positions = (np.arange(layout.marksPerSeam) + .5) / layout.marksPerSeam
+        # Each plate marks its right and bottom seams, on the whole length of its side
+        if plate.column < layout.columns - 1:
+            for row in (row_start + positions * (row_end - 1 - row_start)).astype(int):
+                marked[max(0, row - half_rows):row + half_rows + 1, max(0, col_end - 1 - half_cols):col_end + half_cols] = top
+        if plate.row < layout.rows - 1:
+            for col in (col_start + positions * (col_end - 1 - col_start)).astype(int):
+                marked[max(0, row_end - 1 - half_rows):row_end + half_rows, max(0, col - half_cols):col + half_cols + 1] = top
+    return marked
+
+def generate_plate(height_map: np.ndarray, parameters: MeshGenerationParameters, color_index_image: np.ndarray = None,
+                   colors: List[str] = None) -> Tuple[List[str], MeshValidationReport]:
+    """Generates the files of one plate. Being a module level function, it runs in worker processes.
+
+    Returns:
+        Tuple[List[str], MeshValidationReport]: Paths of the generated files, and the validation report of the plate (None if the validation is disabled)
+    """
+    progress = Progress(callback=lambda value, message="": None, error_callback=lambda *args: None, max=100)
+    report = generateSTL(height_map, parameters=parameters, progress=progress, colorIndexImage=color_index_image, colors=colors)
+    return output_paths(parameters), report
+
+def generate_plates(height_map: np.ndarray, parameters: MeshGenerationParameters, layout: PlateLayout, progress: Progress,
+                    color_index_image: np.ndarray = None, colors: List[str] = None, workers: int = None) -> Tuple[List[str], List[MeshValidationReport]]:
+    """Splits a height map into plates, and generates the files of every plate in parallel worker processes
+    The height map and the colors are computed once for the whole mesh, so that the plates share the same palette and heights.
+
+    Args:
+        height_map (np.ndarray): The height map, at the resolution of the whole mesh
+        parameters (MeshGenerationParameters): Parameters of the whole mesh. The output files of each plate are suffixed with its position.
+        layout (PlateLayout): How the mesh is split
+        progress (Progress): Object used to notify the program when progress is made. Its cancellation token is checked as the plates are done.
+        color_index_image (np.ndarray, optional): Color of each point of the height map, for the 3MF and PLY files. Defaults to None.
+        colors (List[str], optional): Hex representation of the colors. Defaults to None.
+        workers (int, optional): Maximum amount of processes. Defaults to the amount of CPUs.
+
+    Returns:
+        Tuple[List[str], List[MeshValidationReport]]: Paths of the generated files, plate by plate, and the validation report of each plate
+    """
+    plates = plan_plates(height_map.shape, parameters, layout)
+    height_map = add_registration_marks(height_map, plates, layout, parameters)
+    progress.update_progress(0, f"Generating {len(plates)} plates")
+    with ProcessPoolExecutor(max_workers=max(1, min(workers or os.cpu_count() or 1, len(plates)))) as pool:
+        futures = {}
+        for plate in plates:
+            rows, cols = slice(*plate.rowRange), slice(*plate.columnRange)
+            plate_colors = None if color_index_image is None else color_index_image[rows, cols]
+            futures[pool.submit(generate_plate, height_map[rows, cols], plate.parameters, plate_colors, colors)] = plate
+        paths, reports = {}, {}
+        try:
+            for done, future in enumerate(as_completed(futures)):
+                plate = futures[future]
+                paths[plate.row, plate.column], reports[plate.row, plate.column] = future.result()
+                progress.update_progress(int(100 * (done + 1) / len(plates)), f"Plate {plate.row+1}, {plate.column+1} done")
+                progress.check_cancelled()
+        except BaseException:
+            # The plates that have not started yet are not needed anymore
+            for future in futures:
+                future.cancel()
+            raise
+    return [path for plate in plates for path in paths[plate.row, plate.column]], [reports[plate.row, plate.column] for plate in plates]
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from typing import List
+from resampling import resize_nearest
+
+class ThumbnailPyramid:
+    """
+    Small multi-level set of thumbnails of an image, each level being half the size of the previous one
+    It is built once (outside of the UI thread), after which thumbnails of any size can be obtained without touching the full image
+    """
+    def __init__(self, image: np.ndarray, max_size: int = 1024, min_size: int = 64):
+        """Constructor for the pyramid
+
+        Args:
+            image (np.ndarray): The RGB image, at any resolution
+            max_size (int, optional): Size of the largest side of the first level. Defaults to 1024.
+            min_size (int, optional): Levels are added until the largest side is smaller than this. Defaults to 64.
+        """
+        self.image_size = (image.shape[1], image.shape[0])
+        self.levels = [np.ascontiguousarray(ThumbnailPyramid._shrink(image, max_size))]
+        while max(self.levels[-1].shape[:2]) > min_size:
+            self.levels.append(ThumbnailPyramid._shrink(self.levels[-1], max(self.levels[-1].shape[:2]) // 2))
+
+    @staticmethod
+    def from_color_indices(color_index_image: np.ndarray, palette: np.ndarray, max_size: int = 1024, min_size: int = 64) -> 'ThumbnailPyramid':
+        """Makes the pyramid of a flat colored image directly from its color indices,
+        without ever building the full resolution RGB image
+
+        Args:
+            color_index_image (np.ndarray): Index of the color of each pixel, as a 2D array
+            palette (np.ndarray): RGB value of each color index
+            max_size (int, optional): Size of the largest side of the first level. Defaults to 1024.
+            min_size (int, optional): Levels are added until the largest side is smaller than this. Defaults to 64.
+
+        Returns:
+            ThumbnailPyramid: The pyramid
+        """
+        # Oversampling twice before the first level keeps its edges smooth
+        pyramid = ThumbnailPyramid(palette[resize_nearest(color_index_image, 2 * max_size)], max_size, min_size)
+        pyramid.image_size = (color_index_image.shape[1], color_index_image.shape[0])
+        return pyramid
+
+    @staticmethod
+    def _shrink(image: np.ndarray, max_size: int) -> np.ndarray:
+        """Downsamples an image by area averaging so that its largest side is at most max_size"""
+        ratio = max_size / max(image.shape[:2])
+        if ratio >= 1:
+            return image
+        new_size = (max(1, int(image.shape[1] * ratio)), max(1, int(image.shape[0] * ratio)))
+        return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+
+    def get(self, max_size: int) -> np.ndarray:
+        """Makes a thumbnail from the smallest level that is still large enough
+
+        Args:
+            max_size (int): Size of the largest side of the thumbnail, in pixels
+
+        Returns:
+            np.ndarray: The thumbnail, as a contiguous RGB image
+        """
+        level = next((l for l in reversed(self.levels) if max(l.shape[:2]) >= max_size), self.levels[0])
+        return np.ascontiguousarray(ThumbnailPyramid._shrink(level, max_size))
+
+class HeightPreview:
+    """
+    Shaded relief of the height map, rendered at preview resolution
+    The downsampled map of color indices is computed once, and each rendering only applies a per-color lookup to it,
+    which takes a few milliseconds at most
+    """
+    def __init__(self, color_index_image: np.ndarray, max_size: int = 200):
+        """Constructor for the preview
+
+        Args:
+            color_index_image (np.ndarray): Index of the color of each pixel of the image, as a 2D array
+            max_size (int, optional): Size of the largest side of the preview, in pixels. Defaults to 200.
+        """
+        self.full_width = color_index_image.shape[1]
+        self.color_indices = resize_nearest(color_index_image, max_size)
+
+    @property
+    def size(self):
+        """Size of the rendered preview, as (width, height)"""
+        return self.color_indices.shape[1], self.color_indices.shape[0]
+
+    def render(self, heights: List[int], imageThicknessMM: float, baseThicknessMM: float, widthMM: float) -> np.ndarray:
+        """Renders the shaded relief of the height map
+
+        Args:
+            heights (List[int]): The height selected for each color, in the order of the color indices
+            imageThicknessMM (float): The thickness of the carved part of the mesh, in mm
+            baseThicknessMM (float): The thickness of the base of the mesh, in mm
+            widthMM (float): The width of the mesh, in mm
+
+        Returns:
+            np.ndarray: The rendered relief, as a contiguous RGB image
+        """
+        # Height of each color in mm, the same way the height map is built : the lowest color is at the base level
+        heights = np.asarray(heights, dtype=np.float32)
+        height_range = heights.max() - heights.min() if len(heights) > 0 else 0
+        if height_range > 0:
+            lut = baseThicknessMM + imageThicknessMM * (heights - heights.min()) / height_range
+        else:
+            lut = np.full(len(heights), baseThicknessMM, dtype=np.float32)
+        z = lut[self.color_indices]
+
+        # Hillshading, with the light coming from the top left corner at a 45° elevation
+        pixel_size_mm = widthMM / self.color_indices.shape[1]
+        # np.gradient needs at least 2 pixels along an axis : a map of a single row or column is flat along it
+        dz_dy, dz_dx = [np.gradient(z, pixel_size_mm, axis=axis) if z.shape[axis] > 1 else np.zeros_like(z) for axis in (0, 1)]
+        light = np.array([-1, -1, np.sqrt(2)], dtype=np.float32) / 2
+        shade = (-dz_dx * light[0] - dz_dy * light[1] + light[2]) / np.sqrt(1 + dz_dx**2 + dz_dy**2)
+
+        # Higher parts are also lighter, so that flat areas at different heights can be told apart
+        elevation = z / max(baseThicknessMM + imageThicknessMM, 1e-6)
+        value = np.clip(255 * (.6 * np.clip(shade, 0, 1) + .4 * elevation), 0, 255).astype(np.uint8)
+        return np.ascontiguousarray(np.dstack((value, value, value)))
@@ -1,12 +1,57 @@
+import threading
+import time
+
+class OperationCancelled(Exception):
+    """Raised inside a long operation when its cancellation token has been cancelled"""
+    pass
+
+class CancellationToken:
+    """
+    Class used to ask a long operation to stop as soon as possible
+    The operation checks the token regularly and raises OperationCancelled once it has been cancelled
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Requests the cancellation of every operation using this token"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """True if the cancellation was requested"""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raises OperationCancelled if the cancellation was requested"""
+        if self._event.is_set():
+            raise OperationCancelled()
+
 class Progress:
     """
     Class used to relay progress information to the UI
+    Updates are coalesced so that the callback is called at most `frame_rate` times per second,
+    except for updates that change the message or reach the maximum value, which are always relayed.
     """
-    def __init__(self, callback, error_callback, max=1):
+    def __init__(self, callback, error_callback, max=1, frame_rate: float = 30, cancel_token: CancellationToken = None):
         self.callback = callback
         self.error_callback = error_callback
         self.max = max
-        
+        self.min_interval = 1 / frame_rate if frame_rate else 0
+        self.cancel_token = cancel_token if cancel_token is not None else CancellationToken()
+
+        # Every child points directly to the root object, with an affine mapping from its own values to the root's values
+        # This way, an update goes through a single function call however deep the children are
+        self._root = self
+        self._offset = 0
+        self._scale = 1
+
+        # State of the rate limiter, only used by the root object
+        self._lock = threading.Lock()
+        self._last_dispatch_time = 0
+        self._last_message = None
+        self._pending = None
+
     def update_progress(self, value, message: str = ""):
         """Call to indicate progress
 
@@ -14,8 +59,40 @@ class Progress:
             value : Total amount of progress made since the beginning
             message (str, optional): Message describing the current operation. Defaults to "".
         """
+        self._root._dispatch(self._offset + self._scale * max(0, min(self.max, value)), message)
+
+    def _dispatch(self, value, message: str):
+        """Relays an update (expressed in the root's values) to the callback, unless it is too soon after the previous one"""
+        # Updates of a cancelled operation are not relevant anymore
+        if self.cancel_token.cancelled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            is_new_message = message != "" and message != self._last_message
+            if not is_new_message and value < self.max and now - self._last_dispatch_time < self.min_interval:
+                # Coalesced : only the latest value will be relayed by the next update or by flush
+                self._pending = (value, message)
+                return
+            self._pending = None
+            self._last_dispatch_time = now
+            if message != "":
+                self._last_message = message
         self.callback(max(0, min(self.max, value)), message)
 
+    def flush(self):
+        """Relays the last coalesced update, if any"""
+        root = self._root
+        with root._lock:
+            pending = root._pending
+            root._pending = None
+            root._last_dispatch_time = time.monotonic()
+        if pending is not None and not root.cancel_token.cancelled:
+            root.callback(*pending)
+
+    def check_cancelled(self):
+        """Raises OperationCancelled if the operation was cancelled. Call regularly inside long loops."""
+        self.cancel_token.raise_if_cancelled()
+
     def fatal_error(self, exception: Exception = None, message: str = None):
         """Call to indicate a fatal error (error where no recoveryis  possible)
 
@@ -25,12 +102,14 @@ class Progress:
         """
         if message is None:
             message = str(exception)
-        self.error_callback(message)
-        
+        self.flush()
+        self._root.error_callback(message)
+
     def make_child(self, value_start, value_end):
         """Makes a new Progress object linked to this one.
         Any progress made on the new object will be reflected in this one.
-        
+        The new object shares the cancellation token of this one.
+
         Args:
             value_start : Value taken by the current Progress object when the new object has 0% progress
             value_end : Value taken by the current Progress object when the new object has 100% progress
@@ -38,29 +117,37 @@ class Progress:
         Returns:
             Progress: the new Progress object
         """
-        return Progress(max=self.max, error_callback = self.error_callback, 
-                        callback= lambda value, text : self.update_progress(value_start+value*(value_end-value_start)/self.max, text))
-    
+        child = Progress(max=self.max, callback=self._root.callback, error_callback=self._root.error_callback, cancel_token=self.cancel_token)
+        child._root = self._root
+        child._offset = self._offset + self._scale * value_start
+        child._scale = self._scale * (value_end - value_start) / self.max
+        return child
+
 class ConsoleProgress(Progress):
     """
     Class used to relay progress information to the console output
     For more details, refer to class Progress
     """
-    def __init__(self, max=1, progress_bar_width=20):
-        super().__init__(callback=self.write_progress, error_callback=self.write_error, max=max)
+    def __init__(self, max=1, progress_bar_width=20, frame_rate: float = 10, cancel_token: CancellationToken = None):
+        super().__init__(callback=self.write_progress, error_callback=self.write_error, max=max, frame_rate=frame_rate, cancel_token=cancel_token)
         self.progress_bar_width = progress_bar_width
         self.last_message = ""
-        
+        self.last_line = None
+
     def write_progress(self, value, message: str = ""):
         if len(message) == 0:
             message = self.last_message
         self.last_message = message
-        
+
         nb_full = int(value*self.progress_bar_width/self.max)
         nb_empty = self.progress_bar_width - nb_full
-        print(f"[{'#'*nb_full}{' '*nb_empty}] {str(int(value)).rjust(3)} % {message.ljust(100)}", end='\r', flush=True)
-        
+        line = f"[{'#'*nb_full}{' '*nb_empty}] {str(int(value)).rjust(3)} % {message}"
+        # The line is only printed again if what is displayed has changed
+        if line != self.last_line:
+            self.last_line = line
+            print(line.ljust(len(line) + max(0, 100 - len(message))), end='\r', flush=True)
+
     def write_error(self, message: str = ""):
         print(f"{('/!'+chr(92))*5} ERROR {('/!'+chr(92))*5}")
         print(message)
-    
\ No newline at end of file
+
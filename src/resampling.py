@@ -0,0 +1,81 @@
+import math
+import cv2
+import numpy as np
+from typing import Tuple
+
+def resize_nearest(image: np.ndarray, max_size: int) -> np.ndarray:
+    """Downsamples an image so that its largest side is at most max_size, by picking the nearest pixel
+    Unlike interpolating methods, this never makes up new values, so it is safe to use on label maps
+
+    Args:
+        image (np.ndarray): The image to downsample (2D, or 3D with channels last)
+        max_size (int): Maximum size of the largest side of the result, in pixels
+
+    Returns:
+        np.ndarray: The downsampled image (the image itself if it is already small enough)
+    """
+    nb_rows, nb_cols = image.shape[0], image.shape[1]
+    ratio = max_size / max(nb_rows, nb_cols)
+    if ratio >= 1:
+        return image
+    new_rows = max(1, int(nb_rows * ratio))
+    new_cols = max(1, int(nb_cols * ratio))
+    # Index of the source pixel at the center of each destination pixel
+    rows = ((np.arange(new_rows) + .5) * nb_rows / new_rows).astype(np.intp)
+    cols = ((np.arange(new_cols) + .5) * nb_cols / new_cols).astype(np.intp)
+    return image[rows[:, np.newaxis], cols[np.newaxis, :]]
+
+def resample_labels(label_image: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Resamples a label map to a given shape, each new pixel taking the label that covers most of its area
+    Labels are never mixed together, and thin features are kept as long as they are the majority somewhere,
+    which is not the case when picking the nearest pixel
+
+    Args:
+        label_image (np.ndarray): The label map, as a 2D array of integers
+        shape (Tuple[int, int]): The shape of the result (rows, columns)
+
+    Returns:
+        np.ndarray: The resampled label map, with the same type as label_image
+    """
+    if tuple(shape) == label_image.shape:
+        return label_image
+    labels = np.unique(label_image)
+    dsize = (shape[1], shape[0])
+    # Area covered by each label in each new pixel, computed one label at a time to limit memory usage
+    best_label = np.full(shape, labels[0], dtype=label_image.dtype)
+    best_coverage = np.full(shape, -1, dtype=np.float32)
+    for label in labels:
+        coverage = cv2.resize((label_image == label).astype(np.float32), dsize, interpolation=cv2.INTER_AREA)
+        is_better = coverage > best_coverage
+        best_label[is_better] = label
+        best_coverage[is_better] = coverage[is_better]
+    return best_label
+
+def grid_shape_for_budget(image_shape: Tuple[int, int], widthMM: float, heightMM: float, featureSizeMM: float = None,
+                          maxTriangles: int = None, maxResolution: int = None) -> Tuple[int, int]:
+    """Computes the shape of the vertex grid of the mesh, so that its resolution follows the size of the print
+    rather than the resolution of the source image. The grid is never larger than the image.
+
+    Args:
+        image_shape (Tuple[int, int]): The shape of the source image (rows, columns)
+        widthMM (float): The width of the mesh, in mm (along the columns)
+        heightMM (float): The height of the mesh, in mm (along the rows)
+        featureSizeMM (float, optional): If set, the distance between two vertices is at least this size. Defaults to None.
+        maxTriangles (int, optional): If set, the top of the mesh is made of at most this amount of triangles. Defaults to None.
+        maxResolution (int, optional): If set, the maximum number of vertices along the largest side. Defaults to None.
+
+    Returns:
+        Tuple[int, int]: The shape of the grid (rows, columns)
+    """
+    nb_rows, nb_cols = image_shape[0], image_shape[1]
+    ratio = 1
+    if featureSizeMM is not None and featureSizeMM > 0:
+        ratio = min(ratio, (math.ceil(widthMM / featureSizeMM) + 1) / nb_cols, (math.ceil(heightMM / featureSizeMM) + 1) / nb_rows)
+    if maxTriangles is not None and maxTriangles > 0:
+        # Each cell of the grid is made of two triangles
+        ratio = min(ratio, math.sqrt(maxTriangles / (2 * nb_rows * nb_cols)))
+    if maxResolution is not None and maxResolution > 0:
+        ratio = min(ratio, maxResolution / max(nb_rows, nb_cols))
+    if ratio >= 1:
+        return nb_rows, nb_cols
+    return max(2, int(nb_rows * ratio)), max(2, int(nb_cols * ratio))
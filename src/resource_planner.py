@@ -0,0 +1,268 @@
+"""
+Estimation of the resources needed by a conversion, before it runs, and adjustment of the conversion to fit in a budget
+The estimations come from measures of each stage per pixel or per triangle. They are approximations, meant to give orders of magnitude.
+"""
+import dataclasses
+import math
+import os
+import cv2
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from image_loading import reduction_factor
+from mesh_simplification import find_relevant_vertices
+from resampling import resample_labels
+from stl_generation import MeshGenerationParameters, grid_shape
+
+try:
+    import threadpoolctl
+except ImportError:
+    # Without it, the thread pools of NumPy's BLAS and OpenMP libraries are only limited by the environment variables set by main.py
+    threadpoolctl = None
+
+# Memory (bytes) and time (seconds, on one core) used by each stage, per pixel of the decoded image, per vertex of the grid or per triangle
+COLOR_DETECTION_BYTES_PER_PIXEL = 60
+COLOR_DETECTION_SECONDS_PER_PIXEL = 5e-7
+MESH_BYTES_PER_VERTEX = {"none": 80, "blender": 80, "numpy": 210}
+MESH_SECONDS_PER_VERTEX = {"none": 3e-6, "blender": 3e-6, "numpy": 1e-5}
+# Blender keeps its own mesh, copied from the arrays, and the evaluated copies of the modifiers
+BLENDER_BYTES_PER_VERTEX = 550
+BLENDER_SECONDS_PER_VERTEX = 2e-5
+# Bytes of the vertices and faces kept in memory until the export is done (float32 coordinates and int32 indices)
+RESIDENT_BYTES_PER_VERTEX = 28
+RESIDENT_BYTES_PER_TRIANGLE = 12
+EXPORT_BYTES_PER_TRIANGLE = {"stl": 260, "3mf": 100, "ply": 40, "blend": 0}
+EXPORT_SECONDS_PER_TRIANGLE = {"stl": 5e-7, "3mf": 1e-5, "ply": 1e-7, "blend": 2e-6}
+FILE_BYTES_PER_TRIANGLE = {"stl": 50, "3mf": 10, "ply": 16, "blend": 30}
+FILE_BYTES_PER_VERTEX = {"stl": 0, "3mf": 0, "ply": 12, "blend": 12}
+
+# The mesh is never downsampled below this amount of vertices along its largest side
+MIN_RESOLUTION = 32
+
+@dataclass
+class ResourceBudget:
+    """Limits of the resources a conversion may use. None means no limit."""
+    # Maximum peak memory, in MB
+    maxMemoryMB: float = None
+    # Maximum amount of processes and threads used at once
+    maxWorkers: int = None
+
+    def workers(self) -> int:
+        """Amount of processes and threads that can be used"""
+        cpus = os.cpu_count() or 1
+        return cpus if self.maxWorkers is None else max(1, min(self.maxWorkers, cpus))
+
+@dataclass
+class StageEstimate:
+    """Estimated resources of one stage of the conversion"""
+    name: str
+    memoryMB: float
+    seconds: float
+
+@dataclass
+class ConversionPlan:
+    """Estimation of what a conversion will make and use, with the settings chosen to fit in the budget"""
+    # Width and height of the source image, and of the image after decoding
+    imageSize: Tuple[int, int]
+    decodedSize: Tuple[int, int]
+    # Rows and columns of the top grid of the mesh
+    gridShape: Tuple[int, int]
+    paletteSize: int
+    vertices: int
+    triangles: int
+    # Estimated size of each output file, in bytes
+    outputBytes: Dict[str, int]
+    stages: List[StageEstimate]
+    workers: int
+    # Settings used by the conversion, possibly changed to fit in the budget
+    parameters: MeshGenerationParameters
+    maxImagePixels: int = None
+    # What was changed to fit in the budget
+    adjustments: List[str] = field(default_factory=list)
+    # If not None, the conversion cannot fit in the budget, for this reason
+    rejection: str = None
+
+    @property
+    def peakMemoryMB(self) -> float:
+        return max(stage.memoryMB for stage in self.stages)
+
+    @property
+    def totalSeconds(self) -> float:
+        return sum(stage.seconds for stage in self.stages)
+
+    def describe(self) -> str:
+        """Human readable summary of the plan"""
+        lines = [f"Image : {self.imageSize[0]}x{self.imageSize[1]} pixels"
+                 + (f", decoded at {self.decodedSize[0]}x{self.decodedSize[1]}" if self.decodedSize != self.imageSize else ""),
+                 f"Mesh : {self.gridShape[1]}x{self.gridShape[0]} grid, about {self.vertices} vertices and {self.triangles} triangles",
+                 f"Peak memory : about {self.peakMemoryMB:.0f} MB, duration : about {format_duration(self.totalSeconds)} ({self.workers} workers)"]
+        lines += [f"  {stage.name} : {stage.memoryMB:.0f} MB, {format_duration(stage.seconds)}" for stage in self.stages]
+        lines += [f"{extension.upper()} file : about {format_size(size)}" for extension, size in self.outputBytes.items()]
+        lines += [f"Adjusted : {adjustment}" for adjustment in self.adjustments]
+        if self.rejection is not None:
+            lines.append(f"Rejected : {self.rejection}")
+        return "\n".join(lines)
+
+def format_duration(seconds: float) -> str:
+    return f"{seconds:.1f} s" if seconds < 60 else f"{seconds/60:.1f} min"
+
+def format_size(size: float) -> str:
+    for unit in ["B", "kB", "MB"]:
+        if size < 1000:
+            return f"{size:.0f} {unit}"
+        size /= 1000
+    return f"{size:.1f} GB"
+
+def estimate_mesh_size(shape: Tuple[int, int], parameters: MeshGenerationParameters, relevantVertices: int = None) -> Tuple[int, int]:
+    """Estimates the size of the mesh of a grid, as generated before Blender
+
+    Args:
+        shape (Tuple[int, int]): Rows and columns of the top grid
+        parameters (MeshGenerationParameters): Mesh generation parameters
+        relevantVertices (int, optional): Amount of vertices of the grid that are on a side or next to a change of height,
+        used to estimate the result of the built-in simplifier. Defaults to None (no simplification is assumed).
+
+    Returns:
+        Tuple[int, int]: Amount of vertices and of triangles
+    """
+    rows, cols = shape
+    perimeter = 2 * (rows + cols) - 4
+    # Top grid, border ring and bottom, and triangles of the sides and bottom
+    vertices = rows * cols + perimeter + 4
+    sides = 4 * perimeter + 2
+    top = 2 * (rows - 1) * (cols - 1)
+    if parameters.simplification == "numpy" and relevantVertices is not None:
+        vertices = relevantVertices + perimeter + 4
+        top = 2 * relevantVertices
+    return vertices, top + sides
+
+def estimate_blender_triangles(shape: Tuple[int, int], triangles: int) -> int:
+    """Estimates the amount of triangles left by the simplification modifiers of Blender (see approximation_decimate_ratio)"""
+    return int(triangles * min(1, 4 / math.sqrt(shape[0] * shape[1])))
+
+def count_relevant_vertices(colorIndexImage: np.ndarray, shape: Tuple[int, int]) -> int:
+    """Counts the vertices that the built-in simplifier keeps at least, from the color regions of the image"""
+    return int(np.count_nonzero(find_relevant_vertices(resample_labels(colorIndexImage, shape))))
+
+def plan_conversion(imageSize: Tuple[int, int], parameters: MeshGenerationParameters, paletteSize: int = 8, maxImagePixels: int = None,
+                    budget: ResourceBudget = None, colorIndexImage: np.ndarray = None, includeColorDetection: bool = True) -> ConversionPlan:
+    """Estimates the resources used by a conversion, without changing its settings
+
+    Args:
+        imageSize (Tuple[int, int]): Width and height of the source image
+        parameters (MeshGenerationParameters): Mesh generation parameters
+        paletteSize (int, optional): Amount of colors in the image. Defaults to 8.
+        maxImagePixels (int, optional): Larger images are downscaled to this amount of pixels while being decoded. Defaults to None.
+        budget (ResourceBudget, optional): Gives the amount of workers. Defaults to None (no limit).
+        colorIndexImage (np.ndarray, optional): If the image was already loaded, its color regions, to estimate the simplified mesh more precisely. Defaults to None.
+        includeColorDetection (bool, optional): False if the image is already loaded. Defaults to True.
+
+    Returns:
+        ConversionPlan: The estimations
+    """
+    budget = budget or ResourceBudget()
+    workers = budget.workers()
+    width, height = imageSize
+    factor = reduction_factor(imageSize, maxImagePixels)
+    decodedSize = (max(1, int(width / factor)), max(1, int(height / factor))) if factor > 1 else imageSize
+    decodedPixels = decodedSize[0] * decodedSize[1]
+    shape = grid_shape((decodedSize[1], decodedSize[0]), parameters)
+    gridVertices = shape[0] * shape[1]
+
+    relevantVertices = None
+    if parameters.simplification == "numpy" and colorIndexImage is not None:
+        relevantVertices = count_relevant_vertices(colorIndexImage, shape)
+    vertices, triangles = estimate_mesh_size(shape, parameters, relevantVertices)
+    resident = (vertices * RESIDENT_BYTES_PER_VERTEX + triangles * RESIDENT_BYTES_PER_TRIANGLE) / 1e6
+
+    stages = []
+    if includeColorDetection:
+        stages.append(StageEstimate("Color detection", decodedPixels * COLOR_DETECTION_BYTES_PER_PIXEL / 1e6,
+                                    decodedPixels * COLOR_DETECTION_SECONDS_PER_PIXEL / workers))
+    method = parameters.simplification
+    stages.append(StageEstimate("Mesh generation", gridVertices * MESH_BYTES_PER_VERTEX[method] / 1e6, gridVertices * MESH_SECONDS_PER_VERTEX[method]))
+
+    formats = [extension for extension, selected in [("stl", parameters.saveSTL), ("3mf", parameters.save3MF), ("ply", parameters.savePLY),
+                                                      ("blend", parameters.saveBlendFile)] if selected]
+    exportedTriangles = {f: triangles for f in formats}
+    exportedVertices = {f: vertices for f in formats}
+    if parameters.usesBlender():
+        stages.append(StageEstimate("Blender", resident + gridVertices * BLENDER_BYTES_PER_VERTEX / 1e6, gridVertices * BLENDER_SECONDS_PER_VERTEX))
+        if method == "blender":
+            # Every file is written from the evaluated mesh, except a BLEND file that keeps the full resolution mesh
+            for f in exportedTriangles:
+                if f != "blend" or parameters.blendContent != "full":
+                    exportedTriangles[f] = estimate_blender_triangles(shape, triangles)
+                    # A closed triangle mesh has about half as many vertices as triangles
+                    exportedVertices[f] = exportedTriangles[f] // 2
+    if formats:
+        stages.append(StageEstimate("Export", resident + max(t * EXPORT_BYTES_PER_TRIANGLE[f] for f, t in exportedTriangles.items()) / 1e6,
+                                    sum(t * EXPORT_SECONDS_PER_TRIANGLE[f] for f, t in exportedTriangles.items())))
+    outputBytes = {f: int(t * FILE_BYTES_PER_TRIANGLE[f] + exportedVertices[f] * FILE_BYTES_PER_VERTEX[f]) for f, t in exportedTriangles.items()}
+
+    return ConversionPlan(imageSize=imageSize, decodedSize=decodedSize, gridShape=shape, paletteSize=paletteSize, vertices=vertices, triangles=triangles,
+                          outputBytes=outputBytes, stages=stages, workers=workers, parameters=parameters, maxImagePixels=maxImagePixels)
+
+def fit_conversion_to_budget(imageSize: Tuple[int, int], parameters: MeshGenerationParameters, budget: ResourceBudget, paletteSize: int = 8,
+                             maxImagePixels: int = None, colorIndexImage: np.ndarray = None, includeColorDetection: bool = True) -> ConversionPlan:
+    """Plans a conversion, and changes its settings so that it fits in a memory budget
+    In this order : the built-in simplifier replaces Blender, then the image is decoded at a lower resolution, then the mesh is downsampled.
+    If the conversion still does not fit, the plan is rejected.
+
+    Args:
+        See plan_conversion. The parameters are not modified, the plan holds a modified copy.
+
+    Returns:
+        ConversionPlan: The plan, with the settings to use
+    """
+    parameters = dataclasses.replace(parameters)
+    def plan():
+        return plan_conversion(imageSize, parameters, paletteSize, maxImagePixels, budget, colorIndexImage, includeColorDetection)
+    def fits(p: ConversionPlan) -> bool:
+        return budget.maxMemoryMB is None or p.peakMemoryMB <= budget.maxMemoryMB
+
+    adjustments = []
+    current = plan()
+    if not fits(current) and parameters.simplification == "blender" and not parameters.saveBlendFile:
+        # The built-in simplifier writes the files directly, without the copies made by Blender
+        parameters.simplification = "numpy"
+        adjustments.append("built-in simplifier instead of Blender")
+        current = plan()
+
+    # The color detection works on the whole decoded image
+    originalSize = current.decodedSize
+    while includeColorDetection and not fits(current) and current.stages[0].memoryMB > budget.maxMemoryMB \
+          and current.decodedSize[0] * current.decodedSize[1] > MIN_RESOLUTION**2:
+        maxImagePixels = current.decodedSize[0] * current.decodedSize[1] // 2
+        current = plan()
+    if current.decodedSize != originalSize:
+        adjustments.append(f"image decoded at {current.decodedSize[0]}x{current.decodedSize[1]} pixels")
+
+    # The mesh is downsampled until it fits
+    originalShape = current.gridShape
+    while not fits(current) and max(current.gridShape) > MIN_RESOLUTION:
+        parameters.maxResolution = max(MIN_RESOLUTION, int(max(current.gridShape) * .7))
+        current = plan()
+    if current.gridShape != originalShape:
+        adjustments.append(f"mesh downsampled to a {current.gridShape[1]}x{current.gridShape[0]} grid")
+
+    current.adjustments = adjustments
+    if not fits(current):
+        current.rejection = f"needs about {current.peakMemoryMB:.1f} MB, more than the budget of {budget.maxMemoryMB:g} MB"
+    return current
+
+def apply_thread_budget(budget: ResourceBudget) -> int:
+    """Limits the amount of threads used by OpenCV, and by the BLAS and OpenMP libraries used by NumPy and SciPy
+    The libraries of NumPy are limited with threadpoolctl when it is installed. Otherwise, only the environment variables
+    (OMP_NUM_THREADS, OPENBLAS_NUM_THREADS, MKL_NUM_THREADS) can limit them, and they must be set before NumPy is imported :
+    main.py sets them from the --workers option.
+
+    Returns:
+        int: The amount of processes and threads that can be used
+    """
+    workers = budget.workers()
+    cv2.setNumThreads(workers)
+    if threadpoolctl is not None:
+        # Not used as a context manager : the limits stay until the next budget is applied
+        threadpoolctl.threadpool_limits(limits=workers)
+    return workers
@@ -0,0 +1,78 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from typing import Set
+
+class ScratchWorkspace:
+    """
+    Directory for the temporary files of the conversions
+    Every file is created in it and tracked, so that the files of a job can be deleted once they are not needed anymore,
+    and the whole directory is deleted when the program exits. A long running program therefore does not fill the disk.
+    """
+    def __init__(self, prefix: str = "image2touch_"):
+        """
+        Args:
+            prefix (str, optional): Prefix of the name of the directory, created in the temporary directory of the system. Defaults to "image2touch_".
+        """
+        self.path = tempfile.mkdtemp(prefix=prefix)
+        self.files: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def new_file(self, suffix: str = "") -> str:
+        """Creates an empty file in the workspace
+
+        Args:
+            suffix (str, optional): Suffix of the file name, such as an extension. Defaults to "".
+
+        Returns:
+            str: Path to the file, which is closed
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.path)
+        # Only the path is used by the callers : the file is written again by its name
+        os.close(handle)
+        with self.lock:
+            self.files.add(path)
+        return path
+
+    def release(self, path: str) -> None:
+        """Deletes a file of the workspace. Paths that are not in the workspace (or None) are ignored.
+
+        Args:
+            path (str): Path to the file
+        """
+        with self.lock:
+            if path not in self.files:
+                return
+            self.files.discard(path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def size(self) -> int:
+        """Total size of the files in the workspace, in bytes"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def cleanup(self) -> None:
+        """Deletes the workspace and everything in it"""
+        with self.lock:
+            self.files.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+_defaultWorkspace = None
+_defaultWorkspaceLock = threading.Lock()
+
+def get_scratch_workspace() -> ScratchWorkspace:
+    """The workspace used by the conversions of this process, created on first use and deleted when the process exits"""
+    global _defaultWorkspace
+    with _defaultWorkspaceLock:
+        if _defaultWorkspace is None:
+            _defaultWorkspace = ScratchWorkspace()
+            atexit.register(_defaultWorkspace.cleanup)
+        return _defaultWorkspace
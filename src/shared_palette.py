@@ -0,0 +1,104 @@
+"""
+Palette shared by a series of images, such as map sheets with the same legend
+The palette is found once, from a reference image or from a sample of every image of the series, and saved as a JSON file.
+The images of the series are then labelled with its colors, in its order, so that a color has the same height on every sheet.
+"""
+import json
+import numpy as np
+from dataclasses import asdict, dataclass
+from typing import List, Union
+from color_detection import GROUPING_RADIUS, MIN_COLOR_PRCT, hex_to_rgb, quantize_image
+from image_loading import load_image
+from palette_engines import PaletteEngine, get_palette_engine
+from svg_input import is_svg, rasterize_svg, read_svg_size, svg_raster_size
+
+# Each image is decoded at this resolution at most to find the palette
+SAMPLE_IMAGE_PIXELS = 1 << 20
+# Amount of pixels of each image given to the engines that work on pixels
+SAMPLE_PIXELS_PER_IMAGE = 20000
+
+@dataclass
+class SharedPalette:
+    """
+    Colors shared by a series of images, from the most to the least common, and the height of each of them
+
+    Args:
+        colors (List[str]): Hex representation of the colors
+        heights (List[float]): Height of each color, as chosen for the color list of the interface. Defaults to their rank.
+    """
+    colors: List[str]
+    heights: List[float] = None
+
+    def __post_init__(self):
+        if self.heights is None:
+            self.heights = list(range(len(self.colors)))
+        if len(self.heights) != len(self.colors):
+            raise ValueError(f"The palette has {len(self.colors)} colors but {len(self.heights)} heights")
+
+    def save(self, path: str) -> None:
+        """Writes the palette as a JSON file, which can be edited to change the heights"""
+        with open(path, "w") as file:
+            json.dump(asdict(self), file, indent=2)
+
+    @staticmethod
+    def load(path: str) -> "SharedPalette":
+        """Reads a palette written by save
+
+        Raises:
+            ValueError: The file is not a valid palette
+        """
+        with open(path) as file:
+            content = json.load(file)
+        if not isinstance(content, dict) or not isinstance(content.get("colors"), list) or not content["colors"]:
+            raise ValueError(f"'{path}' is not a palette file")
+        return SharedPalette(colors=list(content["colors"]), heights=content.get("heights"))
+
+def load_sample_image(image_path: str) -> np.ndarray:
+    """Loads an image of the series at the resolution used to find the palette"""
+    if is_svg(image_path):
+        # The colors of a vector image are its fill colors
+        label_map = rasterize_svg(image_path, svg_raster_size(read_svg_size(image_path), max_pixels=SAMPLE_IMAGE_PIXELS))
+        return hex_to_rgb(label_map.colors)[label_map.labels]
+    return load_image(image_path, SAMPLE_IMAGE_PIXELS)
+
+def build_shared_palette(image_paths: List[str], engine: Union[str, PaletteEngine] = None) -> SharedPalette:
+    """Finds the palette of a series of images, from the colors of all of them
+    Every image weighs the same, whatever its size, so that a color used on a few small sheets is not lost
+
+    Args:
+        image_paths (List[str]): The images of the series, or a single reference image
+        engine (Union[str, PaletteEngine], optional): The engine that groups the colors, or its name. Defaults to Ward clustering.
+
+    Raises:
+        ValueError: No image was given
+
+    Returns:
+        SharedPalette: The palette, with the default heights
+    """
+    if not image_paths:
+        raise ValueError("At least one image is needed to build a palette")
+    histogram = None
+    samples = []
+    rng = np.random.default_rng(0)
+    for image_path in image_paths:
+        img = load_sample_image(image_path)
+        pixels, quantized_colors = quantize_image(img, GROUPING_RADIUS)
+        counts = np.bincount(pixels.ravel(), minlength=len(quantized_colors)) / pixels.size
+        histogram = counts if histogram is None else histogram + counts
+        flat = img.reshape(-1, 3)
+        samples.append(flat[rng.choice(len(flat), min(len(flat), SAMPLE_PIXELS_PER_IMAGE), replace=False)])
+    histogram /= len(image_paths)
+
+    color_codes = np.flatnonzero(histogram)
+    color_list, counts = quantized_colors[color_codes], histogram[color_codes]
+    # The samples of every image, as a one pixel wide image for the engines that work on pixels
+    sample_image = np.concatenate(samples)[:, None, :]
+    labels = get_palette_engine(engine).cluster(color_list, counts, sample_image)
+
+    # Mean color and share of each label, the most common first
+    _, labels = np.unique(labels, return_inverse=True)
+    labels = labels.ravel()
+    shares = np.bincount(labels, weights=counts)
+    means = np.stack([np.bincount(labels, weights=counts * color_list[:, i]) for i in range(3)], axis=1) / shares[:, None]
+    order = [l for l in np.argsort(-shares, kind="stable") if shares[l] > MIN_COLOR_PRCT] or [int(shares.argmax())]
+    return SharedPalette(colors=['#%02x%02x%02x' % tuple(int(round(v)) for v in means[l]) for l in order])
@@ -0,0 +1,339 @@
+"""
+Job spool in a shared directory, so that conversions can be spread over several processes and hosts
+
+Layout of the spool directory :
+    pending/<id>.json           jobs waiting for a worker
+    claimed/<id>@<worker>.json  jobs being converted. The modification time of the file is the lease, renewed by its worker.
+    done/<id>.json              finished jobs, with their result
+    failed/<id>.json            jobs that failed, or whose workers crashed too many times
+    inputs/<id>.<ext>           images of the jobs
+    outputs/<id>/               files generated by the jobs
+    work/                       private directories of the workers, moved to outputs when a job is done,
+                                and manifests of the jobs being finished by them
+
+Every change of state is a rename, which is atomic on a given file system : when several workers try to claim the same job,
+only one of them succeeds. A job whose lease was not renewed in time (its worker crashed or lost the file system) goes back to pending.
+Hosts must share the clock of the file server within a small fraction of the lease duration.
+"""
+import dataclasses
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from multiprocessing import Process
+from typing import Optional
+from img_to_stl import ConversionJob, ConversionResult, runConversion
+from plate_tiling import PlateLayout
+from progress import CancellationToken, Progress
+from resource_planner import ResourceBudget
+from shared_palette import SharedPalette
+from stl_generation import MeshGenerationParameters
+
+STATES = ["pending", "claimed", "done", "failed"]
+
+def job_to_manifest(job: ConversionJob) -> dict:
+    """Makes the JSON manifest of a job. The image path is replaced by the one in the spool by the caller."""
+    return dataclasses.asdict(job)
+
+def job_from_manifest(manifest: dict, imagePath: str) -> ConversionJob:
+    """Makes a job from its JSON manifest
+
+    Args:
+        manifest (dict): The manifest
+        imagePath (str): Path to the image to convert
+
+    Returns:
+        ConversionJob: The job
+    """
+    fields = {f.name for f in dataclasses.fields(ConversionJob)}
+    values = {k: v for k, v in manifest.get("job", {}).items() if k in fields}
+    values["imagePath"] = imagePath
+    if values.get("meshParameters") is not None:
+        values["meshParameters"] = MeshGenerationParameters(**values["meshParameters"])
+    if values.get("resourceBudget") is not None:
+        values["resourceBudget"] = ResourceBudget(**values["resourceBudget"])
+    if values.get("plateLayout") is not None:
+        values["plateLayout"] = PlateLayout(**values["plateLayout"])
+    if values.get("sharedPalette") is not None:
+        values["sharedPalette"] = SharedPalette(**values["sharedPalette"])
+    if values.get("colorHeights") is not None:
+        values["colorHeights"] = tuple(values["colorHeights"])
+    return ConversionJob(**values)
+
+def default_worker_id() -> str:
+    """Name of the worker of this process, unique across hosts"""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", f"{socket.gethostname()}-{os.getpid()}")
+
+@dataclass
+class ClaimedJob:
+    """A job claimed by a worker"""
+    jobId: str
+    workerId: str
+    # Path to the claimed manifest, whose modification time is the lease
+    path: str
+    manifest: dict
+
+class JobSpool:
+    """
+    A spool directory, shared by the processes that submit jobs and the workers that convert them
+    """
+    def __init__(self, root: str, leaseSeconds: float = 300, maxAttempts: int = 3):
+        """
+        Args:
+            root (str): The spool directory, created if needed
+            leaseSeconds (float, optional): A claimed job whose lease was not renewed for this long goes back to pending. Defaults to 300.
+            maxAttempts (int, optional): Amount of times a job is claimed before it is failed. Defaults to 3.
+        """
+        self.root = root
+        self.leaseSeconds = leaseSeconds
+        self.maxAttempts = maxAttempts
+        for directory in STATES + ["inputs", "outputs", "work"]:
+            os.makedirs(self.path(directory), exist_ok=True)
+
+    def path(self, *parts: str) -> str:
+        """Path inside the spool directory"""
+        return os.path.join(self.root, *parts)
+
+    def writeManifest(self, path: str, manifest: dict) -> None:
+        """Writes a manifest through a temporary file, so that it is never read half written"""
+        temporaryPath = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporaryPath, "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(temporaryPath, path)
+
+    def readManifest(self, path: str) -> dict:
+        with open(path) as file:
+            return json.load(file)
+
+    def submit(self, imagePath: str, job: ConversionJob = None) -> str:
+        """Adds a job to the spool. The image is copied into the spool.
+
+        Args:
+            imagePath (str): Path to the image to convert
+            job (ConversionJob, optional): Parameters of the conversion, whose image path is ignored. Defaults to the default parameters.
+
+        Returns:
+            str: Identifier of the job
+        """
+        # Identifiers sort by submission time, so that jobs are converted in order
+        jobId = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:12]
+        spoolImagePath = os.path.join("inputs", jobId + os.path.splitext(imagePath)[1].lower())
+        shutil.copyfile(imagePath, self.path(spoolImagePath))
+        manifest = {"id": jobId, "image": spoolImagePath, "source": os.path.abspath(imagePath), "submitted": time.time(), "attempts": 0,
+                    "job": job_to_manifest(job or ConversionJob(imagePath))}
+        # The manifest is written last : a pending job always has its image
+        self.writeManifest(self.path("pending", jobId + ".json"), manifest)
+        return jobId
+
+    def reclaimExpired(self) -> int:
+        """Puts the claimed jobs whose lease expired back in pending, as well as the jobs whose worker crashed while finishing them
+
+        Returns:
+            int: Amount of jobs put back
+        """
+        count = 0
+        now = time.time()
+        for state in ("claimed", "work"):
+            for name in os.listdir(self.path(state)):
+                # Temporary files of writeManifest and directories of the workers are not jobs
+                if not name.endswith(".json"):
+                    continue
+                path = self.path(state, name)
+                try:
+                    if now - os.path.getmtime(path) < self.leaseSeconds:
+                        continue
+                    os.rename(path, self.path("pending", name.split("@")[0] + ".json"))
+                    count += 1
+                except FileNotFoundError:
+                    # Finished or reclaimed by someone else in the meantime
+                    pass
+        return count
+
+    def claim(self, workerId: str) -> Optional[ClaimedJob]:
+        """Claims the oldest pending job
+
+        Args:
+            workerId (str): Name of the worker, unique across hosts
+
+        Returns:
+            Optional[ClaimedJob]: The job, or None if there is no pending job
+        """
+        self.reclaimExpired()
+        for name in sorted(os.listdir(self.path("pending"))):
+            if not name.endswith(".json"):
+                continue
+            jobId = name[:-len(".json")]
+            pendingPath = self.path("pending", name)
+            path = self.path("claimed", f"{jobId}@{workerId}.json")
+            try:
+                # The rename keeps the modification time : the lease starts before it, so that the job is never claimed with
+                # the time it waited in pending, and put back by reclaimExpired right away
+                os.utime(pendingPath)
+                os.rename(pendingPath, path)
+                manifest = self.readManifest(path)
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            manifest["attempts"] = manifest.get("attempts", 0) + 1
+            manifest["worker"] = workerId
+            manifest["claimed"] = time.time()
+            claimed = ClaimedJob(jobId, workerId, path, manifest)
+            if manifest["attempts"] > self.maxAttempts:
+                self.finish(claimed, "failed", {"success": False, "errors": [f"Abandoned after {self.maxAttempts} attempts"]})
+                continue
+            self.writeManifest(path, manifest)
+            return claimed
+        return None
+
+    def renewLease(self, claimed: ClaimedJob) -> bool:
+        """Renews the lease of a claimed job
+
+        Returns:
+            bool: False if the job is not claimed by this worker anymore (its lease expired)
+        """
+        try:
+            os.utime(claimed.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finish(self, claimed: ClaimedJob, state: str, result: dict) -> bool:
+        """Records the result of a claimed job, and moves it to done or failed
+
+        Returns:
+            bool: False if the job is not claimed by this worker anymore, the result being dropped
+        """
+        manifest = dict(claimed.manifest, result=result, finished=time.time())
+        # The job is first moved to a name that only this worker uses, so that it cannot be reclaimed while its result is written :
+        # the result is never missing from a finished job, and a job is never finished twice
+        finishingPath = self.path("work", os.path.basename(claimed.path))
+        try:
+            os.utime(claimed.path)
+            os.rename(claimed.path, finishingPath)
+        except FileNotFoundError:
+            return False
+        self.writeManifest(finishingPath, manifest)
+        os.rename(finishingPath, self.path(state, claimed.jobId + ".json"))
+        return True
+
+    def process(self, claimed: ClaimedJob) -> bool:
+        """Converts a claimed job, renewing its lease meanwhile, and records its result
+
+        Returns:
+            bool: True if the job succeeded
+        """
+        workDirectory = self.path("work", f"{claimed.jobId}@{claimed.workerId}")
+        shutil.rmtree(workDirectory, ignore_errors=True)
+        os.makedirs(workDirectory)
+        # The outputs are written next to the image, in the private directory of the worker
+        imagePath = os.path.join(workDirectory, os.path.splitext(os.path.basename(claimed.manifest["source"]))[0] + os.path.splitext(claimed.manifest["image"])[1])
+        shutil.copyfile(self.path(claimed.manifest["image"]), imagePath)
+        job = job_from_manifest(claimed.manifest, imagePath)
+
+        cancelToken = CancellationToken()
+        errors = []
+        progress = Progress(callback=lambda value, message="": None, error_callback=errors.append, max=100, cancel_token=cancelToken)
+        stopped = threading.Event()
+
+        def renewLease():
+            while not stopped.wait(self.leaseSeconds / 3):
+                if not self.renewLease(claimed):
+                    # Another worker has the job now : this conversion is useless
+                    cancelToken.cancel()
+                    return
+        heartbeat = threading.Thread(target=renewLease, daemon=True)
+        heartbeat.start()
+        try:
+            result = runConversion(job, progress)
+        except Exception as e:
+            result = ConversionResult(imagePath=imagePath, success=False, errors=errors + [str(e)])
+        finally:
+            stopped.set()
+            heartbeat.join()
+        if cancelToken.cancelled:
+            shutil.rmtree(workDirectory, ignore_errors=True)
+            return False
+
+        os.remove(imagePath)
+        outputDirectory = self.path("outputs", claimed.jobId)
+        try:
+            os.rename(workDirectory, outputDirectory)
+        except OSError:
+            # The outputs of an earlier attempt are already there
+            shutil.rmtree(workDirectory, ignore_errors=True)
+        resultManifest = {"success": result.success, "colors": result.colors, "errors": result.errors or errors,
+                          "validation": [report.summary() for report in result.validationReports],
+                          "outputs": [os.path.join("outputs", claimed.jobId, os.path.basename(p)) for p in result.outputPaths]}
+        self.finish(claimed, "done" if result.success else "failed", resultManifest)
+        return result.success
+
+    def status(self, jobId: str) -> Optional[str]:
+        """State of a job : 'pending', 'claimed', 'done', 'failed', or None if it is unknown"""
+        for state in STATES:
+            names = os.listdir(self.path(state))
+            if f"{jobId}.json" in names or any(name.startswith(jobId + "@") for name in names):
+                return state
+        return None
+
+    def result(self, jobId: str) -> Optional[dict]:
+        """Manifest of a finished job, with its result, or None if it is not finished"""
+        for state in ("done", "failed"):
+            path = self.path(state, jobId + ".json")
+            if os.path.exists(path):
+                return self.readManifest(path)
+        return None
+
+    def isIdle(self) -> bool:
+        """True if no job is pending or being converted"""
+        return not os.listdir(self.path("pending")) and not os.listdir(self.path("claimed"))
+
+def run_worker(root: str, workerId: str = None, pollSeconds: float = 2, exitWhenIdle: bool = False, leaseSeconds: float = 300,
+               stopEvent: threading.Event = None) -> int:
+    """Converts the jobs of a spool, one at a time, until stopped
+
+    Args:
+        root (str): The spool directory
+        workerId (str, optional): Name of the worker. Defaults to the host name and process id.
+        pollSeconds (float, optional): Delay between two checks when no job is pending. Defaults to 2.
+        exitWhenIdle (bool, optional): Stops when no job is pending or being converted. Defaults to False.
+        leaseSeconds (float, optional): Duration of the leases. Defaults to 300.
+        stopEvent (threading.Event, optional): Stops the worker after the current job when set. Defaults to None.
+
+    Returns:
+        int: Amount of jobs processed
+    """
+    spool = JobSpool(root, leaseSeconds=leaseSeconds)
+    workerId = workerId or default_worker_id()
+    processed = 0
+    while stopEvent is None or not stopEvent.is_set():
+        claimed = spool.claim(workerId)
+        if claimed is not None:
+            spool.process(claimed)
+            processed += 1
+        elif exitWhenIdle and spool.isIdle():
+            break
+        else:
+            time.sleep(pollSeconds)
+    return processed
+
+def run_local_workers(root: str, count: int, exitWhenIdle: bool = True, leaseSeconds: float = 300) -> None:
+    """Runs several workers as processes of this host, and waits for them
+
+    Args:
+        root (str): The spool directory
+        count (int): Amount of worker processes
+        exitWhenIdle (bool, optional): The workers stop when no job is left. Defaults to True.
+        leaseSeconds (float, optional): Duration of the leases. Defaults to 300.
+    """
+    JobSpool(root, leaseSeconds=leaseSeconds)
+    workers = [Process(target=run_worker, kwargs={"root": root, "exitWhenIdle": exitWhenIdle, "leaseSeconds": leaseSeconds})
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -1,15 +1,28 @@
+from __future__ import annotations
 from contextlib import redirect_stdout
 from dataclasses import dataclass
+import dataclasses
+import functools
 import sys
-from typing import Tuple
+import threading
+from typing import List, Tuple, Union
 import sys, os
 import numpy as np
 from numpy import double
 import cv2
 import math
-import bpy
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from progress import Progress
+from color_detection import hex_to_rgb
+from mesh_export import write_stl, write_ply, write_3mf
+from mesh_simplification import simplify_height_grid
+from resampling import resample_labels, grid_shape_for_budget
+
+try:
+    import bpy
+except ImportError:
+    # Blender is only needed to apply the Blender modifiers, or to save BLEND files
+    bpy = None
 
 #region ############################## Parameters ##############################
 
@@ -25,7 +38,23 @@ class MeshGenerationParameters:
         meshImageThicknessMM(int): The thickness of the carved part of the mesh, in mm
         saveSTL(bool): If True, an STL mesh will be generated
         saveBlendFile(bool): If True, the resulting Blender scene will be saved
+        blendContent(str): What the BLEND file holds : "simplified" (only the mesh as exported, after the modifiers, small)
+            or "full" (the full resolution mesh with its modifiers, to edit them in Blender)
+        save3MF(bool): If True, a 3MF file will be generated, with one material per color of the image
+        savePLY(bool): If True, a binary PLY file will be generated, with the color of the image on each face
+            With Blender, every file is written from the same evaluated mesh, after the modifiers
         verticesPerPixel (int): The number of vertices that are mapped to one pixel of the source image
+        minIslandAreaMM2 (float): Regions of a color smaller than this area, in mm², are merged into the region around them. None or 0 keeps them.
+        minIslandWidthMM (float): Regions of a color narrower than this, in mm, are merged into the region around them. None or 0 keeps them.
+        maxResolution (int): If set, the maximum number of vertices along the largest side of the mesh. Larger height maps are downsampled.
+        featureSizeMM (float): If set, the smallest distance between two vertices, in mm. Height maps with a finer resolution are downsampled.
+        maxTriangles (int): If set, the maximum number of triangles on the top of the mesh. Larger height maps are downsampled.
+        simplification (str): How the mesh is simplified : "blender" (modifiers applied by Blender during export),
+            "numpy" (flat areas are simplified before export, without Blender) or "none"
+        simplificationToleranceMM (float): With the "numpy" simplification, maximum vertical distance between the simplified surface
+            and the vertices of the full resolution grid, in mm
+        validation (str): How the mesh is checked before export : "report" (the summary of the report is returned by generateSTL), "fail" (an invalid mesh is not exported,
+            MeshValidationError is raised) or "none". With Blender, the mesh is checked after the modifiers.
     """
     outputMeshPath: str = "mesh"
     
@@ -35,9 +64,32 @@ class MeshGenerationParameters:
     meshImageThicknessMM: int = 3
     
     saveSTL : bool = True
-    saveBlendFile : bool = True
+    saveBlendFile : bool = False
+    save3MF : bool = False
+    savePLY : bool = False
+    blendContent: str = "simplified"
     
     verticesPerPixel: int = 1
+    
+    minIslandAreaMM2: float = 1.
+    minIslandWidthMM: float = None
+    
+    maxResolution: int = None
+    featureSizeMM: float = None
+    maxTriangles: int = None
+    
+    simplification: str = "blender"
+    simplificationToleranceMM: float = 0.05
+    
+    validation: str = "report"
+    
+    def hasOutput(self) -> bool:
+        """True if at least one output format is selected"""
+        return self.saveSTL or self.saveBlendFile or self.save3MF or self.savePLY
+
+    def usesBlender(self) -> bool:
+        """True if Blender is needed : to save the BLEND file, or to simplify the mesh of any other format"""
+        return self.saveBlendFile or (self.simplification == "blender" and (self.saveSTL or self.save3MF or self.savePLY))
 
 #endregion
 
@@ -53,6 +105,32 @@ def generateNameResultingFile(inputFilepath : str, desiredFormat : str) -> str:
 	"""
 	return os.path.splitext(inputFilepath)[0] + "." + desiredFormat
 
+def output_paths(parameters: MeshGenerationParameters) -> List[str]:
+    """Lists the files written by a mesh generation
+
+    Args:
+        parameters (MeshGenerationParameters): Mesh generation parameters
+
+    Returns:
+        List[str]: Paths of the files of every selected format
+    """
+    return [generateNameResultingFile(parameters.outputMeshPath, extension)
+            for extension, selected in [("stl", parameters.saveSTL), ("blend", parameters.saveBlendFile),
+                                        ("3mf", parameters.save3MF), ("ply", parameters.savePLY)] if selected]
+
+def grid_shape(image_shape: Tuple[int, int], parameters: MeshGenerationParameters) -> Tuple[int, int]:
+    """Computes the shape of the vertex grid of the mesh, from the shape of the source image and the resolution limits of the parameters
+
+    Args:
+        image_shape (Tuple[int, int]): The shape of the source image (rows, columns)
+        parameters (MeshGenerationParameters): Mesh generation parameters
+
+    Returns:
+        Tuple[int, int]: The shape of the grid (rows, columns)
+    """
+    return grid_shape_for_budget(image_shape, widthMM=parameters.meshWidthMM, heightMM=parameters.meshHeightMM,
+                                 featureSizeMM=parameters.featureSizeMM, maxTriangles=parameters.maxTriangles,
+                                 maxResolution=parameters.maxResolution)
 
 def load_grayscale_image(image_path: str) -> np.ndarray:
     """Loads an image as a grayscale matrix
@@ -71,6 +149,11 @@ def load_grayscale_image(image_path: str) -> np.ndarray:
 
 #region ############################## Mesh generation ##############################
 
+# Types of the mesh buffers : STL, PLY and 3MF files, as well as Blender, store single precision coordinates and 32 bit indices,
+# so the mesh is generated with them from the start rather than converted at export
+VERTEX_DTYPE = np.float32
+FACE_DTYPE = np.int32
+
 def generate_vertices_top(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
     """Generates the vertices corresponding to the pixels in the source image
 
@@ -81,10 +164,15 @@ def generate_vertices_top(grayscale_image: np.ndarray, pts_par_px: int = 1) -> n
     Returns:
         np.ndarray: The generated vertices
     """
-    nb_pts_x = grayscale_image.shape[0]*pts_par_px
-    nb_pts_y = grayscale_image.shape[1]*pts_par_px
-    vertices_top = np.array([(x, y, grayscale_image[x,y]) for y in range(nb_pts_y) for x in range(nb_pts_x)])
-    vertices_top = vertices_top / (nb_pts_x-1, nb_pts_y-1, 255)
+    if pts_par_px > 1:
+        grayscale_image = np.repeat(np.repeat(grayscale_image, pts_par_px, axis=0), pts_par_px, axis=1)
+    nb_pts_x, nb_pts_y = grayscale_image.shape
+    # Vertices are ordered column by column : the index of (x, y) is x + nb_pts_x*y
+    vertices_top = np.empty((nb_pts_x * nb_pts_y, 3), dtype=VERTEX_DTYPE)
+    vertices_top[:, 0] = np.tile(np.arange(nb_pts_x, dtype=VERTEX_DTYPE) / VERTEX_DTYPE(nb_pts_x-1), nb_pts_y)
+    vertices_top[:, 1] = np.repeat(np.arange(nb_pts_y, dtype=VERTEX_DTYPE) / VERTEX_DTYPE(nb_pts_y-1), nb_pts_x)
+    vertices_top[:, 2] = grayscale_image.ravel(order='F')
+    vertices_top[:, 2] /= 255
     return vertices_top
 
 def generate_vertices_border(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
@@ -101,7 +189,7 @@ def generate_vertices_border(grayscale_image: np.ndarray, pts_par_px: int = 1) -
     nb_pts_x = grayscale_image.shape[0]*pts_par_px
     nb_pts_y = grayscale_image.shape[1]*pts_par_px
     vertices_border = np.array([(x, y, -1) for y in range(nb_pts_y) for x in range(nb_pts_x) if x == 0 or y == 0 or x == nb_pts_x-1 or y == nb_pts_y-1])
-    vertices_border = vertices_border / (nb_pts_x-1, nb_pts_y-1, 2)
+    vertices_border = (vertices_border / (nb_pts_x-1, nb_pts_y-1, 2)).astype(VERTEX_DTYPE)
     return vertices_border
 
 def generate_vertices_bottom() -> np.ndarray:
@@ -113,7 +201,7 @@ def generate_vertices_bottom() -> np.ndarray:
     vertices_bottom = np.array([(0,0,-1),
                                 (1,0,-1),
                                 (0,1,-1),
-                                (1,1,-1)])
+                                (1,1,-1)], dtype=VERTEX_DTYPE)
     return vertices_bottom
 
 def scale_vertices(vertices: np.ndarray, scale: Tuple[double, double, double]) -> np.ndarray:
@@ -126,7 +214,7 @@ def scale_vertices(vertices: np.ndarray, scale: Tuple[double, double, double]) -
     Returns:
         np.ndarray: The scaled vertices
     """
-    return vertices * scale
+    return vertices * np.asarray(scale, dtype=vertices.dtype)
 
 def generate_faces_top(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
     """Generates the faces for the top part of the object
@@ -141,13 +229,16 @@ def generate_faces_top(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.n
     nb_pts_x = grayscale_image.shape[0]*pts_par_px
     nb_pts_y = grayscale_image.shape[1]*pts_par_px
     
-    def index(x, y):
-        return x+nb_pts_x*y
-    
-    list_index = np.array([index(x,y) for x in range(nb_pts_x-1) for y in range(nb_pts_y-1)])
-    faces_first_half = list(zip(list_index, list_index+1, list_index+nb_pts_x))
-    faces_second_half = list(zip(list_index+1, list_index+1+nb_pts_x, list_index+nb_pts_x))
-    faces_top = np.vstack((faces_first_half, faces_second_half))
+    # Index of the vertex (x, y) of each grid cell, x being the slowest varying
+    list_index = (np.arange(nb_pts_x-1, dtype=FACE_DTYPE)[:, None] + nb_pts_x*np.arange(nb_pts_y-1, dtype=FACE_DTYPE)[None, :]).ravel()
+    nb_cells = len(list_index)
+    faces_top = np.empty((2*nb_cells, 3), dtype=FACE_DTYPE)
+    faces_top[:nb_cells, 0] = list_index
+    faces_top[:nb_cells, 1] = list_index+1
+    faces_top[:nb_cells, 2] = list_index+nb_pts_x
+    faces_top[nb_cells:, 0] = list_index+1
+    faces_top[nb_cells:, 1] = list_index+1+nb_pts_x
+    faces_top[nb_cells:, 2] = list_index+nb_pts_x
     return faces_top
 
 def generate_faces_border(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
@@ -188,7 +279,7 @@ def generate_faces_border(grayscale_image: np.ndarray, pts_par_px: int = 1) -> n
         [(index_bord(x+1,0),index(x,0),index_bord(x,y)) for x in range(0, nb_pts_x-1) for y in [0] ], # bord gauche deuxième triangle
         [(index(x-1,y),index(x,y),index_bord(x,y)) for x in range(1, nb_pts_x) for y in [nb_pts_y-1] ], # bord droit premier triangle
         [(index(x,y),index_bord(x+1,y),index_bord(x,y)) for x in range(0, nb_pts_x-1) for y in [nb_pts_y-1] ], # bord droit deuxième triangle
-    ))
+    )).astype(FACE_DTYPE)
     return faces_border
 
 def generate_faces_side(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
@@ -231,7 +322,7 @@ def generate_faces_side(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.
         [[idx_sol_nn, idx_sol_0n, index_bord(0, nb_pts_y-1)]],
         [[idx_sol_nn, index_bord(nb_pts_x-1, y+1), index_bord(nb_pts_x-1, y)] for y in range(nb_pts_y-1)],
         [[idx_sol_nn, index_bord(nb_pts_x-1, 0), idx_sol_n0]]
-    ))
+    )).astype(FACE_DTYPE)
     return faces_side
 
 def generate_faces_bottom(grayscale_image: np.ndarray, pts_par_px: int = 1) -> np.ndarray:
@@ -254,54 +345,347 @@ def generate_faces_bottom(grayscale_image: np.ndarray, pts_par_px: int = 1) -> n
     idx_sol_0n = nb_vert -2
     idx_sol_nn = nb_vert -1
     faces_bottom = np.array([[idx_sol_00, idx_sol_0n, idx_sol_n0],
-                    [idx_sol_nn, idx_sol_n0, idx_sol_0n]])
+                    [idx_sol_nn, idx_sol_n0, idx_sol_0n]], dtype=FACE_DTYPE)
     return faces_bottom
 
-def generate_mesh(image_path: str, parameters: MeshGenerationParameters) -> Tuple[np.ndarray, np.ndarray]:
-    """Generates a mesh from a grayscale image
+def simplify_faces_top(grayscale_image: np.ndarray, parameters: MeshGenerationParameters) -> np.ndarray:
+    """Generates the faces for the top part of the object, with flat areas simplified
+    The vertices inside flat areas are not used by any face anymore
 
     Args:
-        image_path (str): Path to the grayscale image to be used
+        grayscale_image (np.ndarray): Source image as a grayscale matrix
         parameters(MeshGenerationParameters): Mesh generation parameters
 
     Returns:
-        Tuple[np.ndarray, np.ndarray]: Vertices and faces of the generated mesh
+        np.ndarray: The generated faces, using the indices of generate_vertices_top
+    """
+    nb_pts_x = grayscale_image.shape[0]
+    # The tolerance is converted from mm to grey levels
+    tolerance = parameters.simplificationToleranceMM * 255 / parameters.meshImageThicknessMM
+    _, triangles, _ = simplify_height_grid(grayscale_image, tolerance)
+    return (triangles[:, :, 0] + nb_pts_x * triangles[:, :, 1]).astype(FACE_DTYPE)
+
+def remove_unused_vertices(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Removes the vertices that are not used by any face, and updates the faces accordingly
+
+    Args:
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Vertices and faces of the compacted mesh, and the mask of the vertices that were kept
+    """
+    is_used = np.zeros(len(vertices), dtype=bool)
+    is_used[faces.ravel()] = True
+    new_indices = np.cumsum(is_used, dtype=faces.dtype) - 1
+    return vertices[is_used], new_indices[faces], is_used
+
+@functools.lru_cache(maxsize=4)
+def generate_grid_faces(nb_rows: int, nb_cols: int, pts_par_px: int = 1) -> np.ndarray:
+    """Generates all the faces of an object whose top is the full grid of vertices
+    They only depend on the shape of the grid, so the last results are cached (as read-only arrays)
+
+    Args:
+        nb_rows (int): Number of rows of the source image
+        nb_cols (int): Number of columns of the source image
+        pts_par_px (int, optional): Amount of vertices per pixel. Defaults to 1.
+
+    Returns:
+        np.ndarray: The faces of the top, upper sides, lower sides and bottom of the object, in this order
+    """
+    # The face generation functions only use the shape of the image
+    grid = np.broadcast_to(np.uint8(0), (nb_rows, nb_cols))
+    faces = np.vstack((generate_faces_top(grid, pts_par_px),
+                       generate_faces_border(grid, pts_par_px),
+                       generate_faces_side(grid, pts_par_px),
+                       generate_faces_bottom(grid, pts_par_px)))
+    faces.flags.writeable = False
+    return faces
+
+def generate_unit_mesh(grayscale_image: np.ndarray, parameters: MeshGenerationParameters, progress: Progress = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generates a mesh from a grayscale image, before it is scaled to its dimensions in mm
+    Coordinates are between 0 and 1 along the rows and columns, between 0 and 1 on the top of the object and between -1 and 0 for the base
+
+    Args:
+        grayscale_image (np.ndarray): Source image as a grayscale matrix, already resampled to the resolution of the mesh
+        parameters(MeshGenerationParameters): Mesh generation parameters
+        progress (Progress, optional): If given, its cancellation token is checked between the generation steps. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Vertices and faces of the mesh, and for each vertex its index in the top grid (-1 for the vertices of the base)
     """
-    widthMM = parameters.meshWidthMM
-    heightMM = parameters.meshHeightMM
-    imageThicknessMM = parameters.meshImageThicknessMM
-    baseThicknessMM = parameters.meshBaseThicknessMM
     pts_par_px = parameters.verticesPerPixel
     
-    grayscale_image = load_grayscale_image(image_path)
+    def check_cancelled():
+        if progress is not None:
+            progress.check_cancelled()
     
+    check_cancelled()
     vertices_top = generate_vertices_top(grayscale_image, pts_par_px)
+    check_cancelled()
     vertices_border = generate_vertices_border(grayscale_image, pts_par_px)
     vertices_bottom = generate_vertices_bottom()
     
-    # OpenCV uses x for rows and y for columns, such as [0,1] is top right and [1,0] botttom left
-    # We want to use the opposite, so width and height are reversed in the following lines
-    vertices_top = scale_vertices(vertices_top, (heightMM, widthMM, imageThicknessMM))
-    vertices_border = scale_vertices(vertices_border, (heightMM, widthMM, baseThicknessMM))
-    vertices_bottom = scale_vertices(vertices_bottom, (heightMM, widthMM, baseThicknessMM))
-    
     all_vertices = np.vstack((vertices_top, vertices_border, vertices_bottom))
+    grid_index = np.concatenate((np.arange(len(vertices_top), dtype=FACE_DTYPE), np.full(len(vertices_border) + len(vertices_bottom), -1, dtype=FACE_DTYPE)))
     
-    faces_top = generate_faces_top(grayscale_image, pts_par_px)
-    faces_border = generate_faces_border(grayscale_image, pts_par_px)
-    faces_side = generate_faces_side(grayscale_image, pts_par_px)
-    faces_bottom = generate_faces_bottom(grayscale_image, pts_par_px)
+    check_cancelled()
+    all_faces = generate_grid_faces(grayscale_image.shape[0], grayscale_image.shape[1], pts_par_px)
     
-    all_faces = np.vstack((faces_top, faces_border, faces_side, faces_bottom))
+    if parameters.simplification == "numpy":
+        check_cancelled()
+        nb_faces_top = 2 * (grayscale_image.shape[0]*pts_par_px - 1) * (grayscale_image.shape[1]*pts_par_px - 1)
+        all_faces = np.vstack((simplify_faces_top(grayscale_image, parameters), all_faces[nb_faces_top:]))
+        # The vertices inside flat areas are not used anymore
+        all_vertices, all_faces, is_used = remove_unused_vertices(all_vertices, all_faces)
+        grid_index = grid_index[is_used]
     
-    return all_vertices, all_faces
+    return all_vertices, all_faces, grid_index
+
+def scale_unit_mesh(unit_vertices: np.ndarray, grid_index: np.ndarray, parameters: MeshGenerationParameters) -> np.ndarray:
+    """Scales the vertices of a mesh made by generate_unit_mesh to its dimensions in mm
+
+    Args:
+        unit_vertices (np.ndarray): The vertices to scale
+        grid_index (np.ndarray): For each vertex, its index in the top grid (-1 for the vertices of the base)
+        parameters(MeshGenerationParameters): Mesh generation parameters
+
+    Returns:
+        np.ndarray: The scaled vertices
+    """
+    # OpenCV uses x for rows and y for columns, such as [0,1] is top right and [1,0] botttom left
+    # We want to use the opposite, so width and height are reversed in the following lines
+    vertices = scale_vertices(unit_vertices, (parameters.meshHeightMM, parameters.meshWidthMM, 1))
+    vertices[:, 2] *= np.where(grid_index >= 0, VERTEX_DTYPE(parameters.meshImageThicknessMM), VERTEX_DTYPE(parameters.meshBaseThicknessMM))
+    return vertices
+
+def prepare_grayscale_image(image_path: Union[str, np.ndarray], parameters: MeshGenerationParameters) -> np.ndarray:
+    """Loads the grayscale image if needed, and resamples it to the resolution of the mesh
+
+    Args:
+        image_path (Union[str, np.ndarray]): Path to the grayscale image to be used, or the grayscale image itself
+        parameters(MeshGenerationParameters): Mesh generation parameters
+
+    Returns:
+        np.ndarray: The grayscale image, at the resolution of the mesh
+    """
+    grayscale_image = load_grayscale_image(image_path) if isinstance(image_path, str) else image_path
+    # The grey levels are handled as labels, which keeps the heights of the flat areas intact
+    grayscale_image = resample_labels(grayscale_image, grid_shape(grayscale_image.shape, parameters))
+    # The mesh needs at least two vertices along each side : the pixels of 1 pixel wide images are repeated
+    if min(grayscale_image.shape) < 2:
+        grayscale_image = np.repeat(np.repeat(grayscale_image, 2 if grayscale_image.shape[0] < 2 else 1, axis=0),
+                                    2 if grayscale_image.shape[1] < 2 else 1, axis=1)
+    return grayscale_image
+
+def generate_mesh(image_path: Union[str, np.ndarray], parameters: MeshGenerationParameters, progress: Progress = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Generates a mesh from a grayscale image
+
+    Args:
+        image_path (Union[str, np.ndarray]): Path to the grayscale image to be used, or the grayscale image itself
+        parameters(MeshGenerationParameters): Mesh generation parameters
+        progress (Progress, optional): If given, its cancellation token is checked between the generation steps. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Vertices and faces of the generated mesh
+    """
+    grayscale_image = prepare_grayscale_image(image_path, parameters)
+    unit_vertices, faces, grid_index = generate_unit_mesh(grayscale_image, parameters, progress)
+    return scale_unit_mesh(unit_vertices, grid_index, parameters), faces
+
+class MeshState:
+    """
+    Last generated mesh, kept so that generating it again with other parameters only updates what changed
+    For a given shape of the grid the faces never change, the coordinates along the rows and columns only scale,
+    and the heights only change for the pixels whose grey level changed. The Blender object is also kept and updated.
+    """
+    def __init__(self):
+        self.grayscale_image = None
+        self.parameters = None
+        self.unit_vertices = None
+        self.faces = None
+        self.grid_index = None
+        self.vertices = None
+        self.blender_object = None
+        # The mesh is modified in place, so the jobs that share it use it one after the other
+        self.lock = threading.Lock()
+
+    def _needs_new_topology(self, grayscale_image: np.ndarray, parameters: MeshGenerationParameters) -> bool:
+        """True if the faces of the mesh cannot be reused"""
+        previous = self.parameters
+        if previous is None or grayscale_image.shape != self.grayscale_image.shape \
+           or parameters.simplification != previous.simplification or parameters.verticesPerPixel != previous.verticesPerPixel:
+            return True
+        if parameters.simplification == "numpy":
+            # The simplified faces depend on the heights, and on the tolerance relative to the thickness
+            return not np.array_equal(grayscale_image, self.grayscale_image) \
+                or parameters.simplificationToleranceMM / parameters.meshImageThicknessMM != previous.simplificationToleranceMM / previous.meshImageThicknessMM
+        return False
+
+    def update(self, grayscale_image: np.ndarray, parameters: MeshGenerationParameters, progress: Progress = None) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """Makes the mesh of a grayscale image, reusing the previous one as much as possible
+
+        Args:
+            grayscale_image (np.ndarray): Source image as a grayscale matrix, already resampled to the resolution of the mesh
+            parameters(MeshGenerationParameters): Mesh generation parameters
+            progress (Progress, optional): If given, its cancellation token is checked between the generation steps. Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, bool]: Vertices and faces of the mesh, and False if the faces are the same as the previous ones
+        """
+        parameters = dataclasses.replace(parameters)
+        if self._needs_new_topology(grayscale_image, parameters):
+            self.unit_vertices, self.faces, self.grid_index = generate_unit_mesh(grayscale_image, parameters, progress)
+            # The Blender object has the previous faces : it cannot be updated anymore
+            self.blender_object = None
+            self.vertices = scale_unit_mesh(self.unit_vertices, self.grid_index, parameters)
+            self.grayscale_image = grayscale_image.copy()
+            self.parameters = parameters
+            return self.vertices, self.faces, True
+        
+        previous = self.parameters
+        is_top = self.grid_index >= 0
+        # Heights of the top vertices whose grey level changed
+        changed_pixels = (grayscale_image != self.grayscale_image).ravel(order='F')
+        if changed_pixels.any():
+            is_changed = is_top.copy()
+            is_changed[is_top] = changed_pixels[self.grid_index[is_top]]
+            self.unit_vertices[is_changed, 2] = grayscale_image.ravel(order='F')[self.grid_index[is_changed]] / 255
+            self.vertices[is_changed, 2] = self.unit_vertices[is_changed, 2] * parameters.meshImageThicknessMM
+            self.grayscale_image = grayscale_image.copy()
+        # Coordinates that only scale
+        if parameters.meshHeightMM != previous.meshHeightMM:
+            self.vertices[:, 0] = self.unit_vertices[:, 0] * parameters.meshHeightMM
+        if parameters.meshWidthMM != previous.meshWidthMM:
+            self.vertices[:, 1] = self.unit_vertices[:, 1] * parameters.meshWidthMM
+        if parameters.meshImageThicknessMM != previous.meshImageThicknessMM:
+            self.vertices[is_top, 2] = self.unit_vertices[is_top, 2] * parameters.meshImageThicknessMM
+        if parameters.meshBaseThicknessMM != previous.meshBaseThicknessMM:
+            self.vertices[~is_top, 2] = self.unit_vertices[~is_top, 2] * parameters.meshBaseThicknessMM
+        self.parameters = parameters
+        return self.vertices, self.faces, False
+
+#endregion
+
+#region ############################## Validation ##############################
+
+@dataclass
+class MeshValidationReport:
+    """Problems found in a mesh. A valid mesh is closed, manifold, consistently wound and has no degenerate faces."""
+    vertices: int = 0
+    faces: int = 0
+    # Faces that use a vertex twice, or have a null area
+    degenerateFaces: int = 0
+    # Vertices at the same position as another one
+    duplicateVertices: int = 0
+    # Edges used by a single face : the mesh has holes
+    boundaryEdges: int = 0
+    # Edges used by more than two faces
+    nonManifoldEdges: int = 0
+    # Edges whose two faces go through them in the same direction : the faces are not all facing outwards
+    inconsistentEdges: int = 0
+
+    @property
+    def isWatertight(self) -> bool:
+        return self.boundaryEdges == 0 and self.nonManifoldEdges == 0
+
+    @property
+    def isValid(self) -> bool:
+        return self.isWatertight and self.degenerateFaces == 0 and self.inconsistentEdges == 0
+
+    def summary(self) -> str:
+        """Human readable summary of the report"""
+        if self.isValid:
+            return f"Valid mesh : {self.vertices} vertices, {self.faces} faces, watertight"
+        problems = [f"{count} {name}" for count, name in [(self.degenerateFaces, "degenerate faces"), (self.duplicateVertices, "duplicate vertices"),
+                                                           (self.boundaryEdges, "boundary edges (holes)"), (self.nonManifoldEdges, "non-manifold edges"),
+                                                           (self.inconsistentEdges, "edges with inconsistent winding")] if count > 0]
+        return f"Invalid mesh ({self.vertices} vertices, {self.faces} faces) : " + ", ".join(problems)
+
+class MeshValidationError(ValueError):
+    """Raised when a mesh is not valid and the validation is set to fail"""
+    def __init__(self, report: MeshValidationReport):
+        super().__init__(report.summary())
+        self.report = report
+
+def validate_mesh(vertices: np.ndarray, faces: np.ndarray, chunk_size: int = 1 << 16) -> MeshValidationReport:
+    """Checks that a mesh can be printed, using whole-array operations only
+
+    Args:
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh, as triplets of vertex indices
+        chunk_size (int, optional): Amount of faces whose area is checked at once. Defaults to 2^16.
+
+    Returns:
+        MeshValidationReport: The problems found
+    """
+    report = MeshValidationReport(vertices=len(vertices), faces=len(faces))
+    if len(faces) == 0:
+        return report
+    faces = np.asarray(faces, dtype=np.int64)
+
+    # Degenerate faces : a repeated vertex, or an area that is null compared to the size of the mesh
+    # They are counted by chunks, whose temporary arrays stay in cache
+    scale = np.ptp(vertices, axis=0).max()
+    min_area_squared = (1e-12 * scale * scale)**2
+    for start in range(0, len(faces), chunk_size):
+        a, b, c = faces[start:start+chunk_size].T
+        origin = np.take(vertices, a, axis=0)
+        u, v = np.take(vertices, b, axis=0) - origin, np.take(vertices, c, axis=0) - origin
+        cross_x = u[:, 1]*v[:, 2] - u[:, 2]*v[:, 1]
+        cross_y = u[:, 2]*v[:, 0] - u[:, 0]*v[:, 2]
+        cross_z = u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]
+        is_degenerate = (a == b) | (b == c) | (c == a) | (cross_x*cross_x + cross_y*cross_y + cross_z*cross_z <= min_area_squared)
+        report.degenerateFaces += int(np.count_nonzero(is_degenerate))
+
+    # Duplicate vertices : the vertices are sorted by a hash of their coordinates, then neighbours with the same hash are compared
+    coordinates = np.ascontiguousarray(vertices, dtype=np.float64).view(np.int64)
+    hashes = (coordinates[:, 0] * np.int64(-7046029254386353131)) ^ (coordinates[:, 1] * np.int64(-4417276706812531889)) ^ coordinates[:, 2]
+    order = np.argsort(hashes)
+    same_hash = np.flatnonzero(hashes[order][1:] == hashes[order][:-1])
+    report.duplicateVertices = int(np.count_nonzero((coordinates[order[same_hash]] == coordinates[order[same_hash + 1]]).all(axis=1)))
+
+    # Edges : each face goes through its edges a->b, b->c and c->a. An edge is identified by its two vertices in increasing order,
+    # and the lowest bit of its key tells in which direction the face goes through it. A single sort groups the uses of each edge.
+    starts = faces.ravel()
+    ends = np.roll(faces, -1, axis=1).ravel()
+    low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+    keys = np.sort(((low * len(vertices) + high) << 1) | (starts > ends))
+    edges = keys >> 1
+    group_starts = np.flatnonzero(np.concatenate(([True], edges[1:] != edges[:-1])))
+    uses = np.diff(np.append(group_starts, len(edges)))
+    report.boundaryEdges = int(np.count_nonzero(uses == 1))
+    report.nonManifoldEdges = int(np.count_nonzero(uses > 2))
+    # An edge shared by two faces must be used once in each direction
+    pairs = group_starts[uses == 2]
+    report.inconsistentEdges = int(np.count_nonzero((keys[pairs] & 1) == (keys[pairs + 1] & 1)))
+    return report
+
+def check_mesh(vertices: np.ndarray, faces: np.ndarray, parameters: MeshGenerationParameters) -> MeshValidationReport:
+    """Validates a mesh as asked by the parameters
+
+    Raises:
+        MeshValidationError: The mesh is not valid, and the validation is set to fail
+
+    Returns:
+        MeshValidationReport: The report, or None if the validation is disabled
+    """
+    if parameters.validation == "none":
+        return None
+    report = validate_mesh(vertices, faces)
+    if not report.isValid and parameters.validation == "fail":
+        raise MeshValidationError(report)
+    return report
 
 #endregion
 
 #region ############################## Blender ##############################
 
+# Blender has a single scene per process, it is used by one job at a time
+blender_lock = threading.Lock()
+
 def blender_new_empty_scene() -> None:
-    """Empties the Blender scene before use
+    """Empties the Blender scene before use, and deletes the data of the removed objects
     """
     scene = bpy.context.scene
     for obj in scene.objects:
@@ -309,26 +693,50 @@ def blender_new_empty_scene() -> None:
 
     for tex in bpy.data.textures:
         bpy.data.textures.remove(tex, do_unlink=True)
+    blender_purge_orphans()
+
+def blender_purge_orphans() -> None:
+    """Deletes the data that is not used anymore, such as the meshes of removed objects
+    Removing an object keeps its mesh in bpy.data : without this, every conversion would leave its mesh in memory
+    """
+    if hasattr(bpy.data, "orphans_purge"):
+        bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+        return
+    # Older versions of Blender
+    for collection in (bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images):
+        for block in list(collection):
+            if block.users == 0:
+                collection.remove(block)
 
 
 def blender_new_object(vertices: np.ndarray, faces: np.ndarray, object_name: str = "object", mesh_name: str = "mesh") -> bpy.types.Object:
     """Creates a new object in the scene using mesh data
+    The arrays are copied into Blender as they are, without going through Python lists
 
     Args:
         vertices (np.ndarray): The vertices of the mesh to use
-        faces (np.ndarray): The faces of the mesh to use
+        faces (np.ndarray): The triangles of the mesh to use
         object_name (str, optional): The name given to the new object. Defaults to "object".
         mesh_name (str, optional): The name given to the mesh in Blender. Defaults to "mesh".
 
     Returns:
         bpy.types.Object: The newly created object
     """
-    vertices = list(vertices)
-    edges = []
-    faces = list(faces)
+    vertices = np.ascontiguousarray(vertices, dtype=VERTEX_DTYPE)
+    faces = np.ascontiguousarray(faces, dtype=FACE_DTYPE)
     mesh = bpy.data.meshes.new(mesh_name)
-    mesh.from_pydata(vertices, edges, faces)
-    mesh.update()
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set("vertex_index", faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, 3, dtype=FACE_DTYPE))
+    try:
+        mesh.polygons.foreach_set("loop_total", np.full(len(faces), 3, dtype=FACE_DTYPE))
+    except (AttributeError, TypeError, RuntimeError):
+        # Read-only since Blender 4.0, where it is deduced from the starts of the polygons
+        pass
+    mesh.update(calc_edges=True)
 
     object = bpy.data.objects.new(object_name, mesh)
     bpy.context.collection.objects.link(object)
@@ -341,16 +749,14 @@ def blender_create_vertex_groups(object: bpy.types.Object, vertices: np.ndarray)
         object (bpy.types.Object): The object to edit
         vertices (np.ndarray): The vertices of the object's mesh
     """
-    max_x = max(vertices ,key=lambda item:item[0])[0]
-    max_y = max(vertices ,key=lambda item:item[1])[1]
-    indices_of_face_vertices = [i for i,(x,y,_) in enumerate(vertices) if x != 0 and y != 0 and x != max_x and y != max_y]
-    indices_of_side_vertices = [i for i,(x,y,_) in enumerate(vertices) if x == 0 or y == 0 or x == max_x or y == max_y]
+    x, y = vertices[:, 0], vertices[:, 1]
+    is_side = (x == 0) | (y == 0) | (x == x.max()) | (y == y.max())
     
     face_vertex_group = object.vertex_groups.new(name='Face')
-    face_vertex_group.add(indices_of_face_vertices, 1.0, 'ADD')
+    face_vertex_group.add(np.flatnonzero(~is_side).tolist(), 1.0, 'ADD')
     
     side_vertex_group = object.vertex_groups.new(name='Sides')
-    side_vertex_group.add(indices_of_side_vertices, 1.0, 'ADD')
+    side_vertex_group.add(np.flatnonzero(is_side).tolist(), 1.0, 'ADD')
     
 
 def blender_select_object(object: bpy.types.Object) -> None:
@@ -464,47 +870,170 @@ def approximation_weld_threshold(vertices: np.ndarray, merge_radius: double = 3)
     """
     
     # Ideal thershold, ignoring problems with the Z axis
-    step_size = vertices[1][0]
+    step_size = float(vertices[1][0])
     desired_threshold = 1.5*merge_radius*step_size
 
     # Reducing the thershold if necessary in order to avoid merging points along the Z axis
-    sorted_z = sorted(set([z for _,_,z in vertices]))
-    min_diff_z = min([sorted_z[i + 1] - sorted_z[i] for i in range(len(sorted_z)-1)])
+    sorted_z = np.unique(vertices[:, 2])
+    min_diff_z = float(np.diff(sorted_z).min())
     maximum_threshold = .99*min_diff_z
     
     return min([desired_threshold, maximum_threshold])
 
 
-def blender_export(filepath: str, stl: bool = True, blend: bool = False) -> None:
-    """Exports the Blender scene as a STL file and/or a BLEND file
-    Modifiers will be applied during STL export
+def blender_save_blend(filepath: str, object: bpy.types.Object, vertices: np.ndarray = None, faces: np.ndarray = None) -> None:
+    """Saves the Blender scene as a BLEND file
 
     Args:
         filepath (str): Path to the output files, without the extension
-        stl (bool, optional): If true, generates a STL file. Defaults to True.
-        blend (bool, optional): If true, generates a BLEND file. Defaults to False.
+        object (bpy.types.Object): The object of the mesh, with its modifiers
+        vertices (np.ndarray, optional): Vertices of the evaluated mesh. If given with faces, the file only holds this mesh instead of the object. Defaults to None.
+        faces (np.ndarray, optional): Triangles of the evaluated mesh. Defaults to None.
+    """
+    path = generateNameResultingFile(filepath, "blend")
+    if vertices is None or faces is None:
+        with suppress_stdout():
+            bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+        return
+    # The full resolution object is taken out of the scene while saving : the data without users is not written
+    collection = bpy.context.collection
+    simplified = blender_new_object(vertices, faces, object_name=object.name + "_simplified", mesh_name="mesh_simplified")
+    collection.objects.unlink(object)
+    try:
+        with suppress_stdout():
+            bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+    finally:
+        collection.objects.link(object)
+        mesh = simplified.data
+        bpy.data.objects.remove(simplified)
+        bpy.data.meshes.remove(mesh)
+
+def blender_update_object(object: bpy.types.Object, vertices: np.ndarray) -> bool:
+    """Moves the vertices of an existing object, whose faces stay the same
+
+    Args:
+        object (bpy.types.Object): The object to update, made by a previous generation
+        vertices (np.ndarray): The new coordinates of its vertices
+
+    Returns:
+        bool: False if the object cannot be reused (it was removed from Blender, or its amount of vertices differs)
     """
-    with suppress_stdout():
-        if stl:
-            bpy.ops.export_mesh.stl(filepath=generateNameResultingFile(filepath, "stl"), use_mesh_modifiers=True)
-        if blend:
-            bpy.ops.wm.save_as_mainfile(filepath=generateNameResultingFile(filepath, "blend"))
+    try:
+        mesh = object.data
+        if object.name not in bpy.context.scene.objects or len(mesh.vertices) != len(vertices):
+            return False
+    except ReferenceError:
+        # The object was removed from Blender
+        return False
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=VERTEX_DTYPE).ravel())
+    mesh.update()
+    # The weld threshold depends on the heights, the other modifiers only depend on the topology
+    if "Weld" in object.modifiers:
+        object.modifiers["Weld"].merge_threshold = approximation_weld_threshold(vertices)
+    return True
 
-def blender_generate_stl(vertices: np.ndarray, faces: np.ndarray, parameters: MeshGenerationParameters, progress: Progress):
-    """Generates and exports a Blender mesh from sets of vertices and faces
-    Modifiers are added to this mesh, and will be applied during STL export
+def blender_evaluated_mesh(object: bpy.types.Object) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the mesh of an object after its modifiers, as it is exported
 
     Args:
-        vertices (np.ndarray): Vertices of the mesh to generate
-        faces (np.ndarray): Faces of the mesh to generate
+        object (bpy.types.Object): The object
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Vertices and triangles of the evaluated mesh
+    """
+    evaluated = object.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    mesh = evaluated.to_mesh()
+    try:
+        mesh.calc_loop_triangles()
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=VERTEX_DTYPE)
+        mesh.vertices.foreach_get("co", vertices)
+        faces = np.empty(len(mesh.loop_triangles) * 3, dtype=FACE_DTYPE)
+        mesh.loop_triangles.foreach_get("vertices", faces)
+    finally:
+        evaluated.to_mesh_clear()
+    return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+def blender_prepare_object(vertices: np.ndarray, faces: np.ndarray, parameters: MeshGenerationParameters, progress: Progress,
+                           mesh_state: MeshState = None, topology_changed: bool = True) -> bpy.types.Object:
+    """Creates the Blender object of a mesh, with its modifiers, or updates the one of mesh_state when the faces did not change
+
+    Args:
+        vertices (np.ndarray): Vertices of the mesh
+        faces (np.ndarray): Faces of the mesh
         parameters(MeshGenerationParameters): Mesh generation parameters
         progress (Progress): Object used to notify the program when progress is made
+        mesh_state (MeshState, optional): If given, the object it holds is updated instead of being created again when possible. Defaults to None.
+        topology_changed (bool, optional): False if the faces are the same as for the object of mesh_state. Defaults to True.
+
+    Returns:
+        bpy.types.Object: The object, ready to be exported
     """
-    
     progress.update_progress(0, "Creation of the blender object")
+    progress.check_cancelled()
+    if mesh_state is not None and mesh_state.blender_object is not None and not topology_changed \
+       and blender_update_object(mesh_state.blender_object, vertices):
+        return mesh_state.blender_object
+    
     blender_new_empty_scene()
     object = blender_new_object(vertices, faces)
     blender_select_object(object)
+    
+    if parameters.simplification == "blender":
+        blender_add_simplification_modifiers(object, vertices, progress)
+    if mesh_state is not None:
+        mesh_state.blender_object = object
+    return object
+
+def blender_generate_stl(vertices: np.ndarray, faces: np.ndarray, parameters: MeshGenerationParameters, progress: Progress,
+                         mesh_state: MeshState = None, topology_changed: bool = True) -> Tuple[MeshValidationReport, np.ndarray, np.ndarray]:
+    """Generates a Blender mesh from sets of vertices and faces, and exports it
+    The modifiers are evaluated once : the STL file, the simplified BLEND file and the returned mesh all come from the same evaluated mesh.
+
+    Args:
+        vertices (np.ndarray): Vertices of the mesh to generate
+        faces (np.ndarray): Faces of the mesh to generate
+        parameters(MeshGenerationParameters): Mesh generation parameters
+        progress (Progress): Object used to notify the program when progress is made
+        mesh_state (MeshState, optional): If given, the object it holds is updated instead of being created again when possible. Defaults to None.
+        topology_changed (bool, optional): False if the faces are the same as for the object of mesh_state. Defaults to True.
+
+    Returns:
+        Tuple[MeshValidationReport, np.ndarray, np.ndarray]: The validation report of the evaluated mesh (None if the validation is disabled),
+            and the vertices and triangles of the evaluated mesh, for the other formats
+    """
+    
+    object = blender_prepare_object(vertices, faces, parameters, progress, mesh_state, topology_changed)
+    
+    progress.update_progress(45, "Applying the modifiers")
+    progress.check_cancelled()
+    evaluated_vertices, evaluated_faces = blender_evaluated_mesh(object)
+    
+    # The mesh is checked as it will be exported, after the modifiers, before the export itself
+    report = check_mesh(evaluated_vertices, evaluated_faces, parameters)
+    
+    progress.update_progress(50, "Exporting")
+    # The export itself cannot be interrupted
+    progress.check_cancelled()
+    if parameters.saveSTL:
+        write_stl(generateNameResultingFile(parameters.outputMeshPath, "stl"), evaluated_vertices, evaluated_faces)
+    if parameters.saveBlendFile:
+        if parameters.blendContent == "full":
+            blender_save_blend(parameters.outputMeshPath, object)
+        else:
+            blender_save_blend(parameters.outputMeshPath, object, evaluated_vertices, evaluated_faces)
+    if mesh_state is None:
+        # Nothing will reuse the object : its data is deleted now rather than at the next conversion
+        blender_new_empty_scene()
+    return report, evaluated_vertices, evaluated_faces
+
+def blender_add_simplification_modifiers(object: bpy.types.Object, vertices: np.ndarray, progress: Progress):
+    """Adds to an object the modifiers that simplify its mesh. They will be applied during STL export.
+
+    Args:
+        object (bpy.types.Object): The target object
+        vertices (np.ndarray): Vertices of the object's mesh
+        progress (Progress): Object used to notify the program when progress is made
+    """
     blender_create_vertex_groups(object, vertices)
     
     progress.update_progress(10, "Adding the decimate modifier")
@@ -518,14 +1047,61 @@ def blender_generate_stl(vertices: np.ndarray, faces: np.ndarray, parameters: Me
     
     progress.update_progress(40, "Adding the triangulate modifier")
     blender_add_triangulate_modifier(object, apply=False)
-    
-    progress.update_progress(50, "Exporting")
-    blender_export(parameters.outputMeshPath, stl=parameters.saveSTL, blend=parameters.saveBlendFile)
 
 #endregion
 
 #region ############################## Output ##############################
 
+def face_color_indices(vertices: np.ndarray, faces: np.ndarray, color_index_image: np.ndarray, parameters: MeshGenerationParameters, base_index: int) -> np.ndarray:
+    """Finds the color of the region of the image under each face
+    Faces of the top of the object take the color under their center, the other ones (sides and bottom) take the base color
+
+    Args:
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh
+        color_index_image (np.ndarray): Index of the color of each vertex of the top grid, as a 2D array
+        parameters (MeshGenerationParameters): Mesh generation parameters
+        base_index (int): Index given to the faces that are not on the top of the object
+
+    Returns:
+        np.ndarray: The color index of each face
+    """
+    face_vertices = vertices[faces]
+    centers = face_vertices.mean(axis=1)
+    nb_rows, nb_cols = color_index_image.shape
+    # The first coordinate goes along the rows of the image, see generate_mesh
+    rows = np.clip(np.rint(centers[:, 0] / parameters.meshHeightMM * (nb_rows-1)), 0, nb_rows-1).astype(np.intp)
+    cols = np.clip(np.rint(centers[:, 1] / parameters.meshWidthMM * (nb_cols-1)), 0, nb_cols-1).astype(np.intp)
+    indices = color_index_image[rows, cols].astype(np.int32)
+    # The top of the object is at positive heights, the base below 0
+    indices[~(face_vertices[:, :, 2] >= 0).all(axis=1)] = base_index
+    return indices
+
+def export_indexed_meshes(vertices: np.ndarray, faces: np.ndarray, parameters: MeshGenerationParameters,
+                          color_index_image: np.ndarray = None, colors: List[str] = None) -> None:
+    """Writes the mesh in the indexed formats selected in the parameters (3MF and PLY)
+
+    Args:
+        vertices (np.ndarray): The vertices of the mesh
+        faces (np.ndarray): The faces of the mesh
+        parameters (MeshGenerationParameters): Mesh generation parameters
+        color_index_image (np.ndarray, optional): Index of the color of each pixel of the height map, to export the color regions. Defaults to None.
+        colors (List[str], optional): Hex representation of each color. Defaults to None.
+    """
+    face_colors = None
+    if color_index_image is not None and colors:
+        # The base takes the color of the first (most common) color
+        face_colors = face_color_indices(vertices, faces, color_index_image, parameters, base_index=len(colors))
+        colors = list(colors) + [colors[0]]
+    if parameters.save3MF:
+        materials = None if face_colors is None else [(c, c) for c in colors[:-1]] + [("Base", colors[-1])]
+        write_3mf(generateNameResultingFile(parameters.outputMeshPath, "3mf"), vertices, faces, face_colors, materials)
+    if parameters.savePLY:
+        rgb = None
+        if face_colors is not None:
+            rgb = hex_to_rgb(colors)[face_colors]
+        write_ply(generateNameResultingFile(parameters.outputMeshPath, "ply"), vertices, faces, rgb)
+
 @contextmanager
 def suppress_stdout():
     """Suppresses stdout output for python and C code"""
@@ -533,48 +1109,105 @@ def suppress_stdout():
     with open(os.devnull, "w") as devnull:
         sys.stdout.flush() # <--- important when redirecting to files
 
-        # Duplicate stdout (file descriptor 1) to a different file descriptor number
-        newstdout = os.dup(1)
-
-        # Duplicate the file descriptor for /dev/null and overwrite the value for stdout (file descriptor 1)
-        os.dup2(devnull.fileno(), 1)
+        # Duplicate stdout (file descriptor 1) to a different file descriptor number, to restore it afterwards
+        saved_stdout = os.dup(1)
+        try:
+            # Duplicate the file descriptor for /dev/null and overwrite the value for stdout (file descriptor 1)
+            os.dup2(devnull.fileno(), 1)
 
-        # Use the original stdout to still be able to print to stdout within python
-        sys.stdout = os.fdopen(newstdout, 'w')
-    
-        # This next line is the only one needed for python output
-        with redirect_stdout(devnull):
-            try:
+            # This next line is the only one needed for python output
+            with redirect_stdout(devnull):
                 # The code inside the "with" block will be called here
                 yield
-            finally:
-                # Restore the original stdout at the end
-                os.dup2(newstdout, 1)
+        finally:
+            # Restore the original stdout at the end, and close the copy, which would otherwise leak on every call
+            os.dup2(saved_stdout, 1)
+            os.close(saved_stdout)
 
 #endregion
 
 #region ############################## Main method ##############################
 
-def generateSTL(imagePath: str, parameters: MeshGenerationParameters, progress: Progress):
+def generateSTL(imagePath: Union[str, np.ndarray], parameters: MeshGenerationParameters, progress: Progress,
+                colorIndexImage: np.ndarray = None, colors: List[str] = None, meshState: MeshState = None):
 	"""
 	Generate the mesh under the stl format.
 
 	Args:
-		imagePath(str): The path towards the depth map image
+		imagePath(Union[str, np.ndarray]): The path towards the depth map image, or the depth map itself
 		parameters(MeshMandatoryParameters): The mandatory parameters to generate the mesh
         operatorsOpionalParameters(OperatorsOpionalParameters): Optional parameters for more fine tuning of the mesh generation 
         progress (Progress): Object used to notify the program when progress is made
+        colorIndexImage (np.ndarray, optional): Index of the color of each pixel of the depth map, used to export the color regions in 3MF and PLY files
+        colors (List[str], optional): Hex representation of each color of colorIndexImage
+        meshState (MeshState, optional): Mesh of the previous generation, only updated where the parameters changed. Defaults to None.
+
+	Returns:
+		MeshValidationReport: The validation report of the exported mesh, or None if the validation is disabled
 	"""
 	# ## Check if the result of the generation will be saved in at least one format, otherwise raise an exception
-	if not(parameters.saveBlendFile or parameters.saveSTL):
-		raise("No output format detected, doing nothing")
+	if not parameters.hasOutput():
+		raise ValueError("No output format detected, doing nothing")
  
+	# The mesh of the previous generation is modified in place, so the jobs that share it run one after the other
+	with (meshState.lock if meshState is not None else nullcontext()):
+		return _generateSTL(imagePath, parameters, progress, colorIndexImage, colors, meshState)
+
+def prepareMesh(imagePath: Union[str, np.ndarray], parameters: MeshGenerationParameters, meshState: MeshState, progress: Progress) -> None:
+	"""Does the work of generateSTL that comes before writing the files, and keeps it in meshState
+	A generateSTL call with the same meshState then only does what changed since, and writes the files.
+	This is meant to be done in the background, while the user is still choosing the parameters.
+
+	Args:
+		imagePath (Union[str, np.ndarray]): Path to the grayscale image to be used, or the grayscale image itself
+		parameters (MeshGenerationParameters): Mesh generation parameters
+		meshState (MeshState): Where the mesh, and the Blender object if Blender is used, are kept
+		progress (Progress): Object used to notify the program when progress is made. Its cancellation token is checked regularly.
+	"""
+	with meshState.lock:
+		vertices, faces, topologyChanged = meshState.update(prepare_grayscale_image(imagePath, parameters), parameters, progress)
+		if bpy is not None and parameters.usesBlender():
+			progress.check_cancelled()
+			with blender_lock:
+				blender_prepare_object(vertices, faces, parameters, progress, mesh_state=meshState, topology_changed=topologyChanged)
+
+def _generateSTL(imagePath: Union[str, np.ndarray], parameters: MeshGenerationParameters, progress: Progress,
+                 colorIndexImage: np.ndarray, colors: List[str], meshState: MeshState):
+	"""Body of generateSTL, called with the mesh state locked"""
 	progress.update_progress(0, "Generation of the base mesh")
-	vertices, faces = generate_mesh(imagePath, parameters)
+	if meshState is None:
+		vertices, faces = generate_mesh(imagePath, parameters, progress)
+		topologyChanged = True
+	else:
+		vertices, faces, topologyChanged = meshState.update(prepare_grayscale_image(imagePath, parameters), parameters, progress)
+ 
+	report = None
+	if parameters.usesBlender():
+		if bpy is None:
+			raise RuntimeError("Blender (bpy) is required for this simplification method or to save BLEND files")
+		progress.update_progress(50, "Applying modifiers and exporting")
+		with blender_lock:
+			# The indexed formats are written from the same evaluated mesh as the other files
+			report, vertices, faces = blender_generate_stl(vertices, faces, parameters, progress=progress.make_child(50,90),
+			                                               mesh_state=meshState, topology_changed=topologyChanged)
+	else:
+		# The mesh is checked before any file is written, so that an invalid mesh fails fast
+		progress.update_progress(45, "Checking the mesh")
+		report = check_mesh(vertices, faces, parameters)
+		if parameters.saveSTL:
+			# Blender is not needed : the STL file is written directly
+			progress.update_progress(50, "Exporting")
+			progress.check_cancelled()
+			write_stl(generateNameResultingFile(parameters.outputMeshPath, "stl"), vertices, faces)
  
-	progress.update_progress(50, "Applying modifiers and exporting")
-	blender_generate_stl(vertices, faces, parameters, progress=progress.make_child(50,100))
+	if parameters.save3MF or parameters.savePLY:
+		progress.update_progress(90, "Exporting indexed formats")
+		progress.check_cancelled()
+		if colorIndexImage is not None and colorIndexImage.shape != grid_shape(colorIndexImage.shape, parameters):
+			colorIndexImage = resample_labels(colorIndexImage, grid_shape(colorIndexImage.shape, parameters))
+		export_indexed_meshes(vertices, faces, parameters, colorIndexImage, colors)
  
 	progress.update_progress(100, "Done")
+	return report
 
 #endregion
\ No newline at end of file
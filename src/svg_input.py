@@ -0,0 +1,393 @@
+import math
+import re
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import cv2
+from dataclasses import dataclass, field
+from PIL import ImageColor
+from typing import Dict, List, Optional, Set, Tuple
+
+# Size of a unit in pixels (CSS units, 96 pixels per inch)
+UNITS_TO_PX = {"": 1., "px": 1., "pt": 96 / 72, "pc": 16., "mm": 96 / 25.4, "cm": 96 / 2.54, "in": 96.}
+# Amount of segments used for each curve
+CURVE_SEGMENTS = 16
+# Coordinates are given to OpenCV as fixed point numbers with this many fractional bits
+SUBPIXEL_BITS = 4
+# Elements that hold no shape to draw, or shapes that are only drawn where they are referenced
+SKIPPED_TAGS = {"defs", "clipPath", "mask", "symbol", "marker", "pattern", "linearGradient", "radialGradient", "title", "desc", "metadata", "style"}
+# Color of the parts of the drawing that are not covered by any shape
+BACKGROUND_COLOR = (255, 255, 255)
+
+NUMBER = r"[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?"
+
+def is_svg(path: str) -> bool:
+    """True if the path is the one of an SVG file, from its extension"""
+    return path.lower().endswith(".svg")
+
+@dataclass
+class SvgLabelMap:
+    """Flat colors of an SVG file, rasterized"""
+    # Index of the color of each pixel, in the order of colors
+    labels: np.ndarray
+    # Hex representation of the colors, from the most to the least common
+    colors: List[str]
+    # Tags of the elements that could not be drawn (text, images...)
+    unsupported: Set[str] = field(default_factory=set)
+
+#region ############################## Parsing ##############################
+
+def local_name(tag: str) -> str:
+    """Tag of an element, without its namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+def parse_length(value: Optional[str], default: float = None) -> Optional[float]:
+    """Reads a length such as '210mm' or '12.5', in pixels. Percentages and unknown units give the default value."""
+    if value is None:
+        return default
+    match = re.fullmatch(r"\s*(" + NUMBER + r")\s*([a-z]*)\s*", value)
+    if match is None or match.group(2) not in UNITS_TO_PX:
+        return default
+    return float(match.group(1)) * UNITS_TO_PX[match.group(2)]
+
+def parse_numbers(value: Optional[str]) -> List[float]:
+    """Reads all the numbers of an attribute, such as the points of a polygon"""
+    return [float(n) for n in re.findall(NUMBER, value or "")]
+
+def parse_transform(value: Optional[str]) -> np.ndarray:
+    """Reads a transform attribute as a 3x3 affine matrix"""
+    matrix = np.eye(3)
+    for name, arguments in re.findall(r"(\w+)\s*\(([^)]*)\)", value or ""):
+        a = parse_numbers(arguments)
+        if name == "matrix" and len(a) == 6:
+            m = [[a[0], a[2], a[4]], [a[1], a[3], a[5]], [0, 0, 1]]
+        elif name == "translate" and a:
+            m = [[1, 0, a[0]], [0, 1, a[1] if len(a) > 1 else 0], [0, 0, 1]]
+        elif name == "scale" and a:
+            m = [[a[0], 0, 0], [0, a[1] if len(a) > 1 else a[0], 0], [0, 0, 1]]
+        elif name == "rotate" and a:
+            angle = math.radians(a[0])
+            cx, cy = (a[1], a[2]) if len(a) == 3 else (0, 0)
+            c, s = math.cos(angle), math.sin(angle)
+            m = [[c, -s, cx - c * cx + s * cy], [s, c, cy - s * cx - c * cy], [0, 0, 1]]
+        elif name == "skewX" and a:
+            m = [[1, math.tan(math.radians(a[0])), 0], [0, 1, 0], [0, 0, 1]]
+        elif name == "skewY" and a:
+            m = [[1, 0, 0], [math.tan(math.radians(a[0])), 1, 0], [0, 0, 1]]
+        else:
+            continue
+        matrix = matrix @ np.array(m, dtype=float)
+    return matrix
+
+def parse_style(element: ElementTree.Element) -> Dict[str, str]:
+    """Reads the presentation attributes of an element, the style attribute taking precedence over the attributes"""
+    style = {k: v for k, v in element.attrib.items() if k in ("fill", "stroke", "stroke-width", "opacity", "fill-opacity", "stroke-opacity", "display", "visibility")}
+    for declaration in element.get("style", "").split(";"):
+        if ":" in declaration:
+            key, value = declaration.split(":", 1)
+            style[key.strip()] = value.strip()
+    return style
+
+def parse_color(value: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """Reads a paint value as an RGB color. 'none', gradients and invalid colors give None."""
+    if value is None or value in ("none", "transparent") or value.startswith("url("):
+        return None
+    try:
+        return ImageColor.getrgb(value)[:3]
+    except ValueError:
+        return None
+
+def arc_to_points(start: np.ndarray, rx: float, ry: float, rotation: float, large_arc: bool, sweep: bool, end: np.ndarray) -> List[np.ndarray]:
+    """Approximates an elliptical arc of a path by points (SVG implementation notes, conversion to center parametrization)"""
+    if rx == 0 or ry == 0 or np.allclose(start, end):
+        return [end]
+    rx, ry = abs(rx), abs(ry)
+    phi = math.radians(rotation)
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+    dx, dy = (start - end) / 2
+    x1 = cos_phi * dx + sin_phi * dy
+    y1 = -sin_phi * dx + cos_phi * dy
+    # Radii too small to join the points are scaled up
+    scale = x1**2 / rx**2 + y1**2 / ry**2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    factor = math.sqrt(max(0., (rx**2 * ry**2 - rx**2 * y1**2 - ry**2 * x1**2) / (rx**2 * y1**2 + ry**2 * x1**2)))
+    if large_arc == sweep:
+        factor = -factor
+    cx1, cy1 = factor * rx * y1 / ry, -factor * ry * x1 / rx
+    center = np.array([cos_phi * cx1 - sin_phi * cy1, sin_phi * cx1 + cos_phi * cy1]) + (start + end) / 2
+    theta = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    delta = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    angles = theta + delta * np.arange(1, CURVE_SEGMENTS + 1) / CURVE_SEGMENTS
+    return [center + np.array([cos_phi * rx * math.cos(a) - sin_phi * ry * math.sin(a), sin_phi * rx * math.cos(a) + cos_phi * ry * math.sin(a)])
+            for a in angles]
+
+def bezier_points(control_points: List[np.ndarray]) -> List[np.ndarray]:
+    """Approximates a quadratic or cubic Bézier curve by points, the first control point excluded"""
+    t = np.arange(1, CURVE_SEGMENTS + 1)[:, None] / CURVE_SEGMENTS
+    degree = len(control_points) - 1
+    points = sum(math.comb(degree, i) * t**i * (1 - t)**(degree - i) * p for i, p in enumerate(control_points))
+    return list(points)
+
+def parse_path(d: str) -> List[np.ndarray]:
+    """Reads the data of a path as a list of subpaths, curves being approximated by segments
+
+    Args:
+        d (str): The d attribute of the path
+
+    Returns:
+        List[np.ndarray]: The points of each subpath, as arrays of shape (n, 2)
+    """
+    tokens = re.findall(r"[MmLlHhVvCcSsQqTtAaZz]|" + NUMBER, d or "")
+    subpaths, current = [], []
+    position, start = np.zeros(2), np.zeros(2)
+    last_control, last_command_upper, command, i = None, "", None, 0
+
+    def numbers(count):
+        nonlocal i
+        values = [float(v) for v in tokens[i:i + count]]
+        i += count
+        return values
+
+    def flag():
+        # Arc flags can be written without separators, such as "01" for two flags
+        nonlocal i
+        token = tokens[i]
+        if len(token) > 1 and token[0] in "01":
+            tokens[i] = token[1:]
+            return token[0] == "1"
+        i += 1
+        return float(token) != 0
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                if current:
+                    subpaths.append(np.array(current))
+                current, position, last_control = [], start.copy(), None
+                continue
+        elif command is None:
+            break
+        relative = command.islower()
+        origin = position if relative else np.zeros(2)
+        upper = command.upper()
+        if upper == "M":
+            if current:
+                subpaths.append(np.array(current))
+            position = origin + numbers(2)
+            start, current = position.copy(), [position]
+            # The next coordinates are implicit line commands
+            command = "l" if relative else "L"
+            last_control = None
+            continue
+        if not current:
+            current = [position]
+        if upper == "L":
+            points = [origin + numbers(2)]
+        elif upper == "H":
+            x, = numbers(1)
+            points = [np.array([x + (position[0] if relative else 0), position[1]])]
+        elif upper == "V":
+            y, = numbers(1)
+            points = [np.array([position[0], y + (position[1] if relative else 0)])]
+        elif upper == "C":
+            c1, c2, end = origin + numbers(2), origin + numbers(2), origin + numbers(2)
+            points, last_control = bezier_points([position, c1, c2, end]), c2
+        elif upper == "S":
+            c1 = 2 * position - last_control if last_control is not None and last_command_upper in "CS" else position
+            c2, end = origin + numbers(2), origin + numbers(2)
+            points, last_control = bezier_points([position, c1, c2, end]), c2
+        elif upper == "Q":
+            c, end = origin + numbers(2), origin + numbers(2)
+            points, last_control = bezier_points([position, c, end]), c
+        elif upper == "T":
+            c = 2 * position - last_control if last_control is not None and last_command_upper in "QT" else position
+            end = origin + numbers(2)
+            points, last_control = bezier_points([position, c, end]), c
+        elif upper == "A":
+            rx, ry, rotation = numbers(3)
+            large_arc, sweep = flag(), flag()
+            end = origin + numbers(2)
+            points = arc_to_points(position, rx, ry, rotation, large_arc, sweep, end)
+        else:
+            break
+        if upper not in "CSQT":
+            last_control = None
+        last_command_upper = upper
+        current.extend(points)
+        position = points[-1]
+    if current:
+        subpaths.append(np.array(current))
+    return [s for s in subpaths if len(s) > 1]
+
+def ellipse_points(cx: float, cy: float, rx: float, ry: float) -> np.ndarray:
+    """Approximates an ellipse by a polygon"""
+    angles = np.linspace(0, 2 * math.pi, 4 * CURVE_SEGMENTS, endpoint=False)
+    return np.stack([cx + rx * np.cos(angles), cy + ry * np.sin(angles)], axis=1)
+
+def element_shapes(element: ElementTree.Element) -> Tuple[List[np.ndarray], bool]:
+    """Reads the geometry of a shape element
+
+    Returns:
+        Tuple[List[np.ndarray], bool]: The points of each of its subpaths, and whether they are closed (False for lines and polylines)
+    """
+    tag = local_name(element.tag)
+    get = lambda name: parse_length(element.get(name), 0.)
+    if tag == "rect":
+        x, y, w, h = get("x"), get("y"), get("width"), get("height")
+        return ([np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]])] if w > 0 and h > 0 else []), True
+    if tag == "circle":
+        r = get("r")
+        return ([ellipse_points(get("cx"), get("cy"), r, r)] if r > 0 else []), True
+    if tag == "ellipse":
+        rx, ry = get("rx"), get("ry")
+        return ([ellipse_points(get("cx"), get("cy"), rx, ry)] if rx > 0 and ry > 0 else []), True
+    if tag in ("polygon", "polyline"):
+        points = parse_numbers(element.get("points"))
+        points = np.array(points[:len(points) // 2 * 2]).reshape(-1, 2)
+        return ([points] if len(points) > 1 else []), tag == "polygon"
+    if tag == "line":
+        return [np.array([[get("x1"), get("y1")], [get("x2"), get("y2")]])], False
+    if tag == "path":
+        return parse_path(element.get("d")), True
+    return [], True
+
+#endregion
+
+#region ############################## Rasterization ##############################
+
+def read_svg(svg_path: str) -> ElementTree.Element:
+    """Parses an SVG file
+
+    Raises:
+        IOError: The file cannot be read or is not an SVG file
+    """
+    try:
+        root = ElementTree.parse(svg_path).getroot()
+    except (ElementTree.ParseError, OSError) as e:
+        raise IOError(f"Cannot read SVG file '{svg_path}' : {e}") from e
+    if local_name(root.tag) != "svg":
+        raise IOError(f"'{svg_path}' is not an SVG file")
+    return root
+
+def svg_view(root: ElementTree.Element) -> Tuple[Tuple[float, float], Tuple[float, float, float, float]]:
+    """Size of the drawing in pixels, and its view box (the area of the user coordinates that is drawn)
+
+    Returns:
+        Tuple[Tuple[float, float], Tuple[float, float, float, float]]: (width, height), and (x, y, width, height) of the view box
+    """
+    view_box = parse_numbers(root.get("viewBox"))
+    width = parse_length(root.get("width"))
+    height = parse_length(root.get("height"))
+    if len(view_box) != 4 or view_box[2] <= 0 or view_box[3] <= 0:
+        view_box = [0., 0., width or 300., height or 150.]
+    if width is None and height is None:
+        width, height = view_box[2], view_box[3]
+    elif width is None:
+        width = height * view_box[2] / view_box[3]
+    elif height is None:
+        height = width * view_box[3] / view_box[2]
+    return (width, height), tuple(view_box)
+
+def read_svg_size(svg_path: str) -> Tuple[int, int]:
+    """Size at which an SVG file is displayed, in pixels
+
+    Returns:
+        Tuple[int, int]: Width and height
+    """
+    (width, height), _ = svg_view(read_svg(svg_path))
+    return max(1, int(round(width))), max(1, int(round(height)))
+
+def rasterize_svg(svg_path: str, size: Tuple[int, int]) -> SvgLabelMap:
+    """Draws the fills and strokes of an SVG file as a label map, with one label per declared color
+    The shapes are drawn without antialiasing, in the order of the document, so no color is made up at their edges.
+    Text, images, clips, masks, gradients and style sheets are not supported : text and images are listed in SvgLabelMap.unsupported,
+    and gradients are ignored. Shapes with holes are filled with the even-odd rule, whatever their fill-rule.
+
+    Args:
+        svg_path (str): Path to the SVG file
+        size (Tuple[int, int]): Width and height of the label map
+
+    Raises:
+        IOError: The file cannot be read or is not an SVG file
+
+    Returns:
+        SvgLabelMap: The labels and their colors
+    """
+    root = read_svg(svg_path)
+    _, (vx, vy, vw, vh) = svg_view(root)
+    width, height = size
+    # The view box is fitted to the label map and centered (preserveAspectRatio="xMidYMid meet")
+    scale = min(width / vw, height / vh)
+    view_transform = np.array([[scale, 0, (width - vw * scale) / 2 - vx * scale], [0, scale, (height - vh * scale) / 2 - vy * scale], [0, 0, 1]])
+
+    palette: Dict[Tuple[int, int, int], int] = {BACKGROUND_COLOR: 0}
+    labels = np.zeros((height, width), dtype=np.int32)
+    unsupported = set()
+
+    def label_of(color):
+        return palette.setdefault(color, len(palette))
+
+    def draw(element, transform, inherited):
+        tag = local_name(element.tag)
+        if tag in SKIPPED_TAGS:
+            return
+        style = dict(inherited)
+        style.update(parse_style(element))
+        if style.get("display") == "none" or style.get("visibility") == "hidden" or parse_length(style.get("opacity"), 1.) <= 0:
+            return
+        transform = transform @ parse_transform(element.get("transform"))
+        if tag in ("svg", "g", "a", "switch"):
+            for child in element:
+                draw(child, transform, style)
+            return
+        if tag in ("text", "image", "use", "foreignObject"):
+            unsupported.add(tag)
+            return
+        shapes, closed = element_shapes(element)
+        if not shapes:
+            return
+        # Fixed point coordinates in the label map
+        contours = [np.round(((transform[:2, :2] @ s.T).T + transform[:2, 2]) * (1 << SUBPIXEL_BITS)).astype(np.int32) for s in shapes]
+        fill = parse_color(style.get("fill", "black"))
+        if closed and fill is not None and parse_length(style.get("fill-opacity"), 1.) > 0:
+            cv2.fillPoly(labels, contours, label_of(fill), lineType=cv2.LINE_8, shift=SUBPIXEL_BITS)
+        stroke = parse_color(style.get("stroke"))
+        if stroke is not None and parse_length(style.get("stroke-opacity"), 1.) > 0:
+            # Width of the stroke in the label map, with the average scale of the transform
+            stroke_width = parse_length(style.get("stroke-width"), 1.) * math.sqrt(abs(np.linalg.det(transform[:2, :2])))
+            cv2.polylines(labels, contours, closed, label_of(stroke), thickness=max(1, int(round(stroke_width))), lineType=cv2.LINE_8, shift=SUBPIXEL_BITS)
+
+    draw(root, view_transform, {})
+
+    # The colors are ordered from the most to the least common, as those found in raster images
+    colors = sorted(palette, key=palette.get)
+    counts = np.bincount(labels.ravel(), minlength=len(colors))
+    order = [l for l in np.argsort(-counts, kind="stable") if counts[l] > 0]
+    relabel = np.zeros(len(colors), dtype=np.int32)
+    relabel[order] = np.arange(len(order))
+    return SvgLabelMap(labels=relabel[labels], colors=['#%02x%02x%02x' % colors[l] for l in order], unsupported=unsupported)
+
+def svg_raster_size(svg_size: Tuple[int, int], grid: Tuple[int, int] = None, max_pixels: int = None) -> Tuple[int, int]:
+    """Size at which an SVG file is rasterized : the resolution of the mesh if it is known, otherwise the size of the drawing
+
+    Args:
+        svg_size (Tuple[int, int]): Width and height of the drawing, in pixels
+        grid (Tuple[int, int], optional): Rows and columns of the grid of the mesh. Defaults to None.
+        max_pixels (int, optional): Maximum amount of pixels. Defaults to None (no limit).
+
+    Returns:
+        Tuple[int, int]: Width and height of the label map
+    """
+    width, height = (grid[1], grid[0]) if grid is not None else svg_size
+    if max_pixels is not None and width * height > max_pixels:
+        factor = math.sqrt(width * height / max_pixels)
+        width, height = width / factor, height / factor
+    return max(1, int(width)), max(1, int(height))
+
+#endregion
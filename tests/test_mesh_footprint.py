@@ -0,0 +1,42 @@
+"""
+Memory footprint of the generated mesh : regressions to double precision buffers or to extra copies of the mesh must fail
+Run from the root of the repository with : python -m pytest tests
+"""
+import os
+import sys
+import tracemalloc
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from stl_generation import MeshGenerationParameters, generate_grid_faces, generate_mesh
+
+# Memory allocated by generate_mesh, per vertex of the full resolution mesh : 12 bytes of vertex and 24 bytes of faces are kept
+MAX_RETAINED_BYTES_PER_VERTEX = 40
+# The temporary arrays of the generation come on top of it
+MAX_PEAK_BYTES_PER_VERTEX = 100
+
+@pytest.fixture
+def height_map() -> np.ndarray:
+    rows, columns = np.mgrid[0:300, 0:400]
+    return ((np.sin(columns / 17.) + np.cos(rows / 11.)) * 60 + 128).astype(np.uint8)
+
+def test_mesh_buffers_are_compact(height_map):
+    vertices, faces = generate_mesh(height_map, MeshGenerationParameters(simplification="none"))
+    assert vertices.dtype == np.float32 and faces.dtype == np.int32
+    assert vertices.shape[1] == 3 and faces.shape[1] == 3
+    assert vertices.flags.c_contiguous and faces.flags.c_contiguous
+    # Neither buffer is a view keeping a larger array alive
+    assert vertices.base is None and faces.base is None
+
+def test_mesh_generation_memory(height_map):
+    # The faces of a grid are cached : they must be generated, and counted, again
+    generate_grid_faces.cache_clear()
+    tracemalloc.start()
+    try:
+        vertices, faces = generate_mesh(height_map, MeshGenerationParameters(simplification="none"))
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert retained / len(vertices) <= MAX_RETAINED_BYTES_PER_VERTEX
+    assert peak / len(vertices) <= MAX_PEAK_BYTES_PER_VERTEX